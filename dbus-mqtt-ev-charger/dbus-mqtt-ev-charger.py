@@ -1,18 +1,32 @@
 #!/usr/bin/env python
 
 from gi.repository import GLib  # pyright: ignore[reportMissingImports]
+import dbus  # pyright: ignore[reportMissingImports]
 import platform
 import logging
 import sys
 import os
-from time import sleep, time
+from time import monotonic, perf_counter, sleep, time
+
+# start of the driver, used to log the startup times
+startup_time = time()
+
 import json
 import configparser  # for config/ini file
 import _thread
+import random
+import signal
+import threading
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate
+from math import isfinite
+from typing import Dict, NamedTuple, Optional, Tuple
 
 # import external packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext"))
 import paho.mqtt.client as mqtt
+from paho.mqtt.matcher import MQTTMatcher
 
 # import Victron Energy packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
@@ -20,6 +34,64 @@ from vedbus import VeDbusService  # noqa: E402
 from ve_utils import get_vrm_portal_id  # noqa: E402
 
 
+# formatting
+def _a(p, v):
+    return str("%.1f" % v) + "A"
+
+
+def _n(p, v):
+    return str("%i" % v)
+
+
+def _s(p, v):
+    return str("%s" % v)
+
+
+def _w(p, v):
+    return str("%i" % v) + "W"
+
+
+def _kwh(p, v):
+    return str("%.2f" % v) + "kWh"
+
+
+def _seconds(p, v):
+    return str("%.3f" % v) + "s"
+
+
+def _ms(p, v):
+    return str("%.1f" % v) + "ms"
+
+
+def _us(p, v):
+    return str("%.1f" % v) + "µs"
+
+
+def _per_second(p, v):
+    return str("%.1f" % v) + "/s"
+
+
+ev_charger_dict = {
+    # general data
+    "/Ac/Power": {"value": None, "textformat": _w},
+    "/Ac/L1/Power": {"value": None, "textformat": _w},
+    "/Ac/L2/Power": {"value": None, "textformat": _w},
+    "/Ac/L3/Power": {"value": None, "textformat": _w},
+    "/Ac/Energy/Forward": {"value": None, "textformat": _kwh},
+    "/Current": {"value": None, "textformat": _a},
+    "/MaxCurrent": {"value": None, "textformat": _a},
+    "/SetCurrent": {"value": None, "textformat": _a},
+    "/AutoStart": {"value": 0, "textformat": _n},
+    "/ChargingTime": {"value": None, "textformat": _n},
+    "/EnableDisplay": {"value": 1, "textformat": _n},
+    "/Mode": {"value": 1, "textformat": _n},
+    "/Model": {"value": None, "textformat": _s},
+    "/Role": {"value": None, "textformat": _n},
+    "/StartStop": {"value": 1, "textformat": _n},
+    "/Status": {"value": None, "textformat": _n},
+}
+
+
 # get values from config.ini file
 try:
     config_file = (os.path.dirname(os.path.realpath(__file__))) + "/config.ini"
@@ -45,79 +117,672 @@ except Exception:
     sys.exit()
 
 
-# Get logging level from config.ini
-# ERROR = shows errors only
-# WARNING = shows ERROR and warnings
-# INFO = shows WARNING and running functions
-# DEBUG = shows INFO and data/values
-if "DEFAULT" in config and "logging" in config["DEFAULT"]:
-    if config["DEFAULT"]["logging"] == "DEBUG":
-        logging.basicConfig(level=logging.DEBUG)
-    elif config["DEFAULT"]["logging"] == "INFO":
-        logging.basicConfig(level=logging.INFO)
-    elif config["DEFAULT"]["logging"] == "ERROR":
-        logging.basicConfig(level=logging.ERROR)
-    else:
-        logging.basicConfig(level=logging.WARNING)
-else:
-    logging.basicConfig(level=logging.WARNING)
+class PathFilter(NamedTuple):
+    """
+    Deadband and rounding filter for the values of a dbus path, configured in the [FILTER] section.
+    A new value is only published, if it differs by at least the absolute and the relative deadband from the last published value
+    """
 
+    absolute: float = 0.0
+    relative: float = 0.0
+    digits: Optional[int] = None
 
-# get timeout
-if "DEFAULT" in config and "timeout" in config["DEFAULT"]:
-    timeout = int(config["DEFAULT"]["timeout"])
-else:
-    timeout = 60
+    def round(self, value):
+        if self.digits is None:
+            return value
+        return round(value, self.digits) if self.digits > 0 else int(round(value, self.digits))
 
+    def is_significant(self, value, reference):
+        if reference is None or type(reference) is str:
+            return True
+        difference = abs(value - reference)
+        return difference >= self.absolute and difference >= self.relative * abs(reference)
 
-# set variables
-connected = 0
-last_changed = 0
-last_updated = 0
-charging_time = {"start": None, "calculate": False, "stopped_since": 0}
-STOP_CHARGING_COUNTER_AFTER = 300  # seconds
 
+def get_path_filters(config):
+    """
+    Get the filters from the [FILTER] section, e.g. "/Ac/Power = absolute=5 relative=0.01 round=0"
+    """
+    path_filters = {}
 
-# formatting
-def _a(p, v):
-    return str("%.1f" % v) + "A"
+    if "FILTER" not in config:
+        return path_filters
 
+    # the config keys are lower case
+    paths = {path.lower(): path for path in ev_charger_dict}
 
-def _n(p, v):
-    return str("%i" % v)
+    for key in config["FILTER"]:
+        # skip max_silence and settings inherited from [DEFAULT]
+        if not key.startswith("/"):
+            continue
 
+        if key not in paths:
+            raise ValueError('The filter for the path "%s" is not valid, the path is unknown' % key)
 
-def _s(p, v):
-    return str("%s" % v)
+        try:
+            options = dict(option.split("=", 1) for option in config["FILTER"][key].replace(",", " ").split())
+        except ValueError:
+            raise ValueError('The filter "%s" for the path "%s" is not valid, use e.g. "absolute=5 relative=0.01 round=0"' % (config["FILTER"][key], paths[key]))
+
+        for option in options:
+            if option not in ("absolute", "relative", "round"):
+                raise ValueError('The filter option "%s" for the path "%s" is not valid, use "absolute", "relative" or "round"' % (option, paths[key]))
+
+        path_filters[paths[key]] = PathFilter(
+            absolute=get_number(options, "absolute", 0, float, minimum=0),
+            relative=get_number(options, "relative", 0, float, minimum=0),
+            digits=int(options["round"]) if "round" in options else None,
+        )
 
+    return path_filters
+
+
+# formats of the payload, which can be configured with payload_format
+PAYLOAD_FORMATS = ("json", "msgpack", "cbor", "auto")
+
+
+def check_payload_format(payload_format):
+    """
+    Check the payload_format of an EV charger or of the discovery. A format, of which the decoder isn't installed, falls back to json
+    """
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError('The payload_format "%s" is not valid, use "%s"' % (payload_format, '", "'.join(PAYLOAD_FORMATS)))
+
+    return payload_format
+
+
+class DiscoverySettings(NamedTuple):
+    """
+    Settings of the [DISCOVERY] section. Discovered EV chargers take device_name, position, voltage and phases from [DEFAULT]
+    """
+
+    topic: str
+    device_instance_first: int
+    device_instance_last: int
+    remove_after: int
+    payload_format: str
+    command_topic: str
+    device_name: str
+    position: int
+    voltage: int
+    phases: int
+
+
+def get_discovery_settings(config):
+    """
+    Get the settings of the [DISCOVERY] section, None if the section doesn't exist
+    """
+    if "DISCOVERY" not in config:
+        return None
+
+    default = config["DEFAULT"]
+    section = config["DISCOVERY"]
+    device_instance_first = get_number(section, "device_instance_first", 200, minimum=0)
+
+    # the driver would receive its own commands as values of the EV charger
+    if section.get("command_topic", "") == "{topic}":
+        raise ValueError('The command_topic "{topic}" has to differ from the topic of the EV charger')
+
+    return DiscoverySettings(
+        topic=section["topic"],
+        device_instance_first=device_instance_first,
+        device_instance_last=get_number(section, "device_instance_last", 219, minimum=device_instance_first),
+        # get the seconds after which a discovered EV charger, which doesn't publish anymore, is removed
+        # value to keep discovered EV chargers until the next restart: 0
+        remove_after=get_number(section, "remove_after", 300, minimum=0),
+        payload_format=check_payload_format(section.get("payload_format", "json")),
+        command_topic=section.get("command_topic", ""),
+        device_name=default["device_name"],
+        position=get_number(default, "position", 0, minimum=0, maximum=1),
+        voltage=get_number(default, "voltage", 230, minimum=1),
+        phases=get_number(default, "phases", 0, minimum=0, maximum=3),
+    )
 
-def _w(p, v):
-    return str("%i" % v) + "W"
 
+class ChargerSettings(NamedTuple):
+    """
+    Settings of one EV charger from an [EV_CHARGER_<n>] section or the [MQTT] section
+    """
+
+    topic: str
+    device_instance: int
+    device_name: str
+    position: int
+    voltage: int
+    phases: int
+    payload_format: str
+    topic_mode: str
+    command_topic: str
+
+
+class Settings(NamedTuple):
+    """
+    Settings parsed once from the config.ini. The settings in RESTART_SETTINGS are only applied on a restart of the driver,
+    all others are applied again when the config.ini is reloaded
+    """
+
+    logging_level: int
+    timeout: int
+    timeout_mode: str
+    phase_timeout: int
+    chargers: Tuple[ChargerSettings, ...]
+    discovery: Optional[DiscoverySettings]
+    log_suppress_window: int
+    json_decoder: str
+    dbus_batch_signals: bool
+    mqtt_broker_address: str
+    mqtt_broker_port: int
+    mqtt_tls_enabled: bool
+    mqtt_tls_path_to_ca: str
+    mqtt_tls_insecure: bool
+    mqtt_username: str
+    mqtt_password: str
+    mqtt_client_id_instance: int
+    retained_messages: bool
+    mqtt_protocol: int
+    mqtt_qos: int
+    persistent_session: bool
+    session_expiry: int
+    topic_alias_maximum: int
+    receive_maximum: int
+    message_expiry: int
+    message_max_age: int
+    reconnect_delay_min: float
+    reconnect_delay_max: float
+    energy_calculation: bool
+    energy_save_interval: int
+    command_coalesce_time: int
+    command_timeout: int
+    metrics_listen: str
+    stats_interval: int
+    filter_max_silence: int
+    path_filters: Dict[str, PathFilter]
+    config_reload_on_change: bool
+
+
+# settings, which are used to connect to the broker or to create the dbus services and the metrics server
+RESTART_SETTINGS = (
+    "discovery",
+    "json_decoder",
+    "mqtt_broker_address",
+    "mqtt_broker_port",
+    "mqtt_tls_enabled",
+    "mqtt_tls_path_to_ca",
+    "mqtt_tls_insecure",
+    "mqtt_username",
+    "mqtt_password",
+    "mqtt_client_id_instance",
+    "mqtt_protocol",
+    "mqtt_qos",
+    "persistent_session",
+    "session_expiry",
+    "topic_alias_maximum",
+    "receive_maximum",
+    "reconnect_delay_min",
+    "reconnect_delay_max",
+    "energy_calculation",
+    "metrics_listen",
+    "stats_interval",
+    "config_reload_on_change",
+)
+
+
+def get_number(section, option, default, number_type=int, minimum=None, maximum=None):
+    """
+    Get a number from a section of the config.ini and check, that it's within minimum and maximum
+    """
+    value = number_type(section.get(option, str(default)))
+
+    if minimum is not None and maximum is not None and not minimum <= value <= maximum:
+        raise ValueError('The %s "%s" has to be between %s and %s' % (option, value, minimum, maximum))
+    if minimum is not None and value < minimum:
+        raise ValueError('The %s "%s" has to be %s or greater' % (option, value, minimum))
+
+    return value
+
+
+def get_charger_settings(config):
+    """
+    Get the settings for each [EV_CHARGER_<n>] section in the config.ini. Missing settings are taken from [DEFAULT].
+    Without such sections and without discovery a single EV charger is configured by the [DEFAULT] and [MQTT] sections
+    """
+    sections = [section for section in config.sections() if section.startswith("EV_CHARGER")]
+
+    # the [MQTT] section inherits all settings from [DEFAULT] and contains the topic
+    if not sections and "DISCOVERY" not in config:
+        sections = ["MQTT"]
+
+    chargers_settings = []
+    for section_name in sections:
+        section = config[section_name]
+        chargers_settings.append(
+            ChargerSettings(
+                topic=section["topic"],
+                device_instance=int(section["device_instance"]),
+                device_name=section["device_name"],
+                position=get_number(section, "position", 0, minimum=0, maximum=1),
+                voltage=get_number(section, "voltage", 230, minimum=1),
+                phases=get_number(section, "phases", 0, minimum=0, maximum=3),
+                payload_format=check_payload_format(section.get("payload_format", "json")),
+                topic_mode=section.get("topic_mode", "json"),
+                command_topic=section.get("command_topic", "").replace("{topic}", section["topic"]),
+            )
+        )
 
-def _kwh(p, v):
-    return str("%.2f" % v) + "kWh"
+    for charger_settings in chargers_settings:
+        if charger_settings.topic_mode not in ("json", "flat"):
+            raise ValueError('The topic_mode "%s" is not valid, use "json" or "flat"' % charger_settings.topic_mode)
+        # the driver would receive its own commands as values of the EV charger
+        if charger_settings.command_topic == charger_settings.topic:
+            raise ValueError('The command_topic "%s" has to differ from the topic of the EV charger' % charger_settings.command_topic)
+
+    # each charger needs an own dbus service name and topic
+    if len(set(charger_settings.device_instance for charger_settings in chargers_settings)) != len(chargers_settings):
+        raise ValueError("The device_instance of each EV charger has to be unique")
+    if len(set(charger_settings.topic for charger_settings in chargers_settings)) != len(chargers_settings):
+        raise ValueError("The topic of each EV charger has to be unique")
+
+    return tuple(chargers_settings)
+
+
+def get_settings(config):
+    """
+    Parse and validate the settings of the config.ini
+    """
+    default = config["DEFAULT"]
+    mqtt_section = config["MQTT"] if "MQTT" in config else default
+    filter_section = config["FILTER"] if "FILTER" in config else {}
+
+    # Get logging level from config.ini
+    # ERROR = shows errors only
+    # WARNING = shows ERROR and warnings
+    # INFO = shows WARNING and running functions
+    # DEBUG = shows INFO and data/values
+    logging_levels = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+    logging_level = logging_levels.get(default.get("logging", "WARNING"), logging.WARNING)
+
+    # get timeout
+    timeout = get_number(default, "timeout", 60, minimum=0)
+
+    # get what happens, if the timeout is exceeded
+    # exit = stop the driver, it's restarted by the service
+    # stale = keep the driver running, set /Connected to 0 and invalidate the measured values until a new message is received
+    timeout_mode = default.get("timeout_mode", "exit")
+    if timeout_mode not in ("exit", "stale"):
+        raise ValueError('The timeout_mode "%s" is not valid, use "exit" or "stale"' % timeout_mode)
+
+    # get the MQTT protocol version
+    # 3.1.1 = MQTT 3.1.1
+    # 5 = MQTT 5.0
+    mqtt_protocols = {"3.1.1": mqtt.MQTTv311, "5": mqtt.MQTTv5}
+    mqtt_protocol = mqtt_section.get("protocol", "3.1.1")
+    if mqtt_protocol not in mqtt_protocols:
+        raise ValueError('The MQTT protocol "%s" is not valid, use "3.1.1" or "5"' % mqtt_protocol)
+
+    # get the minimum and maximum seconds to wait before reconnecting to the MQTT broker
+    reconnect_delay_min = get_number(mqtt_section, "reconnect_delay_min", 1, float)
+    if reconnect_delay_min <= 0:
+        raise ValueError('The reconnect_delay_min "%s" has to be greater than 0' % reconnect_delay_min)
+    reconnect_delay_max = get_number(mqtt_section, "reconnect_delay_max", 120, float, minimum=reconnect_delay_min)
+
+    return Settings(
+        logging_level=logging_level,
+        timeout=timeout,
+        timeout_mode=timeout_mode,
+        # get the seconds after which a phase power not received anymore in the flat topic mode is not used for the calculated values
+        # value to use the phase powers until the next restart: 0
+        phase_timeout=get_number(default, "phase_timeout", 30, minimum=0),
+        chargers=get_charger_settings(config),
+        discovery=get_discovery_settings(config),
+        # get the seconds in which the same message from the MQTT payload processing is logged only once
+        # value to log all messages: 0
+        log_suppress_window=get_number(default, "log_suppress_window", 60, minimum=0),
+        # get JSON decoder
+        # auto = use the fastest available decoder
+        # json = Python standard library
+        # orjson, ujson = use this decoder, if installed
+        json_decoder=default.get("json_decoder", "auto"),
+        # get if changed values are sent as one ItemsChanged signal per update instead of one PropertiesChanged signal per path
+        dbus_batch_signals=default.get("dbus_batch_signals", "1") == "1",
+        # get the address and port of the MQTT broker
+        mqtt_broker_address=mqtt_section["broker_address"],
+        mqtt_broker_port=get_number(mqtt_section, "broker_port", 1883, minimum=1, maximum=65535),
+        # get if TLS is used, with the Certificate Authority certificate file or the system CAs, if empty
+        mqtt_tls_enabled=mqtt_section.get("tls_enabled", "0") == "1",
+        mqtt_tls_path_to_ca=mqtt_section.get("tls_path_to_ca", ""),
+        # get if the verification of the server hostname in the server certificate is disabled
+        mqtt_tls_insecure=mqtt_section.get("tls_insecure", "0") == "1",
+        # get the username and password, they are only used if both are set
+        mqtt_username=mqtt_section.get("username", ""),
+        mqtt_password=mqtt_section.get("password", ""),
+        # get the device instance in the client ID, which has to be the same on every start to resume a persistent session
+        mqtt_client_id_instance=int(default["device_instance"]),
+        # get if retained messages are used, then the first data is received right after connecting to the broker
+        retained_messages=mqtt_section.get("retained_messages", "1") == "1",
+        mqtt_protocol=mqtt_protocols[mqtt_protocol],
+        # get the QoS used to subscribe to the topics
+        mqtt_qos=get_number(mqtt_section, "qos", 0, minimum=0, maximum=2),
+        # get if the broker keeps the session while the driver is disconnected, then QoS 1 and 2 messages are not lost
+        persistent_session=mqtt_section.get("persistent_session", "0") == "1",
+        # get the seconds the broker keeps the persistent session after the connection was lost, only used by MQTT 5.0
+        session_expiry=get_number(mqtt_section, "session_expiry", 3600, minimum=0),
+        # get the number of topic aliases the broker can use, to send only a number instead of the topic. Only used by MQTT 5.0
+        topic_alias_maximum=get_number(mqtt_section, "topic_alias_maximum", 16, minimum=0, maximum=65535),
+        # get the number of QoS 1 and 2 messages the broker sends without waiting for the acknowledgement. Only used by MQTT 5.0
+        receive_maximum=get_number(mqtt_section, "receive_maximum", 0, minimum=0, maximum=65535),
+        # get the Message Expiry Interval in seconds, with which the EV charger publishes, and the maximum seconds a message
+        # may have waited at the broker. The broker reduces the interval by the waited time. Only used by MQTT 5.0
+        message_expiry=get_number(mqtt_section, "message_expiry", 0, minimum=0),
+        message_max_age=get_number(mqtt_section, "message_max_age", 0, minimum=0),
+        reconnect_delay_min=reconnect_delay_min,
+        reconnect_delay_max=reconnect_delay_max,
+        # get if the energy is calculated from the power, when the EV charger doesn't send /Ac/Energy/Forward
+        energy_calculation=default.get("energy_calculation", "1") == "1",
+        # get the seconds after which the calculated energy is saved to the disk
+        energy_save_interval=get_number(default, "energy_save_interval", 900, minimum=0),
+        # get the milliseconds in which values written on the dbus are collected, before they are published to the command topic.
+        # While a slider is dragged only the last value is sent
+        command_coalesce_time=get_number(default, "command_coalesce_time", 300, minimum=0),
+        # get the seconds in which the EV charger has to send back the value of a command, else the dbus shows the value of the EV charger again
+        command_timeout=get_number(default, "command_timeout", 10, minimum=0),
+        # get where the metrics are served in the Prometheus text format
+        # <host>:<port> = TCP port, e.g. 127.0.0.1:9101
+        # <path> = Unix socket, e.g. /run/dbus-mqtt-ev-charger.sock
+        # empty = disabled
+        metrics_listen=default.get("metrics_listen", ""),
+        # get the seconds after which the driver statistics under /Mgmt/Stats are updated on the dbus
+        # value to disable the statistics: 0
+        stats_interval=get_number(default, "stats_interval", 10, minimum=0),
+        # get the seconds after which a filtered value is published, even if it's within the deadband
+        filter_max_silence=get_number(filter_section, "max_silence", 60, minimum=0),
+        path_filters=get_path_filters(config),
+        # get if the config.ini is reloaded when it's changed
+        config_reload_on_change=default.get("config_reload_on_change", "1") == "1",
+    )
 
 
-ev_charger_dict = {
-    # general data
-    "/Ac/Power": {"value": None, "textformat": _w},
-    "/Ac/L1/Power": {"value": None, "textformat": _w},
-    "/Ac/L2/Power": {"value": None, "textformat": _w},
-    "/Ac/L3/Power": {"value": None, "textformat": _w},
-    "/Ac/Energy/Forward": {"value": None, "textformat": _kwh},
-    "/Current": {"value": None, "textformat": _a},
-    "/MaxCurrent": {"value": None, "textformat": _a},
-    "/SetCurrent": {"value": None, "textformat": _a},
-    "/AutoStart": {"value": 0, "textformat": _n},
-    "/ChargingTime": {"value": None, "textformat": _n},
-    "/EnableDisplay": {"value": 1, "textformat": _n},
-    "/Mode": {"value": 1, "textformat": _n},
-    "/Model": {"value": None, "textformat": _s},
-    "/Role": {"value": None, "textformat": _n},
-    "/StartStop": {"value": 1, "textformat": _n},
-    "/Status": {"value": None, "textformat": _n},
-}
+try:
+    settings = get_settings(config)
+
+except Exception:
+    exception_type, exception_object, exception_traceback = sys.exc_info()
+    file = exception_traceback.tb_frame.f_code.co_filename
+    line = exception_traceback.tb_lineno
+    print(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+    print("ERROR:The driver restarts in 60 seconds.")
+    sleep(60)
+    sys.exit()
+
+logging.basicConfig(level=settings.logging_level)
+
+
+class RateLimitedLogger:
+    """
+    Logs a message only once per window for each key, e.g. for each invalid key of a payload.
+    Suppressed messages are counted and summarized with the first message of the key after the window.
+    The message is formatted by logging, so only if it's logged
+    """
+
+    # maximum number of tracked keys, to limit the memory used by payloads with changing invalid keys
+    MAX_KEYS = 1000
+
+    def __init__(self, window):
+        self.window = window
+        # key -> [time last logged, number of suppressed messages]
+        self.keys = {}
+
+    def log(self, level, key, msg, *args):
+        if not logging.root.isEnabledFor(level):
+            return
+
+        if self.window == 0:
+            logging.log(level, msg, *args)
+            return
+
+        now = time()
+        entry = self.keys.get(key)
+
+        if entry is not None and now - entry[0] < self.window:
+            entry[1] += 1
+            return
+
+        if entry is not None and entry[1] > 0:
+            logging.log(level, msg + " (%i similar messages suppressed in the last %i seconds)", *args, entry[1], now - entry[0])
+        else:
+            logging.log(level, msg, *args)
+
+        if len(self.keys) >= self.MAX_KEYS and key not in self.keys:
+            self.keys.clear()
+
+        self.keys[key] = [now, 0]
+
+    def warning(self, key, msg, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+    def error(self, key, msg, *args):
+        self.log(logging.ERROR, key, msg, *args)
+
+
+class LatencyHistogram:
+    """
+    Cumulative histogram of measured latencies in seconds. The percentiles are calculated
+    from the last samples only, so that they follow changes of the latency
+    """
+
+    def __init__(self, buckets, samples=1000):
+        # upper bounds of the buckets in seconds, the last bucket counts all values
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        # last samples for the percentiles, None = no percentiles needed
+        self.samples = deque(maxlen=samples) if samples != 0 else None
+
+    def observe(self, value):
+        # each histogram is written by one thread only and the readers copy the values at once,
+        # so no lock is needed on the ingest path
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        if self.samples is not None:
+            self.samples.append(value)
+
+    def snapshot(self):
+        """
+        Get the (upper bound, cumulative count) of each bucket, the sum and the count
+        """
+        buckets = list(zip(self.buckets, accumulate(list(self.counts))))
+
+        # the count of the last bucket matches the bucket counts, even if a value was observed meanwhile
+        return buckets, self.sum, buckets[-1][1]
+
+    def percentiles(self, *percents):
+        """
+        Get the percentiles of the last samples with the nearest-rank method, None without samples
+        """
+        samples = sorted(list(self.samples))
+
+        if not samples:
+            return tuple(None for percent in percents)
+
+        return tuple(samples[max(int(len(samples) * percent / 100 + 0.5) - 1, 0)] for percent in percents)
+
+
+log_limited = RateLimitedLogger(settings.log_suppress_window)
+
+
+# sample payload of the README, decoded by the benchmarks in tests
+JSON_SAMPLE_PAYLOAD = (
+    b'{"Ac": {"Power": 12000.0, "L1": {"Power": 4000.0}, "L2": {"Power": 4000.0}, "L3": {"Power": 4000.0}, "Energy": {"Forward": 342.4}},'
+    b' "Current": 17.39, "MaxCurrent": 32, "SetCurrent": 16, "AutoStart": 1, "ChargingTime": 63, "EnableDisplay": 1, "Mode": 1, "StartStop": 1, "Status": 1}'
+)
+
+
+def get_json_decoders():
+    """
+    Get the available JSON decoders. orjson and ujson are optional and used, if installed
+    """
+    decoders = {"json": json.loads}
+
+    try:
+        import orjson  # pyright: ignore[reportMissingImports]
+
+        decoders["orjson"] = orjson.loads
+    except ImportError:
+        pass
+
+    try:
+        import ujson  # pyright: ignore[reportMissingImports]
+
+        decoders["ujson"] = ujson.loads
+    except ImportError:
+        pass
+
+    return decoders
+
+
+# JSON decoders used with "auto", the fastest first. Measured with tests/benchmark_payload_formats.py
+JSON_DECODER_PREFERENCE = ("orjson", "ujson", "json")
+
+
+def select_json_decoder(name):
+    """
+    Get the JSON decoder by name. With "auto" the first available decoder of JSON_DECODER_PREFERENCE is used,
+    so the startup isn't slowed down by measuring the decoders
+    """
+    decoders = get_json_decoders()
+
+    if name != "auto":
+        if name in decoders:
+            return name, decoders[name]
+
+        logging.warning('JSON decoder "%s" is not available, using "json" instead' % name)
+        return "json", decoders["json"]
+
+    name = next(decoder_name for decoder_name in JSON_DECODER_PREFERENCE if decoder_name in decoders)
+    return name, decoders[name]
+
+
+json_decoder_name, json_loads = select_json_decoder(settings.json_decoder)
+logging.info('Using JSON decoder "%s"' % json_decoder_name)
+
+
+def get_payload_decoders():
+    """
+    Get the available payload decoders. MessagePack (msgpack) and CBOR (cbor2) are optional and used, if installed
+    """
+    decoders = {"json": json_loads}
+
+    try:
+        import msgpack  # pyright: ignore[reportMissingImports]
+
+        decoders["msgpack"] = msgpack.unpackb
+    except ImportError:
+        pass
+
+    try:
+        import cbor2  # pyright: ignore[reportMissingImports]
+
+        def cbor_loads(payload):
+            # raise a ValueError like the other decoders
+            try:
+                return cbor2.loads(payload)
+            except cbor2.CBORError as e:
+                raise ValueError(e)
+
+        decoders["cbor"] = cbor_loads
+    except ImportError:
+        pass
+
+    return decoders
+
+
+payload_decoders = get_payload_decoders()
+
+
+def decode_payload_auto(payload):
+    """
+    Detect the payload format by the first byte, since all formats have to start with a map:
+    MessagePack fixmap/map16/map32 = 0x80-0x8f/0xde/0xdf, CBOR map = 0xa0-0xbf, else JSON
+    """
+    first_byte = payload[0]
+
+    if 0x80 <= first_byte <= 0x8F or first_byte == 0xDE or first_byte == 0xDF:
+        payload_format = "msgpack"
+    elif 0xA0 <= first_byte <= 0xBF:
+        payload_format = "cbor"
+    else:
+        payload_format = "json"
+
+    if payload_format not in payload_decoders:
+        raise ValueError("Received %s payload, but the decoder is not installed" % payload_format)
+
+    return payload_decoders[payload_format](payload)
+
+
+def get_payload_decoder(payload_format):
+    """
+    Get the decoder for the payload format configured for a topic
+    """
+    if payload_format == "auto":
+        return decode_payload_auto
+
+    if payload_format not in payload_decoders:
+        logging.error('Payload format "%s" is not available, using "json" instead. Is the decoder installed?' % payload_format)
+        return payload_decoders["json"]
+
+    return payload_decoders[payload_format]
+
+
+# gaps between two messages longer than the timeout are not integrated, since the power in between is unknown
+ENERGY_MAX_GAP_WITHOUT_TIMEOUT = 300  # seconds
+
+# directory where the calculated energy and the cached VRM portal ID are saved, it's kept by the download.sh on updates
+data_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+
+# set variables
+connected = 0
+STOP_CHARGING_COUNTER_AFTER = 300  # seconds
+
+# settings, which are published to the command topic of the EV charger when written on the dbus, e.g. by the GUI
+COMMAND_PATHS = ("/AutoStart", "/EnableDisplay", "/MaxCurrent", "/Mode", "/SetCurrent", "/StartStop")
+
+# upper bounds in seconds of the histogram buckets of the time from a write on the dbus until the EV charger sent back the value
+COMMAND_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# dbus paths of the 50th, 95th and 99th percentile of the command latency
+COMMAND_LATENCY_PATHS = ("/Mgmt/Commands/Latency/P50", "/Mgmt/Commands/Latency/P95", "/Mgmt/Commands/Latency/P99")
+
+# upper bounds in seconds of the histogram buckets of the time from receiving a message until its values were written to the dbus
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+# upper bounds in seconds of the histogram buckets of the age of the data from the Timestamp sent by the EV charger
+SOURCE_AGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# number of the last samples from which /Latency and /Mgmt/SourceAge are calculated
+LATENCY_SAMPLES = 100
+
+# upper bounds in seconds of the histogram buckets of the time to decode a payload
+DECODE_TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025)
+# upper bounds in seconds of the histogram buckets of the delay of the GLib main loop
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+# measured values, which are invalidated after the timeout in the stale timeout mode
+STALE_PATHS = ("/Ac/Power", "/Ac/L1/Power", "/Ac/L2/Power", "/Ac/L3/Power", "/Current", "/ChargingTime")
+
+# EV chargers handled by this driver and the topic routing to them
+chargers = []
+chargers_matcher = MQTTMatcher()
+# protects chargers and chargers_matcher, since discovered EV chargers are added and removed at runtime
+chargers_lock = threading.Lock()
+# creates EV chargers for new topics on the discovery topic, if enabled
+discovery = None
+# set, when any EV charger received its first data, main() waits for it
+chargers_first_data = threading.Event()
+# MQTT client, needed to subscribe to changed topics after reloading the config.ini
+mqtt_client = None
+# topics of the MQTT 5.0 topic aliases set by the broker, only valid for the current connection
+topic_aliases = {}
+mqtt_stats = {"messages_received": 0, "bytes_received": 0, "messages_dropped_max_age": 0}
+# file monitor of the config.ini and the pending reload after it changed
+config_monitor = None
+config_reload_source = None
 
 
 """
@@ -181,25 +846,688 @@ com.victronenergy.evcharger
 """
 
 
+# types accepted as D-Bus values from the JSON payload
+VALID_VALUE_TYPES = (str, int, float)
+
+
+class JsonBranch(dict):
+    """
+    Branch of the compiled key tree, which knows its own dbus path prefix, e.g. "/Ac/L1"
+    """
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+
+def compile_json_paths(paths):
+    """
+    Compile the D-Bus paths into a tree of JSON keys, which is walked together with the received payload.
+    Branches are JsonBranch dicts, leafs are tuples of (dbus path, dict holding the value), e.g.
+    {"Ac": {"Power": ("/Ac/Power", values["/Ac/Power"]), ...}, ...}
+    """
+    tree = JsonBranch("")
+    for path, data in paths.items():
+        *branches, leaf = path[1:].split("/")
+        node = tree
+        for key in branches:
+            if key not in node:
+                node[key] = JsonBranch(node.path + "/" + key)
+            node = node[key]
+        node[leaf] = (path, data)
+    return tree
+
+
+def walk_json_paths(schema, node, received, invalid):
+    """
+    Walk a node of the decoded JSON payload together with its branch of the key tree. Appends (leaf, value) of the values,
+    which differ from the stored ones, to received and ("dbus path prefix/key", value) of the unknown keys to invalid.
+    Nothing else is done per key, the values are checked and stored by parse_json_payload afterwards
+    """
+    for key, data in node.items():
+        entry = schema.get(key)
+
+        if entry.__class__ is tuple:
+            # null equals the initial value, but is no valid value
+            if entry[1]["value"] != data or data is None:
+                received.append((entry, data))
+
+        elif entry.__class__ is JsonBranch and data.__class__ is dict:
+            walk_json_paths(entry, data, received, invalid)
+
+        else:
+            invalid.append((schema.path + "/" + key, data))
+
+
+PHASE_POWER_PATHS = ("/Ac/L1/Power", "/Ac/L2/Power", "/Ac/L3/Power")
+
+
+def derive_power(charger):
+    """
+    /Ac/Power as sum of the phase powers provided by the EV charger
+    """
+    powers = [charger.values[path]["value"] for path in charger.phase_paths_provided if type(charger.values[path]["value"]) in (int, float)]
+    return sum(powers) if powers else None
+
+
+def derive_current(charger):
+    """
+    /Current from /Ac/Power, the voltage and the number of phases. If the number of phases is not configured,
+    it's the number of phases with a power value provided by the EV charger
+    """
+    power = charger.values["/Ac/Power"]["value"]
+
+    if type(power) not in (int, float):
+        return None
+
+    phases = charger.phases or sum(1 for path in charger.phase_paths_provided if charger.values[path]["value"] is not None)
+    # more than 3 phases are not possible, less than 1 phase means that the phases are not sent
+    phases = min(max(phases, 1), 3)
+
+    return round((power / charger.voltage) / phases, 3) if power != 0 else 0
+
+
+# values calculated from other values, if the EV charger does not send them
+# derived path: (input paths, function returning the value or None, if it can't be calculated)
+DERIVED_PATHS = {
+    "/Ac/Power": (PHASE_POWER_PATHS, derive_power),
+    "/Current": (("/Ac/Power",) + PHASE_POWER_PATHS, derive_current),
+}
+
+
+def sort_derived_paths(derived_paths):
+    """
+    Sort the derived paths, so that each one is calculated after the derived paths it depends on.
+    Returns a list of (derived path, input paths, function)
+    """
+    order = []
+
+    def visit(path, parents):
+        if path in order or path not in derived_paths:
+            return
+        if path in parents:
+            raise ValueError("Circular dependency of the derived path %s" % path)
+        for input_path in derived_paths[path][0]:
+            visit(input_path, parents + (path,))
+        order.append(path)
+
+    for path in derived_paths:
+        visit(path, ())
+
+    return [(path,) + derived_paths[path] for path in order]
+
+
+# sorted once at startup, since the derived paths never change
+derived_paths_sorted = sort_derived_paths(DERIVED_PATHS)
+
+# JSON keys of the derived paths, the calculated energy and the phase powers, to check if the EV charger sent them, e.g. "/Ac/Power" -> ("Ac", "Power")
+derived_json_keys = [(path, tuple(path[1:].split("/"))) for path in list(DERIVED_PATHS) + ["/Ac/Energy/Forward"] + list(PHASE_POWER_PATHS)]
+
+
+def get_derived_paths_in_payload(jsonpayload):
+    """
+    Get the derived paths, /Ac/Energy/Forward and the phase powers, which are contained in the JSON payload
+    """
+    paths = set()
+
+    for path, keys in derived_json_keys:
+        node = jsonpayload
+        for key in keys:
+            if type(node) is not dict or key not in node:
+                break
+            node = node[key]
+        else:
+            paths.add(path)
+
+    return paths
+
+
+def get_energy_file(device_instance):
+    """
+    Get the file where the calculated energy of the device instance is saved
+    """
+    return os.path.join(data_directory, "energy_%i.json" % device_instance)
+
+
+def load_energy(device_instance, topic):
+    """
+    Load the calculated energy in kWh saved for the device instance. Returns 0, if nothing was saved for the topic
+    """
+    try:
+        with open(get_energy_file(device_instance), "r") as file:
+            data = json.load(file)
+
+        if data["topic"] == topic:
+            return float(data["energy_forward"])
+
+    except FileNotFoundError:
+        pass
+
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning("Could not load the calculated energy of device instance %i: %s" % (device_instance, e))
+
+    return 0.0
+
+
+class EvCharger:
+    """
+    State of one EV charger. It's filled by on_message in the MQTT network thread
+    and published by DbusMqttEvChargerService in the GLib main loop
+    """
+
+    def __init__(self, topic, device_instance, device_name, position, voltage, phases=0, payload_format="json", topic_mode="json", command_topic="", discovered=False):
+        self.topic = topic
+        self.decode_payload = get_payload_decoder(payload_format)
+        # json = all values in one payload on the topic, flat = one value per sub topic, e.g. <topic>/Ac/Power
+        self.topic_mode = topic_mode
+        self.subscription_topic = topic + "/#" if topic_mode == "flat" else topic
+        self.device_instance = device_instance
+        self.device_name = device_name
+        self.position = position
+        self.voltage = voltage
+        # number of phases used to calculate the current, 0 = number of phases with a power value
+        self.phases = phases
+        # discovered EV chargers are removed when stale, instead of stopping the driver
+        self.discovered = discovered
+        # topic to which the settings written on the dbus are published, empty = the settings are only shown on the dbus
+        self.command_topic = command_topic
+
+        # own copy of the ev_charger_dict values
+        self.values = {path: dict(data) for path, data in ev_charger_dict.items()}
+        # the filters are looked up when a value changed, so the tree doesn't change on a reload of the config.ini
+        self.json_path_table = compile_json_paths(self.values)
+        # sub topic to (dbus path, dict holding the value), e.g. "Ac/Power" -> ("/Ac/Power", values["/Ac/Power"])
+        self.flat_topic_table = {path[1:]: (path, data) for path, data in self.values.items()}
+        # path -> monotonic receive time of the paths received in flat topic mode, needed to know which values have to be calculated
+        self.flat_paths_received = {}
+        # phase powers of the last payload, the EV charger can switch the phases while charging
+        self.phase_paths_provided = ()
+        # paths which changed since the last update of the dbus service
+        self.dirty_paths = set()
+        # last published (value, time) of the filtered paths
+        self.filter_references = {}
+
+        self.last_changed = 0
+        # no message was received within the timeout, the measured values are invalidated
+        self.stale = False
+        # last successfully processed payload, identical payloads are not decoded again
+        self.last_payload = None
+        self.stats = {"messages_processed": 0, "messages_skipped": 0, "invalid_keys": 0, "dbus_signals": 0}
+        # time to decode the last payload, measured by the stats update
+        self.decode_time = LatencyHistogram(DECODE_TIME_BUCKETS, 0)
+        # path -> number of changed values written to the dbus
+        self.dbus_emissions = {}
+        self.charging_time = {"start": None, "calculate": False, "stopped_since": 0}
+
+        # energy in kWh integrated from /Ac/Power, if the EV charger doesn't send /Ac/Energy/Forward
+        self.energy_provided = False
+        self.energy_forward = load_energy(device_instance, topic) if settings.energy_calculation else 0.0
+        # (timestamp, power) of the last message, only the last sample is needed for the trapezoidal rule
+        self.energy_last_sample = None
+        self.energy_saved = self.energy_forward
+        self.energy_saved_at = time()
+        if self.energy_forward != 0:
+            self.values["/Ac/Energy/Forward"]["value"] = round(self.energy_forward, 3)
+
+        # set by set_first_data(), when /Ac/Power is known and the dbus service can be created
+        self.first_data = threading.Event()
+
+        # handler which publishes the changed paths in the GLib main loop, set after the dbus service is registered
+        self.publish_handler = None
+        self.publish_lock = threading.Lock()
+        self.publish_scheduled = False
+        # monotonic receive time of the oldest message, of which the changed values are not yet written to the dbus
+        self.received_at = None
+        # time from receiving a message until its values were written to the dbus
+        self.latency = LatencyHistogram(LATENCY_BUCKETS, LATENCY_SAMPLES)
+        # age of the data from the Timestamp sent by the EV charger until the message was received
+        self.source_age = LatencyHistogram(SOURCE_AGE_BUCKETS, LATENCY_SAMPLES)
+
+        # path -> (value, monotonic time) written on the dbus and not yet published, only the last value of a path is kept
+        self.commands_pending = {}
+        # path -> (value, monotonic time, command ID) of the published commands, until the EV charger sends the value back
+        self.commands_sent = {}
+        # protects commands_sent, which is checked in the MQTT network thread
+        self.commands_lock = threading.Lock()
+        # increasing ID of the published commands, to correlate the logged publish and acknowledgement
+        self.command_id = 0
+        self.command_stats = {"commands_sent": 0, "commands_acknowledged": 0, "commands_timed_out": 0}
+        # time from the write on the dbus until the EV charger sent back the value
+        self.command_latency = LatencyHistogram(COMMAND_LATENCY_BUCKETS)
+
+    def parse_json_payload(self, jsonpayload, changed):
+        """
+        Walk the decoded JSON payload in a single pass, then store the values which differ. The paths of changed values are added to changed
+        """
+        received = []
+        invalid = []
+        walk_json_paths(self.json_path_table, jsonpayload, received, invalid)
+
+        for (path, data), value in received:
+            # the JSON decoder of the standard library, MessagePack and CBOR accept nan and inf
+            if type(value) not in VALID_VALUE_TYPES or (type(value) is float and not isfinite(value)):
+                invalid.append((path, value))
+            elif type(value) is str or path not in settings.path_filters:
+                changed.add(path)
+                data["value"] = value
+                self.dirty_paths.add(path)
+            else:
+                changed.add(path)
+                self.store_filtered_value(path, data, settings.path_filters[path], value)
+
+        for path, value in invalid:
+            self.stats["invalid_keys"] += 1
+            log_limited.warning(("invalid key", self.topic, path), 'Received key "%s" with value "%s" is not valid', path, value)
+
+    def update_derived_values(self, provided_paths, changed):
+        """
+        Recalculate the derived paths, which are not provided by the EV charger and of which an input changed.
+        changed contains the paths changed by the current message, since dirty_paths is emptied by the GLib main loop meanwhile
+        """
+        # the phase powers of the other phases are not valid anymore, after switching from 3 to 1 phase
+        phase_paths_provided = tuple(path for path in PHASE_POWER_PATHS if path in provided_paths)
+        if phase_paths_provided != self.phase_paths_provided:
+            self.phase_paths_provided = phase_paths_provided
+            changed.update(PHASE_POWER_PATHS)
+
+        for path, input_paths, function in derived_paths_sorted:
+            if path not in provided_paths and not changed.isdisjoint(input_paths):
+                value = function(self)
+                if value is not None and self.set_value(path, value):
+                    changed.add(path)
+
+    def get_flat_paths_provided(self, timestamp):
+        """
+        Get the paths received in the flat topic mode. The EV charger stops publishing the phases it doesn't use anymore,
+        so the phase powers not received for phase_timeout seconds are left out
+        """
+        if settings.phase_timeout == 0:
+            return self.flat_paths_received
+
+        return {path for path, received_at in self.flat_paths_received.items() if path not in PHASE_POWER_PATHS or timestamp - received_at <= settings.phase_timeout}
+
+    def set_value(self, path, value):
+        """
+        Store a value and mark the path as changed, if the value differs. Returns True, if the value differs
+        """
+        if self.values[path]["value"] == value:
+            return False
+
+        if path in settings.path_filters and type(value) in (int, float):
+            self.store_filtered_value(path, self.values[path], settings.path_filters[path], value)
+        else:
+            self.values[path]["value"] = value
+            self.dirty_paths.add(path)
+
+        return True
+
+    def store_filtered_value(self, path, data, path_filter, value):
+        """
+        Store a rounded value and mark the path as changed, if it's outside of the deadband
+        or the last published value is older than max_silence
+        """
+        value = path_filter.round(value)
+        data["value"] = value
+
+        now = time()
+        reference = self.filter_references.get(path)
+
+        if reference is None or (value != reference[0] and (path_filter.is_significant(value, reference[0]) or now - reference[1] >= settings.filter_max_silence)):
+            self.filter_references[path] = (value, now)
+            self.dirty_paths.add(path)
+
+    def refresh_filtered_values(self, now):
+        """
+        Publish filtered values, which changed within the deadband and were not published since max_silence seconds
+        """
+        for path, reference in list(self.filter_references.items()):
+            value = self.values[path]["value"]
+            if value != reference[0] and now - reference[1] >= settings.filter_max_silence:
+                self.filter_references[path] = (value, now)
+                self.dirty_paths.add(path)
+
+    def integrate_energy(self, timestamp):
+        """
+        Add the energy since the last message with the trapezoidal rule, if the EV charger doesn't send /Ac/Energy/Forward.
+        The timestamp is the monotonic receive time of the MQTT message
+        """
+        if not settings.energy_calculation or self.energy_provided:
+            return
+
+        power = self.values["/Ac/Power"]["value"]
+        if type(power) not in (int, float):
+            return
+
+        if self.energy_last_sample is not None:
+            elapsed = timestamp - self.energy_last_sample[0]
+
+            if 0 < elapsed <= (settings.timeout if settings.timeout != 0 else ENERGY_MAX_GAP_WITHOUT_TIMEOUT):
+                # W * s -> kWh, a negative power is not counted as charged energy
+                self.energy_forward += max(self.energy_last_sample[1] + power, 0) / 2 * elapsed / 3600000
+                self.set_value("/Ac/Energy/Forward", round(self.energy_forward, 3))
+
+        self.energy_last_sample = (timestamp, power)
+
+    def save_energy(self):
+        """
+        Save the calculated energy to the disk, if it changed since it was saved last.
+        The file is replaced atomically, so that a power loss while writing doesn't lose the counter
+        """
+        self.energy_saved_at = time()
+
+        if self.energy_provided or self.energy_forward == self.energy_saved:
+            return
+
+        file_name = get_energy_file(self.device_instance)
+
+        try:
+            os.makedirs(data_directory, exist_ok=True)
+
+            with open(file_name + ".tmp", "w") as file:
+                json.dump({"topic": self.topic, "energy_forward": self.energy_forward}, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(file_name + ".tmp", file_name)
+            self.energy_saved = self.energy_forward
+
+        except OSError as e:
+            logging.error("Could not save the calculated energy of device instance %i: %s" % (self.device_instance, e))
+
+    def apply_settings(self, charger_settings):
+        """
+        Apply the settings after the config.ini was reloaded. Called in the GLib main loop, while holding chargers_lock
+        """
+        if charger_settings.topic != self.topic or charger_settings.topic_mode != self.topic_mode:
+            self.topic = charger_settings.topic
+            self.topic_mode = charger_settings.topic_mode
+            self.subscription_topic = self.topic + "/#" if self.topic_mode == "flat" else self.topic
+            # the values of the new topic could be in another format
+            self.last_payload = None
+            self.flat_paths_received.clear()
+
+        self.decode_payload = get_payload_decoder(charger_settings.payload_format)
+        self.device_name = charger_settings.device_name
+        self.position = charger_settings.position
+        self.voltage = charger_settings.voltage
+        self.phases = charger_settings.phases
+        self.command_topic = charger_settings.command_topic
+
+    def apply_filters(self):
+        """
+        Apply the filters after the config.ini was reloaded. Called in the GLib main loop, while holding chargers_lock
+        """
+        # paths without a filter publish each change again
+        self.filter_references = {path: reference for path, reference in self.filter_references.items() if path in settings.path_filters}
+
+    def is_command_topic(self, topic):
+        """
+        Check if the driver publishes the commands of the EV charger to the topic, <command_topic> or <command_topic>/<path>
+        """
+        return self.command_topic != "" and (topic == self.command_topic or topic.startswith(self.command_topic + "/"))
+
+    def check_commands_acknowledged(self, timestamp):
+        """
+        Remove the published commands, which the EV charger sent back, and log the time from the write on the dbus
+        until the value was received. Called in the MQTT network thread with the monotonic receive time of the message
+        """
+        with self.commands_lock:
+            for path, (value, written_at, command_id) in list(self.commands_sent.items()):
+                if self.values[path]["value"] == value:
+                    del self.commands_sent[path]
+                    self.command_stats["commands_acknowledged"] += 1
+                    self.command_latency.observe(timestamp - written_at)
+                    logging.info('Command #%i %s = %s acknowledged by the EV charger on topic "%s" after %.3f seconds', command_id, path, value, self.topic, timestamp - written_at)
+
+    def get_commands_timed_out(self, now):
+        """
+        Remove and return the (path, command ID) of the published commands, which the EV charger didn't send back within command_timeout seconds
+        """
+        with self.commands_lock:
+            timed_out = [(path, command_id) for path, (value, written_at, command_id) in self.commands_sent.items() if now - written_at > settings.command_timeout]
+            for path, command_id in timed_out:
+                del self.commands_sent[path]
+            self.command_stats["commands_timed_out"] += len(timed_out)
+
+        return timed_out
+
+    def set_first_data(self):
+        """
+        Mark the first data as received and create the dbus service of a configured EV charger in the GLib main loop,
+        so that it doesn't wait for the other EV chargers. Called in the MQTT network thread, after /Ac/Power is known
+        """
+        self.first_data.set()
+        chargers_first_data.set()
+
+        # discovered EV chargers create their dbus service when they are added
+        if not self.discovered and self.publish_handler is None:
+            GLib.idle_add(create_dbus_service, self)
+
+    def mark_stale(self):
+        """
+        Invalidate the measured values after the timeout. They are valid again with the next message
+        """
+        self.stale = True
+        # decode the next payload, even if it's identical to the last one
+        self.last_payload = None
+        # don't integrate the energy over the time without data
+        self.energy_last_sample = None
+        # the time without data is not counted as charging time
+        self.charging_time["start"] = None
+        self.charging_time["stopped_since"] = None
+
+        for path in STALE_PATHS:
+            self.filter_references.pop(path, None)
+            if self.values[path]["value"] is not None:
+                self.values[path]["value"] = None
+                self.dirty_paths.add(path)
+
+    def observe_source_timestamp(self, source_timestamp):
+        """
+        Record the age of the data from the Timestamp sent by the EV charger as unix time in seconds or milliseconds.
+        The age includes the difference between the clocks of the EV charger and the GX device
+        """
+        if type(source_timestamp) not in (int, float):
+            log_limited.warning(("invalid timestamp", self.topic), 'Received Timestamp "%s" is not a unix time', source_timestamp)
+            return
+
+        # a unix time in milliseconds is greater than any unix time in seconds until the year 5138
+        if source_timestamp > 100000000000:
+            source_timestamp /= 1000
+
+        self.source_age.observe(time() - source_timestamp)
+
+    def sample_decode_time(self):
+        """
+        Measure the time to decode the last payload again. Called by the stats update in the GLib main loop,
+        so measuring doesn't slow down the messages in the MQTT network thread. Returns the seconds, None without a payload
+        """
+        payload = self.last_payload
+        if payload is None:
+            return None
+
+        started = perf_counter()
+        self.decode_payload(payload)
+        seconds = perf_counter() - started
+        self.decode_time.observe(seconds)
+        return seconds
+
+    def schedule_publish(self, timestamp):
+        """
+        Wake up the GLib main loop to publish the changed paths immediately.
+        Called from the MQTT network thread with the monotonic receive time of the message,
+        calls are coalesced until the main loop ran the handler
+        """
+        if self.publish_handler is None:
+            return
+
+        with self.publish_lock:
+            if self.received_at is None:
+                self.received_at = timestamp
+            if self.publish_scheduled:
+                return
+            self.publish_scheduled = True
+
+        GLib.idle_add(self.publish_handler, priority=GLib.PRIORITY_DEFAULT)
+
+
+class ChargerDiscovery:
+    """
+    Creates an EV charger for each new topic published on the wildcard topic
+    and removes it again, after no message was received for remove_after seconds
+    """
+
+    def __init__(self, discovery_settings, used_device_instances):
+        self.settings = discovery_settings
+        self.topic = discovery_settings.topic
+        self.remove_after = discovery_settings.remove_after
+        self.free_device_instances = [i for i in range(discovery_settings.device_instance_first, discovery_settings.device_instance_last + 1) if i not in used_device_instances]
+        # topics which could not be added, since all device instances are in use
+        self.ignored_topics = set()
+
+    def add_charger(self, topic):
+        """
+        Create an EV charger for the topic. Called in the MQTT network thread, while holding chargers_lock
+        """
+        if not self.free_device_instances:
+            if topic not in self.ignored_topics:
+                self.ignored_topics.add(topic)
+                logging.warning('Discovery: No free device instance left for the EV charger on topic "%s"' % topic)
+            return None
+
+        charger = EvCharger(
+            topic=topic,
+            device_instance=self.free_device_instances.pop(0),
+            device_name=self.settings.device_name + " " + topic.rsplit("/", 1)[-1],
+            position=self.settings.position,
+            voltage=self.settings.voltage,
+            phases=self.settings.phases,
+            payload_format=self.settings.payload_format,
+            command_topic=self.settings.command_topic.replace("{topic}", topic),
+            discovered=True,
+        )
+        chargers.append(charger)
+        chargers_matcher[topic] = charger
+
+        logging.info('Discovery: Added EV charger with device instance %i on topic "%s"' % (charger.device_instance, topic))
+
+        # the dbus service has to be created in the GLib main loop
+        GLib.idle_add(create_dbus_service, charger)
+
+        return charger
+
+    def remove_charger(self, charger):
+        """
+        Remove the EV charger from the routing and free its device instance. Called in the GLib main loop
+        """
+        with chargers_lock:
+            chargers.remove(charger)
+            del chargers_matcher[charger.topic]
+            self.free_device_instances.append(charger.device_instance)
+            self.free_device_instances.sort()
+            self.ignored_topics.clear()
+
+        logging.info('Discovery: Removed stale EV charger with device instance %i on topic "%s"' % (charger.device_instance, charger.topic))
+
+
+def get_discovery_from_config(chargers_list):
+    """
+    Create the ChargerDiscovery, if the [DISCOVERY] section exists in the config.ini
+    """
+    if settings.discovery is None:
+        return None
+
+    return ChargerDiscovery(settings.discovery, [charger.device_instance for charger in chargers_list])
+
+
+class ReconnectBackoff:
+    """
+    Exponential delay between the reconnect attempts with random jitter, so that many clients
+    don't reconnect in lockstep after a broker restart. The delay is waited by the paho network thread
+    """
+
+    def __init__(self, min_delay, max_delay):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+        self.disconnected_at = None
+        # time of the last reconnect, until the first message was received after it
+        self.reconnected_at = None
+        self.stats = {"reconnects": 0, "reconnect_attempts": 0, "last_reconnect_attempts": 0, "last_reconnect_seconds": None, "last_reconnect_to_first_data_seconds": None}
+
+    def schedule(self, client):
+        """
+        Set the delay for the next reconnect attempt of paho. Returns the delay in seconds
+        """
+        # the delay doubles with every attempt, the jitter is up to half of it
+        delay = min(self.max_delay, self.min_delay * 2 ** min(self.attempts, 30))
+        delay = random.uniform(max(self.min_delay, delay / 2), delay)
+        self.attempts += 1
+
+        # paho waits min_delay before the next attempt, since the delay was reset by reconnect_delay_set()
+        client.reconnect_delay_set(min_delay=delay, max_delay=delay)
+
+        return delay
+
+    def disconnected(self):
+        if self.disconnected_at is None:
+            self.disconnected_at = time()
+
+    def connected(self):
+        """
+        Reset the delay and update the stats. Returns the seconds since the connection was lost, if it was a reconnect
+        """
+        seconds = None
+
+        if self.disconnected_at is not None:
+            seconds = time() - self.disconnected_at
+            self.stats["reconnects"] += 1
+            self.stats["reconnect_attempts"] += self.attempts
+            self.stats["last_reconnect_attempts"] = self.attempts
+            self.stats["last_reconnect_seconds"] = seconds
+            self.reconnected_at = time()
+
+        self.attempts = 0
+        self.disconnected_at = None
+
+        return seconds
+
+    def message_received(self):
+        """
+        Update the stats with the seconds from the last reconnect to the first message. Returns the seconds
+        """
+        seconds = time() - self.reconnected_at
+        self.reconnected_at = None
+        self.stats["last_reconnect_to_first_data_seconds"] = seconds
+
+        return seconds
+
+
+reconnect_backoff = ReconnectBackoff(settings.reconnect_delay_min, settings.reconnect_delay_max)
+
+
 # MQTT requests
 def on_disconnect(client, userdata, flags, reason_code, properties):
     global connected
+    connected = 0
     logging.warning("MQTT client: Got disconnected")
     if reason_code != 0:
-        logging.warning("MQTT client: Unexpected MQTT disconnection. Will auto-reconnect")
+        logging.warning("MQTT client: Unexpected MQTT disconnection (%s). Will auto-reconnect" % reason_code)
     else:
         logging.warning("MQTT client: reason_code value:" + str(reason_code))
 
-    while connected == 0:
-        try:
-            logging.warning(f"MQTT client: Trying to reconnect to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
-            client.connect(host=config["MQTT"]["broker_address"], port=int(config["MQTT"]["broker_port"]))
-            connected = 1
-        except Exception as err:
-            logging.error(f"MQTT client: Error in retrying to connect with broker ({config['MQTT']['broker_address']}:{config['MQTT']['broker_port']}): {err}")
-            logging.error("MQTT client: Retrying in 15 seconds")
-            connected = 0
-            sleep(15)
+    # paho reconnects in its network thread after the delay, the callback must not block it
+    reconnect_backoff.disconnected()
+    delay = reconnect_backoff.schedule(client)
+    logging.warning(f"MQTT client: Trying to reconnect to broker {settings.mqtt_broker_address} on port {settings.mqtt_broker_port} in {delay:.1f} seconds")
+
+
+def on_connect_fail(client, userdata):
+    reconnect_backoff.disconnected()
+    delay = reconnect_backoff.schedule(client)
+    logging.error(f"MQTT client: Error in retrying to connect with broker ({settings.mqtt_broker_address}:{settings.mqtt_broker_port}). Retrying in {delay:.1f} seconds")
 
 
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -207,128 +1535,257 @@ def on_connect(client, userdata, flags, reason_code, properties):
     if reason_code == 0:
         logging.info("MQTT client: Connected to MQTT broker!")
         connected = 1
-        client.subscribe(config["MQTT"]["topic"])
+        topic_aliases.clear()
+
+        reconnect_seconds = reconnect_backoff.connected()
+        if reconnect_seconds is not None:
+            stats = reconnect_backoff.stats
+            logging.warning(
+                "MQTT client: Reconnected after %.1f seconds and %i attempts (reconnects: %i, average attempts per reconnect: %.1f)"
+                % (reconnect_seconds, stats["last_reconnect_attempts"], stats["reconnects"], stats["reconnect_attempts"] / stats["reconnects"])
+            )
+
+        topics = [charger.subscription_topic for charger in chargers if not charger.discovered]
+        if discovery is not None:
+            topics.append(discovery.topic)
+        client.subscribe([(topic, settings.mqtt_qos) for topic in topics])
     else:
         logging.error("MQTT client: Failed to connect, return code %d\n", reason_code)
 
 
-def on_message(client, userdata, msg):
-    try:
+def check_mqtt5_message(msg):
+    """
+    Resolve the topic alias of a MQTT 5.0 message and check its age. Returns False, if the message has to be dropped
+    """
+    topic_alias = getattr(msg.properties, "TopicAlias", None)
 
-        global ev_charger_dict, last_changed
+    if topic_alias is not None:
+        # the first message with the alias contains the topic, the following ones only the alias
+        if msg.topic != "":
+            topic_aliases[topic_alias] = msg.topic
+        elif topic_alias in topic_aliases:
+            msg.topic = topic_aliases[topic_alias].encode("utf-8")
+        else:
+            log_limited.warning(("topic alias", topic_alias), "MQTT client: Received unknown topic alias %i", topic_alias)
+            return False
 
-        # get JSON from topic
-        if msg.topic == config["MQTT"]["topic"]:
-            if msg.payload != "" and msg.payload != b"":
-                jsonpayload = json.loads(msg.payload)
+    # the broker reduced the Message Expiry Interval by the seconds the message waited, e.g. while the driver was disconnected
+    if settings.message_max_age != 0 and settings.message_expiry != 0:
+        message_expiry_remaining = getattr(msg.properties, "MessageExpiryInterval", None)
+        if message_expiry_remaining is not None and settings.message_expiry - message_expiry_remaining > settings.message_max_age:
+            mqtt_stats["messages_dropped_max_age"] += 1
+            log_limited.warning(("max age", msg.topic), 'MQTT client: Dropped message on topic "%s", since it\'s older than %i seconds', msg.topic, settings.message_max_age)
+            return False
 
-                last_changed = int(time())
+    return True
 
-                if "Ac" in jsonpayload and "Power" in jsonpayload["Ac"]:
 
-                    # save JSON data into ev_charger_dict
-                    for key_1, data_1 in jsonpayload.items():
+def on_message(client, userdata, msg):
+    mqtt_stats["messages_received"] += 1
+    mqtt_stats["bytes_received"] += len(msg.payload)
 
-                        key = "/" + key_1
+    if msg.properties is not None and not check_mqtt5_message(msg):
+        return
 
-                        if type(data_1) is dict:
+    # ignore retained messages, since they could be outdated
+    if msg.retain and not settings.retained_messages:
+        return
 
-                            for key_2, data_2 in data_1.items():
+    if reconnect_backoff.reconnected_at is not None:
+        logging.info("MQTT client: First message received %.3f seconds after the reconnect" % reconnect_backoff.message_received())
 
-                                key = "/" + key_1 + "/" + key_2
+    # route the message to the EV charger(s) subscribed to the topic. In the flat topic mode the subscription <topic>/#
+    # also matches a command topic like <topic>/set, the commands published by the driver itself are no values
+    with chargers_lock:
+        chargers_matched = [charger for charger in chargers_matcher.iter_match(msg.topic) if not charger.is_command_topic(msg.topic)]
 
-                                if type(data_2) is dict:
+        # create a new EV charger for unknown topics on the discovery topic
+        if not chargers_matched and discovery is not None and mqtt.topic_matches_sub(discovery.topic, msg.topic) and not any(charger.is_command_topic(msg.topic) for charger in chargers):
+            charger = discovery.add_charger(msg.topic)
+            if charger is not None:
+                chargers_matched.append(charger)
 
-                                    for key_3, data_3 in data_2.items():
+    for charger in chargers_matched:
+        if charger.topic_mode == "flat":
+            handle_flat_message(charger, msg)
+        else:
+            handle_message(charger, msg)
 
-                                        key = "/" + key_1 + "/" + key_2 + "/" + key_3
 
-                                        if key in ev_charger_dict and (type(data_3) is str or type(data_3) is int or type(data_3) is float):
-                                            ev_charger_dict[key]["value"] = data_3
-                                        else:
-                                            logging.warning('Received key "' + str(key) + '" with value "' + str(data_3) + '" is not valid')
+def handle_message(charger, msg):
+    try:
 
-                                else:
+        # get JSON from topic
+        if msg.payload != "" and msg.payload != b"":
+
+            # the EV charger republished the same payload, only refresh the timeout
+            if msg.payload == charger.last_payload:
+                charger.last_changed = int(time())
+                charger.stale = False
+                charger.stats["messages_skipped"] += 1
+
+                # the power didn't change, but the time passed
+                charger.integrate_energy(msg.timestamp)
+                if charger.dirty_paths:
+                    charger.schedule_publish(msg.timestamp)
+
+                return
 
-                                    if key in ev_charger_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float):
-                                        ev_charger_dict[key]["value"] = data_2
-                                    else:
-                                        logging.warning('Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
+            jsonpayload = charger.decode_payload(msg.payload)
 
-                        else:
+            charger.last_changed = int(time())
+            charger.stale = False
 
-                            if key in ev_charger_dict and (type(data_1) is str or type(data_1) is int or type(data_1) is float):
-                                ev_charger_dict[key]["value"] = data_1
-                            else:
-                                logging.warning('Received key "' + str(key) + '" with value "' + str(data_1) + '" is not valid')
+            if "Ac" in jsonpayload and ("Power" in jsonpayload["Ac"] or "L1" in jsonpayload["Ac"] or "L2" in jsonpayload["Ac"] or "L3" in jsonpayload["Ac"]):
 
-                    # ------ calculate possible values if missing -----
-                    # Current
-                    if "Current" not in jsonpayload:
-                        if "L1" in jsonpayload["Ac"] and "L2" in jsonpayload["Ac"] and "L3" in jsonpayload["Ac"]:
-                            ev_charger_dict["/Current"]["value"] = (
-                                round(
-                                    (ev_charger_dict["/Ac/Power"]["value"] / int(config["DEFAULT"]["voltage"])) / 3,
-                                    3,
-                                )
-                                if ev_charger_dict["/Ac/Power"]["value"] != 0
-                                else 0
-                            )
+                # the optional source timestamp is no dbus path
+                if "Timestamp" in jsonpayload:
+                    charger.observe_source_timestamp(jsonpayload.pop("Timestamp"))
 
-                        elif "L1" in jsonpayload["Ac"] and "L2" in jsonpayload["Ac"] or "L1" in jsonpayload["Ac"] and "L3" in jsonpayload["Ac"] or "L2" in jsonpayload["Ac"] and "L3" in jsonpayload["Ac"]:
-                            ev_charger_dict["/Current"]["value"] = (
-                                round(
-                                    (ev_charger_dict["/Ac/Power"]["value"] / int(config["DEFAULT"]["voltage"])) / 2,
-                                    3,
-                                )
-                                if ev_charger_dict["/Ac/Power"]["value"] != 0
-                                else 0
-                            )
+                # save JSON data into the values of the charger
+                changed = set()
+                charger.parse_json_payload(jsonpayload, changed)
 
-                        else:
-                            ev_charger_dict["/Current"]["value"] = (
-                                round(
-                                    (ev_charger_dict["/Ac/Power"]["value"] / int(config["DEFAULT"]["voltage"])),
-                                    3,
-                                )
-                                if ev_charger_dict["/Ac/Power"]["value"] != 0
-                                else 0
-                            )
+                # ------ calculate possible values if missing -----
+                # Power, Current
+                provided_paths = get_derived_paths_in_payload(jsonpayload)
+                charger.update_derived_values(provided_paths, changed)
 
-                    # ChargingTime
-                    if "ChargingTime" in jsonpayload:
-                        charging_time["calculate"] = False
-                    else:
-                        charging_time["calculate"] = True
+                # Energy
+                if "/Ac/Energy/Forward" in provided_paths:
+                    charger.energy_provided = True
+                charger.integrate_energy(msg.timestamp)
 
+                # ChargingTime
+                if "ChargingTime" in jsonpayload:
+                    charger.charging_time["calculate"] = False
                 else:
-                    logging.warning("Received JSON doesn't contain minimum required values")
-                    logging.warning('Example: {"Ac":{"Power":321.6}}')
-                    logging.debug("MQTT payload: " + str(msg.payload)[1:])
+                    charger.charging_time["calculate"] = True
+
+                charger.last_payload = msg.payload
+                charger.stats["messages_processed"] += 1
+
+                if charger.commands_sent:
+                    charger.check_commands_acknowledged(msg.timestamp)
+
+                if not charger.first_data.is_set() and charger.values["/Ac/Power"]["value"] is not None:
+                    charger.set_first_data()
+
+                if charger.dirty_paths:
+                    charger.schedule_publish(msg.timestamp)
 
             else:
-                logging.warning("Received message was empty and therefore it was ignored")
-                logging.debug("MQTT payload: " + str(msg.payload)[1:])
+                log_limited.warning(("minimum", msg.topic), 'Received JSON doesn\'t contain minimum required values. Example: {"Ac":{"Power":321.6}}')
+                logging.debug("MQTT payload: %r", msg.payload)
+
+        else:
+            log_limited.warning(("empty", msg.topic), "Received message was empty and therefore it was ignored")
 
     except TypeError as e:
-        logging.error("Received message is not valid. Check the README and sample payload. %s" % e)
-        logging.debug("MQTT payload: " + str(msg.payload)[1:])
+        log_limited.error(("invalid", msg.topic), "Received message is not valid. Check the README and sample payload. %s", e)
+        logging.debug("MQTT payload: %r", msg.payload)
 
     except ValueError as e:
-        logging.error("Received message is not a valid JSON. Check the README and sample payload. %s" % e)
-        logging.debug("MQTT payload: " + str(msg.payload)[1:])
+        log_limited.error(("decode", msg.topic), "Received message is not a valid JSON, MessagePack or CBOR payload. Check the README and sample payload. %s", e)
+        logging.debug("MQTT payload: %r", msg.payload)
+
+    except Exception:
+        exception_type, exception_object, exception_traceback = sys.exc_info()
+        file = exception_traceback.tb_frame.f_code.co_filename
+        line = exception_traceback.tb_lineno
+        log_limited.error(("exception", msg.topic, line), "Exception occurred: %r of type %s in %s line #%i", exception_object, exception_type, file, line)
+        logging.debug("MQTT payload: %r", msg.payload)
+
+
+def parse_flat_value(payload):
+    """
+    Parse the raw payload of a flat topic to int, float or str without decoding JSON.
+    Raises a ValueError for nan and inf, which JSON doesn't allow either
+    """
+    try:
+        return int(payload)
+    except ValueError:
+        pass
+
+    try:
+        value = float(payload)
+    except ValueError:
+        return payload.decode("utf-8")
+
+    if not isfinite(value):
+        raise ValueError('"%s" is not a finite number' % value)
+
+    return value
+
+
+def handle_flat_message(charger, msg):
+    try:
+
+        # get the dbus path from the sub topic, e.g. <topic>/Ac/Power -> /Ac/Power
+        sub_topic = msg.topic[len(charger.topic) + 1 :]
+        entry = charger.flat_topic_table.get(sub_topic)
+
+        if entry is None and sub_topic != "Timestamp":
+            charger.stats["invalid_keys"] += 1
+            log_limited.warning(("invalid topic", msg.topic), 'Received topic "%s" is not valid', msg.topic)
+            return
+
+        if msg.payload == b"":
+            log_limited.warning(("empty", msg.topic), 'Received message on topic "%s" was empty and therefore it was ignored', msg.topic)
+            return
+
+        try:
+            value = parse_flat_value(msg.payload)
+        except ValueError as e:
+            charger.stats["invalid_keys"] += 1
+            log_limited.warning(("invalid value", msg.topic), 'Received value on topic "%s" is not valid: %s', msg.topic, e)
+            return
+
+        # the optional source timestamp is no dbus path
+        if sub_topic == "Timestamp":
+            charger.observe_source_timestamp(value)
+            return
+
+        path, data = entry
+        charger.last_changed = int(time())
+        charger.stale = False
+
+        charger.flat_paths_received[path] = msg.timestamp
+        changed = {path} if charger.set_value(path, value) else set()
+        charger.stats["messages_processed"] += 1
+
+        if charger.commands_sent:
+            charger.check_commands_acknowledged(msg.timestamp)
+
+        # ------ calculate possible values if missing -----
+        # Power, Current
+        charger.update_derived_values(charger.get_flat_paths_provided(msg.timestamp), changed)
+
+        # Energy
+        charger.energy_provided = "/Ac/Energy/Forward" in charger.flat_paths_received
+        charger.integrate_energy(msg.timestamp)
+
+        # ChargingTime
+        charger.charging_time["calculate"] = "/ChargingTime" not in charger.flat_paths_received
+
+        if not charger.first_data.is_set() and charger.values["/Ac/Power"]["value"] is not None:
+            charger.set_first_data()
+
+        if charger.dirty_paths:
+            charger.schedule_publish(msg.timestamp)
 
     except Exception:
         exception_type, exception_object, exception_traceback = sys.exc_info()
         file = exception_traceback.tb_frame.f_code.co_filename
         line = exception_traceback.tb_lineno
-        logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-        logging.debug("MQTT payload: " + str(msg.payload)[1:])
+        log_limited.error(("exception", msg.topic, line), "Exception occurred: %r of type %s in %s line #%i", exception_object, exception_type, file, line)
+        logging.debug("MQTT payload: %r", msg.payload)
 
 
 class DbusMqttEvChargerService:
     def __init__(
         self,
+        charger,
         servicename,
         deviceinstance,
         paths,
@@ -337,8 +1794,21 @@ class DbusMqttEvChargerService:
         connection="MQTT EV Charger service",
     ):
 
-        self._dbusservice = VeDbusService(servicename, register=False)
+        # each service needs an own connection, since all services export the same object paths
+        self._bus = dbus.SessionBus(private=True) if "DBUS_SESSION_BUS_ADDRESS" in os.environ else dbus.SystemBus(private=True)
+
+        self._dbusservice = VeDbusService(servicename, bus=self._bus, register=False)
+        self._charger = charger
         self._paths = paths
+        # timer which publishes the collected commands after command_coalesce_time
+        self._command_source = None
+        # timer which updates the statistics under /Mgmt/Stats
+        self._stats_source = None
+        # (monotonic time, messages) of the last statistics update
+        self._stats_last = None
+
+        # the current values are added below, changes from now on are published afterwards
+        charger.dirty_paths.clear()
 
         logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
 
@@ -359,15 +1829,36 @@ class DbusMqttEvChargerService:
         # self._dbusservice.add_path('/HardwareVersion', '')
         self._dbusservice.add_path("/Connected", 1)
 
-        self._dbusservice.add_path("/Position", int(config["DEFAULT"]["position"]))
-
-        self._dbusservice.add_path("/Latency", None)
-
-        for path, settings in self._paths.items():
+        self._dbusservice.add_path("/Position", charger.position)
+
+        # time from receiving a message until its values were written to the dbus, median of the last updates
+        self._dbusservice.add_path("/Latency", None, gettextcallback=_ms)
+        # age of the data from the Timestamp sent by the EV charger, median of the last messages
+        self._dbusservice.add_path("/Mgmt/SourceAge", None, gettextcallback=_seconds)
+
+        # statistics of the settings written on the dbus and published to the command topic
+        self._dbusservice.add_path("/Mgmt/Commands/Sent", 0, gettextcallback=_n)
+        self._dbusservice.add_path("/Mgmt/Commands/Acknowledged", 0, gettextcallback=_n)
+        self._dbusservice.add_path("/Mgmt/Commands/TimedOut", 0, gettextcallback=_n)
+        for path in COMMAND_LATENCY_PATHS:
+            self._dbusservice.add_path(path, None, gettextcallback=_seconds)
+
+        # statistics of the driver, which are updated every stats_interval seconds
+        if settings.stats_interval != 0:
+            self._dbusservice.add_path("/Mgmt/Stats/MessagesPerSecond", None, gettextcallback=_per_second)
+            self._dbusservice.add_path("/Mgmt/Stats/DecodeTime", None, gettextcallback=_us)
+            self._dbusservice.add_path("/Mgmt/Stats/LastMessageAge", None, gettextcallback=_n)
+            self._dbusservice.add_path("/Mgmt/Stats/MessagesSkipped", 0, gettextcallback=_n)
+            self._dbusservice.add_path("/Mgmt/Stats/MessagesDropped", 0, gettextcallback=_n)
+            self._dbusservice.add_path("/Mgmt/Stats/InvalidKeys", 0, gettextcallback=_n)
+            self._dbusservice.add_path("/Mgmt/Stats/Reconnects", 0, gettextcallback=_n)
+            self._dbusservice.add_path("/Mgmt/Stats/DbusSignals", 0, gettextcallback=_n)
+
+        for path, path_settings in self._paths.items():
             self._dbusservice.add_path(
                 path,
-                settings["value"],
-                gettextcallback=settings["textformat"],
+                path_settings["value"],
+                gettextcallback=path_settings["textformat"],
                 writeable=True,
                 onchangecallback=self._handlechangedvalue,
             )
@@ -375,74 +1866,667 @@ class DbusMqttEvChargerService:
         # register VeDbusService after all paths where added
         self._dbusservice.register()
 
-        GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
-
-    def _update(self):
-
-        global ev_charger_dict, last_changed, last_updated
-
-        now = int(time())
-
-        if last_changed != last_updated:
+        logging.info("Startup: %s registered on dbus %.3f seconds after the driver started" % (servicename, time() - startup_time))
 
-            for setting, data in ev_charger_dict.items():
+        charger.publish_handler = self._publish
 
-                try:
-                    self._dbusservice[setting] = data["value"]
+        # housekeeping like charging time, timeout and UpdateIndex, new values are published by _publish
+        GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
 
-                except TypeError as e:
-                    logging.error('Received key "' + setting + '" with value "' + str(data["value"]) + '" is not valid: ' + str(e))
-                    sys.exit()
+        if settings.stats_interval != 0:
+            self._stats_source = GLib.timeout_add(settings.stats_interval * 1000, self._update_stats)
 
-                except Exception:
-                    exception_type, exception_object, exception_traceback = sys.exc_info()
-                    file = exception_traceback.tb_frame.f_code.co_filename
-                    line = exception_traceback.tb_lineno
-                    logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+    def _update(self):
 
-            logging.info("Data: {:.2f} W".format(ev_charger_dict["/Ac/Power"]["value"]))
+        charger = self._charger
+        values = charger.values
+        charging_time = charger.charging_time
 
-            last_updated = last_changed
+        now = int(time())
+        power = values["/Ac/Power"]["value"]
 
-        # calculate charging time
-        if charging_time["calculate"]:
+        # calculate charging time, the power is unknown after the timeout until a message with the power is received
+        if charging_time["calculate"] and not charger.stale and type(power) in (int, float):
 
             # set charging time start
-            if charging_time["start"] is None and ev_charger_dict["/Ac/Power"]["value"] > 0:
+            if charging_time["start"] is None and power > 0:
                 charging_time["start"] = now
 
             # calculate charging time if charging started
             if charging_time["start"] is not None:
-                ev_charger_dict["/ChargingTime"]["value"] = now - charging_time["start"]
+                charger.set_value("/ChargingTime", now - charging_time["start"])
 
-                if ev_charger_dict["/Ac/Power"]["value"] == 0 and charging_time["stopped_since"] is None:
+                if power == 0 and charging_time["stopped_since"] is None:
                     charging_time["stopped_since"] = now
-                elif ev_charger_dict["/Ac/Power"]["value"] > 0 and charging_time["stopped_since"] is not None:
+                elif power > 0 and charging_time["stopped_since"] is not None:
                     charging_time["stopped_since"] = None
 
                 if charging_time["stopped_since"] is not None and STOP_CHARGING_COUNTER_AFTER < now - charging_time["stopped_since"]:
                     charging_time["start"] = None
                     charging_time["stopped_since"] = None
-                    ev_charger_dict["/ChargingTime"]["value"] = None
-
-        # quit driver if timeout is exceeded
-        if timeout != 0 and (now - last_changed) > timeout:
-            logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
-            sys.exit()
+                    charger.set_value("/ChargingTime", None)
+
+        # show the value of the EV charger again, if it didn't send back the value of a command
+        if charger.commands_sent:
+            for path, command_id in charger.get_commands_timed_out(monotonic()):
+                log_limited.warning(
+                    ("command timeout", charger.topic, path),
+                    'Command #%i %s was not acknowledged by the EV charger on topic "%s" within %i seconds, showing the value of the EV charger again',
+                    command_id,
+                    path,
+                    charger.topic,
+                    settings.command_timeout,
+                )
+                charger.dirty_paths.add(path)
+
+        # publish values kept back by the deadband filters
+        if charger.filter_references:
+            charger.refresh_filtered_values(time())
+
+        # save the calculated energy only every energy_save_interval seconds to spare the flash memory
+        if settings.energy_calculation and now - charger.energy_saved_at >= settings.energy_save_interval:
+            charger.save_energy()
+
+        # remove discovered EV charger, if no message was received for remove_after seconds
+        if charger.discovered and discovery.remove_after != 0 and (now - charger.last_changed) > discovery.remove_after:
+            self._remove()
+            return False  # stop the timer
+
+        if settings.timeout != 0 and (now - charger.last_changed) > settings.timeout:
+            # invalidate the values and keep the dbus service, until a new message is received.
+            # Discovered EV chargers are removed after remove_after seconds and with multiple EV chargers
+            # the others are kept on the dbus, instead of stopping the driver
+            if settings.timeout_mode == "stale" or charger.discovered or is_fleet_mode():
+                if not charger.stale:
+                    logging.warning("Timeout of %i seconds exceeded, since no new MQTT message was received in this time on topic %s. Values are invalid until the next message." % (settings.timeout, charger.topic))
+                    charger.mark_stale()
+
+            # quit driver if timeout is exceeded
+            else:
+                logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time on topic %s." % (settings.timeout, charger.topic))
+                save_energy_all()
+                sys.exit()
 
         # increment UpdateIndex - to show that new data is available
         index = self._dbusservice["/UpdateIndex"] + 1  # increment index
         if index > 255:  # maximum value of the index
             index = 0  # overflow from 255 to 0
-        self._dbusservice["/UpdateIndex"] = index
+
+        extra_values = {"/UpdateIndex": index, "/CustomName": charger.device_name, "/Position": charger.position}
+
+        if charger.latency.samples:
+            extra_values["/Latency"] = round(charger.latency.percentiles(50)[0] * 1000, 1)
+        if charger.source_age.samples:
+            extra_values["/Mgmt/SourceAge"] = round(charger.source_age.percentiles(50)[0], 3)
+
+        # statistics of the commands, they are only sent if they changed
+        extra_values["/Mgmt/Commands/Sent"] = charger.command_stats["commands_sent"]
+        extra_values["/Mgmt/Commands/Acknowledged"] = charger.command_stats["commands_acknowledged"]
+        extra_values["/Mgmt/Commands/TimedOut"] = charger.command_stats["commands_timed_out"]
+        if charger.command_latency.samples:
+            for path, value in zip(COMMAND_LATENCY_PATHS, charger.command_latency.percentiles(50, 95, 99)):
+                extra_values[path] = round(value, 3)
+
+        # the name and position can be changed by reloading the config.ini, they are only sent if they changed
+        self._publish_changes(extra_values)
+
+        return True
+
+    def _update_stats(self):
+        """
+        Write the statistics of the driver as one ItemsChanged signal, so they add only one signal every stats_interval seconds
+        """
+        charger = self._charger
+        now = monotonic()
+        messages = charger.stats["messages_processed"] + charger.stats["messages_skipped"]
+        decode_seconds = charger.sample_decode_time()
+
+        stats = {
+            "/Mgmt/Stats/LastMessageAge": int(time()) - charger.last_changed,
+            "/Mgmt/Stats/MessagesSkipped": charger.stats["messages_skipped"],
+            "/Mgmt/Stats/MessagesDropped": mqtt_stats["messages_dropped_max_age"],
+            "/Mgmt/Stats/InvalidKeys": charger.stats["invalid_keys"],
+            "/Mgmt/Stats/Reconnects": reconnect_backoff.stats["reconnects"],
+            "/Mgmt/Stats/DbusSignals": charger.stats["dbus_signals"],
+        }
+
+        if decode_seconds is not None:
+            stats["/Mgmt/Stats/DecodeTime"] = round(decode_seconds * 1000000, 1)
+
+        # the rate is calculated from the difference to the last update
+        if self._stats_last is not None:
+            last_time, last_messages = self._stats_last
+            stats["/Mgmt/Stats/MessagesPerSecond"] = round((messages - last_messages) / (now - last_time), 1)
+
+        self._stats_last = (now, messages)
+
+        # batched independent of dbus_batch_signals
+        with self._dbusservice as ctx:
+            for path, value in stats.items():
+                self._write(ctx, path, value)
+            if ctx.changes:
+                charger.stats["dbus_signals"] += 1
+
         return True
 
+    def _publish(self):
+        """
+        Called by the GLib main loop after on_message changed values
+        """
+        # the EV charger was removed, after this run was scheduled
+        if self._charger.publish_handler is None:
+            return False
+
+        # reset first, so that values changed while publishing schedule a new run
+        with self._charger.publish_lock:
+            self._charger.publish_scheduled = False
+
+        self._publish_changes()
+
+        return False  # remove the idle source
+
+    def _publish_changes(self, extra_values=None):
+        """
+        Write the changed paths and the extra values to the dbus
+        """
+        if extra_values is None:
+            extra_values = {}
+
+        # written on every update, but only sent if it changed
+        extra_values["/Connected"] = 0 if self._charger.stale else 1
+
+        with self._charger.publish_lock:
+            received_at = self._charger.received_at
+            self._charger.received_at = None
+
+        if self._charger.dirty_paths and not self._charger.stale and type(self._charger.values["/Ac/Power"]["value"]) in (int, float):
+            logging.info(
+                "Data %s: %.2f W (messages processed: %i, skipped as unchanged: %i)",
+                self._charger.device_name,
+                self._charger.values["/Ac/Power"]["value"],
+                self._charger.stats["messages_processed"],
+                self._charger.stats["messages_skipped"],
+            )
+
+        if settings.dbus_batch_signals:
+            # emit all changed paths as one ItemsChanged signal when leaving the context
+            with self._dbusservice as ctx:
+                self._publish_dirty_paths(ctx)
+                for path, value in extra_values.items():
+                    self._write(ctx, path, value)
+                if ctx.changes:
+                    self._charger.stats["dbus_signals"] += 1
+        else:
+            self._publish_dirty_paths(self._dbusservice)
+            for path, value in extra_values.items():
+                self._write(self._dbusservice, path, value)
+
+        if received_at is not None:
+            self._charger.latency.observe(monotonic() - received_at)
+
+    def _publish_dirty_paths(self, target):
+        """
+        Write the changed paths to the dbus service or a ServiceContext of it
+        """
+        dirty_paths = self._charger.dirty_paths
+        values = self._charger.values
+
+        while dirty_paths:
+            setting = dirty_paths.pop()
+            value = values[setting]["value"]
+
+            try:
+                self._write(target, setting, value)
+
+            except TypeError as e:
+                logging.error('Received key "' + setting + '" with value "' + str(value) + '" is not valid: ' + str(e))
+                sys.exit()
+
+            except Exception:
+                exception_type, exception_object, exception_traceback = sys.exc_info()
+                file = exception_traceback.tb_frame.f_code.co_filename
+                line = exception_traceback.tb_lineno
+                logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+
+    def _write(self, target, path, value):
+        """
+        Write a value to the dbus service or a ServiceContext of it and count the changed values per path
+        """
+        if target[path] != value:
+            target[path] = value
+
+            emissions = self._charger.dbus_emissions
+            emissions[path] = emissions.get(path, 0) + 1
+            # without batching each changed value is sent as an own PropertiesChanged signal
+            if target is self._dbusservice:
+                self._charger.stats["dbus_signals"] += 1
+
+    def _remove(self):
+        """
+        Invalidate and remove all paths, release the service name and stop routing messages to the EV charger
+        """
+        self._charger.publish_handler = None
+        self._charger.save_energy()
+        discovery.remove_charger(self._charger)
+
+        if self._command_source is not None:
+            GLib.source_remove(self._command_source)
+            self._command_source = None
+
+        if self._stats_source is not None:
+            GLib.source_remove(self._stats_source)
+            self._stats_source = None
+
+        with self._dbusservice as ctx:
+            ctx.del_tree("/")
+
+        self._dbusservice.__del__()
+        self._bus.close()
+
     def _handlechangedvalue(self, path, value):
         logging.debug("someone else updated %s to %s" % (path, value))
+
+        # collect the commands, so that dragging a slider publishes only the last value
+        if path in COMMAND_PATHS and value is not None and self._charger.command_topic != "":
+            self._charger.commands_pending[path] = (value, monotonic())
+            if self._command_source is None:
+                self._command_source = GLib.timeout_add(settings.command_coalesce_time, self._send_commands)
+
+        # the EV charger doesn't get the value, so its own value is written again with the next update
+        elif path in self._charger.values:
+            self._charger.dirty_paths.add(path)
+
         return True  # accept the change
 
+    def _send_commands(self):
+        """
+        Publish the commands collected within command_coalesce_time to the command topic of the EV charger.
+        In the json topic mode all commands are sent as one payload, in the flat topic mode each command to <command_topic>/<path>
+        """
+        self._command_source = None
+
+        charger = self._charger
+        commands = charger.commands_pending
+        charger.commands_pending = {}
+
+        # all commands published together get the same ID
+        charger.command_id += 1
+
+        if charger.topic_mode == "flat":
+            messages = [(charger.command_topic + path, str(value)) for path, (value, written_at) in commands.items()]
+        else:
+            messages = [(charger.command_topic, json.dumps({path[1:]: value for path, (value, written_at) in commands.items()}))]
+
+        # track the commands before publishing, the EV charger could answer before publish() returns
+        with charger.commands_lock:
+            for path, (value, written_at) in commands.items():
+                charger.commands_sent[path] = (value, written_at, charger.command_id)
+
+        for topic, payload in messages:
+            result = mqtt_client.publish(topic, payload, qos=settings.mqtt_qos)
+
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                logging.error('Publishing the command "%s" to topic "%s" failed: %s' % (payload, topic, mqtt.error_string(result.rc)))
+            else:
+                logging.info('Published the command #%i "%s" to topic "%s"' % (charger.command_id, payload, topic))
+
+        charger.command_stats["commands_sent"] += len(commands)
+
+        return False  # remove the timer
+
+
+def is_fleet_mode():
+    """
+    Check if the driver handles multiple EV chargers, then the timeout of one EV charger doesn't stop the driver
+    """
+    return len(chargers) > 1 or discovery is not None
+
+
+def save_energy_all():
+    """
+    Save the calculated energy of all EV chargers, e.g. before the driver stops
+    """
+    if not settings.energy_calculation:
+        return
+
+    with chargers_lock:
+        chargers_list = list(chargers)
+
+    for charger in chargers_list:
+        charger.save_energy()
+
+
+def reload_config():
+    """
+    Read the config.ini again and apply the changed settings without restarting the driver.
+    Changed topics are subscribed in place, so the dbus services are kept
+    """
+    global settings
+
+    try:
+        new_config = configparser.ConfigParser()
+        if not new_config.read(config_file):
+            raise ValueError('The "%s" is not found' % config_file)
+        new_settings = get_settings(new_config)
+
+    except Exception:
+        exception_type, exception_object, exception_traceback = sys.exc_info()
+        file = exception_traceback.tb_frame.f_code.co_filename
+        line = exception_traceback.tb_lineno
+        logging.error(f"Config reload failed, keeping the current settings. Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+        return
+
+    old_settings = settings
+
+    # keep the settings, which are only applied on a restart
+    restart_settings = [name for name in RESTART_SETTINGS if getattr(new_settings, name) != getattr(old_settings, name)]
+    if restart_settings:
+        logging.warning("Config reloaded, but changing %s requires a restart of the driver" % ", ".join(restart_settings))
+        new_settings = new_settings._replace(**{name: getattr(old_settings, name) for name in restart_settings})
+
+    settings = new_settings
+
+    if new_settings == old_settings:
+        logging.info("Config reloaded, settings unchanged")
+        return
+
+    logging.getLogger().setLevel(new_settings.logging_level)
+    log_limited.window = new_settings.log_suppress_window
+
+    with chargers_lock:
+        chargers_configured = {charger.device_instance: charger for charger in chargers if not charger.discovered}
+
+    new_chargers_settings = {charger_settings.device_instance: charger_settings for charger_settings in new_settings.chargers}
+    if set(new_chargers_settings) != set(chargers_configured):
+        logging.warning("Config reloaded, but adding or removing EV chargers requires a restart of the driver")
+
+    for device_instance, charger in chargers_configured.items():
+        if device_instance not in new_chargers_settings:
+            continue
+
+        old_subscription_topic = charger.subscription_topic
+
+        with chargers_lock:
+            del chargers_matcher[old_subscription_topic]
+            charger.apply_settings(new_chargers_settings[device_instance])
+            chargers_matcher[charger.subscription_topic] = charger
+
+        if charger.subscription_topic != old_subscription_topic and mqtt_client is not None:
+            mqtt_client.unsubscribe(old_subscription_topic)
+            mqtt_client.subscribe(charger.subscription_topic, settings.mqtt_qos)
+            logging.info('Config reloaded, EV charger with device instance %i subscribed to topic "%s"' % (device_instance, charger.subscription_topic))
+
+    # the filters are applied to the configured and the discovered EV chargers
+    if new_settings.path_filters != old_settings.path_filters:
+        with chargers_lock:
+            for charger in chargers:
+                charger.apply_filters()
+
+    logging.info("Config reloaded, settings applied")
+
+
+def watch_config():
+    """
+    Reload the config.ini one second after it was changed, so that an editor has finished writing it
+    """
+    global config_monitor
+
+    # imported here, since it's only needed for the file monitor
+    from gi.repository import Gio  # pyright: ignore[reportMissingImports]
+
+    def on_timeout():
+        global config_reload_source
+        config_reload_source = None
+        reload_config()
+        return False
+
+    def on_changed(monitor, file, other_file, event_type):
+        global config_reload_source
+        if config_reload_source is not None:
+            GLib.source_remove(config_reload_source)
+        config_reload_source = GLib.timeout_add(1000, on_timeout)
+
+    # the monitor is stopped, when it's garbage collected
+    config_monitor = Gio.File.new_for_path(config_file).monitor_file(Gio.FileMonitorFlags.NONE, None)
+    config_monitor.connect("changed", on_changed)
+
+
+def get_portal_id():
+    """
+    Get the VRM portal ID used in the MQTT client ID. It's cached in the data directory,
+    since get_vrm_portal_id() starts /sbin/get-unique-id, which slows down the startup
+    """
+    file_name = os.path.join(data_directory, "portal_id")
+
+    try:
+        with open(file_name, "r") as file:
+            portal_id = file.read().strip()
+        if portal_id != "":
+            return portal_id
+    except OSError:
+        pass
+
+    portal_id = get_vrm_portal_id()
+
+    try:
+        os.makedirs(data_directory, exist_ok=True)
+        with open(file_name, "w") as file:
+            file.write(portal_id)
+    except OSError as e:
+        logging.warning("Could not cache the VRM portal ID: %s" % e)
+
+    return portal_id
+
+
+class LoopLagMonitor:
+    """
+    Measures how much later than scheduled the GLib main loop runs a timer. A high lag delays the dbus updates of all EV chargers
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.expected_at = None
+        self.lag = LatencyHistogram(LOOP_LAG_BUCKETS, 0)
+        self.last_lag = None
+
+    def start(self):
+        self.expected_at = monotonic() + self.interval / 1000
+        GLib.timeout_add(self.interval, self._check)
+
+    def _check(self):
+        now = monotonic()
+        self.last_lag = max(now - self.expected_at, 0)
+        self.lag.observe(self.last_lag)
+        self.expected_at = now + self.interval / 1000
+        return True
+
+
+loop_lag_monitor = LoopLagMonitor(1000)
+
+
+class MetricsRegistry:
+    """
+    Metrics in the Prometheus text format. Each metric is registered with a function returning its current samples,
+    so the counters on the ingest path stay plain integers and are only read when the metrics are requested
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        # (name, type, description, function returning a list of (labels, value))
+        self.metrics = []
+
+    def add(self, name, metric_type, description, collect):
+        self.metrics.append((self.prefix + name, metric_type, description, collect))
+
+    def render(self):
+        lines = []
+
+        for name, metric_type, description, collect in self.metrics:
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+
+            for labels, value in collect():
+                if metric_type == "histogram":
+                    buckets, total, count = value.snapshot()
+                    for bucket, bucket_count in buckets:
+                        lines.append("%s_bucket%s %i" % (name, format_metric_labels(dict(labels, le=format_metric_value(bucket))), bucket_count))
+                    lines.append("%s_sum%s %s" % (name, format_metric_labels(labels), format_metric_value(total)))
+                    lines.append("%s_count%s %i" % (name, format_metric_labels(labels), count))
+                else:
+                    lines.append("%s%s %s" % (name, format_metric_labels(labels), format_metric_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+def format_metric_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels.items()) + "}"
+
+
+def format_metric_value(value):
+    if value is None:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(value)
+
+
+def get_charger_samples(get_value):
+    """
+    Get a sample of each EV charger labeled with its device instance and topic
+    """
+    with chargers_lock:
+        chargers_list = list(chargers)
+
+    return [({"device_instance": charger.device_instance, "topic": charger.topic}, get_value(charger)) for charger in chargers_list]
+
+
+def get_dbus_emission_samples():
+    with chargers_lock:
+        chargers_list = list(chargers)
+
+    return [
+        ({"device_instance": charger.device_instance, "path": path}, count)
+        for charger in chargers_list
+        # copied at once, since the GLib main loop can add paths while the metrics are rendered
+        for path, count in list(charger.dbus_emissions.items())
+    ]
+
+
+def get_metrics_registry():
+    """
+    Register the metrics of the driver
+    """
+    registry = MetricsRegistry("dbus_mqtt_ev_charger_")
+
+    registry.add("mqtt_messages_received_total", "counter", "MQTT messages received", lambda: [({}, mqtt_stats["messages_received"])])
+    registry.add("mqtt_bytes_received_total", "counter", "Payload bytes of the received MQTT messages", lambda: [({}, mqtt_stats["bytes_received"])])
+    registry.add("mqtt_messages_dropped_max_age_total", "counter", "MQTT messages dropped, since they are older than message_max_age", lambda: [({}, mqtt_stats["messages_dropped_max_age"])])
+    registry.add("mqtt_connected", "gauge", "1 if connected to the MQTT broker", lambda: [({}, connected)])
+    registry.add("mqtt_reconnects_total", "counter", "Reconnects to the MQTT broker", lambda: [({}, reconnect_backoff.stats["reconnects"])])
+    registry.add("mqtt_reconnect_attempts_total", "counter", "Attempts to reconnect to the MQTT broker", lambda: [({}, reconnect_backoff.stats["reconnect_attempts"])])
+    # packets paho couldn't write to the socket yet, e.g. commands while the connection is slow.
+    # paho has no public API for the queue, so its private _out_packet deque is read on purpose. It's only read
+    # when the metrics are scraped and the length of a deque can be read safely from another thread
+    registry.add("mqtt_out_queue_depth", "gauge", "MQTT packets waiting to be sent", lambda: [({}, len(mqtt_client._out_packet) if mqtt_client is not None else 0)])
+
+    registry.add("messages_processed_total", "counter", "Messages with changed payload processed", lambda: get_charger_samples(lambda charger: charger.stats["messages_processed"]))
+    registry.add("messages_skipped_total", "counter", "Messages skipped, since the payload didn't change", lambda: get_charger_samples(lambda charger: charger.stats["messages_skipped"]))
+    registry.add("invalid_keys_total", "counter", "Invalid keys in the payloads or invalid sub topics", lambda: get_charger_samples(lambda charger: charger.stats["invalid_keys"]))
+    registry.add("decode_seconds", "histogram", "Time to decode the last payload, measured every stats_interval seconds", lambda: get_charger_samples(lambda charger: charger.decode_time))
+    registry.add("dbus_queue_depth", "gauge", "Changed paths waiting to be written to the dbus", lambda: get_charger_samples(lambda charger: len(charger.dirty_paths)))
+    registry.add("dbus_latency_seconds", "histogram", "Time from receiving a message until its values were written to the dbus", lambda: get_charger_samples(lambda charger: charger.latency))
+    registry.add("dbus_signals_total", "counter", "Signals emitted on the dbus", lambda: get_charger_samples(lambda charger: charger.stats["dbus_signals"]))
+    registry.add("dbus_emissions_total", "counter", "Changed values written to the dbus", get_dbus_emission_samples)
+    registry.add("stale", "gauge", "1 if no message was received within the timeout", lambda: get_charger_samples(lambda charger: int(charger.stale)))
+
+    registry.add("commands_sent_total", "counter", "Commands published to the command topic", lambda: get_charger_samples(lambda charger: charger.command_stats["commands_sent"]))
+    registry.add("commands_acknowledged_total", "counter", "Commands sent back by the EV charger", lambda: get_charger_samples(lambda charger: charger.command_stats["commands_acknowledged"]))
+    registry.add("commands_timed_out_total", "counter", "Commands not sent back by the EV charger within command_timeout", lambda: get_charger_samples(lambda charger: charger.command_stats["commands_timed_out"]))
+    registry.add("command_latency_seconds", "histogram", "Time from a write on the dbus until the EV charger sent back the value", lambda: get_charger_samples(lambda charger: charger.command_latency))
+
+    registry.add("glib_loop_lag_seconds", "histogram", "Delay of the GLib main loop running a timer", lambda: [({}, loop_lag_monitor.lag)])
+
+    return registry
+
+
+def start_metrics_server(listen):
+    """
+    Serve the metrics in the Prometheus text format on a local TCP port or Unix socket from a daemon thread
+    """
+    # only imported, if the metrics are enabled
+    import http.server
+    import socketserver
+    import stat
+
+    registry = get_metrics_registry()
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # the requests are not logged, since the metrics are requested every few seconds
+            pass
+
+    try:
+        if listen.startswith("/"):
+            # remove the socket of the last run, but never another file at this path
+            if os.path.lexists(listen):
+                if not stat.S_ISSOCK(os.lstat(listen).st_mode):
+                    raise ValueError("the path exists and is not a socket")
+                os.remove(listen)
+            server = socketserver.UnixStreamServer(listen, MetricsHandler)
+        else:
+            host, port = listen.rsplit(":", 1)
+            server = http.server.HTTPServer((host, int(port)), MetricsHandler)
+
+    except (OSError, ValueError) as e:
+        logging.error('Could not serve the metrics on "%s": %s' % (listen, e))
+        return
+
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info('Serving the metrics on "%s"' % listen)
+
+    # the delay of the GLib main loop is only measured for the metrics
+    loop_lag_monitor.start()
+
+
+def create_dbus_service(charger):
+    """
+    Create and register the dbus service of the EV charger. Returns False to be usable as GLib idle callback
+    """
+    paths_dbus = {
+        "/UpdateIndex": {"value": 0, "textformat": _n},
+    }
+    paths_dbus.update(charger.values)
+
+    DbusMqttEvChargerService(
+        charger=charger,
+        servicename="com.victronenergy.evcharger.mqtt_ev_charger_" + str(charger.device_instance),
+        deviceinstance=charger.device_instance,
+        customname=charger.device_name,
+        paths=paths_dbus,
+    )
+
+    return False
+
 
 def main():
+    global chargers, discovery, mqtt_client
+
     _thread.daemon = True  # allow the program to quit
 
     from dbus.mainloop.glib import (
@@ -452,66 +2536,129 @@ def main():
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
 
+    # create the EV chargers and route their topics
+    chargers = [EvCharger(**charger_settings._asdict()) for charger_settings in settings.chargers]
+    for charger in chargers:
+        chargers_matcher[charger.subscription_topic] = charger
+
+    # create EV chargers for new topics on the discovery topic
+    discovery = get_discovery_from_config(chargers)
+
     # MQTT setup
-    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id="MqttEvCharger_" + get_vrm_portal_id() + "_" + str(config["DEFAULT"]["device_instance"]))
+    # the client ID is the same on every start, so that the broker can resume a persistent session
+    client = mqtt.Client(
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        client_id="MqttEvCharger_" + get_portal_id() + "_" + str(settings.mqtt_client_id_instance),
+        protocol=settings.mqtt_protocol,
+        clean_session=None if settings.mqtt_protocol == mqtt.MQTTv5 else not settings.persistent_session,
+    )
     client.on_disconnect = on_disconnect
+    client.on_connect_fail = on_connect_fail
     client.on_connect = on_connect
     client.on_message = on_message
+    mqtt_client = client
 
     # check tls and use settings, if provided
-    if "tls_enabled" in config["MQTT"] and config["MQTT"]["tls_enabled"] == "1":
+    if settings.mqtt_tls_enabled:
         logging.info("MQTT client: TLS is enabled")
 
-        if "tls_path_to_ca" in config["MQTT"] and config["MQTT"]["tls_path_to_ca"] != "":
-            logging.info('MQTT client: TLS: custom ca "%s" used' % config["MQTT"]["tls_path_to_ca"])
-            client.tls_set(config["MQTT"]["tls_path_to_ca"], tls_version=2)
+        if settings.mqtt_tls_path_to_ca != "":
+            logging.info('MQTT client: TLS: custom ca "%s" used' % settings.mqtt_tls_path_to_ca)
+            client.tls_set(settings.mqtt_tls_path_to_ca, tls_version=2)
         else:
             client.tls_set(tls_version=2)
 
-        if "tls_insecure" in config["MQTT"] and config["MQTT"]["tls_insecure"] != "":
+        if settings.mqtt_tls_insecure:
             logging.info("MQTT client: TLS certificate server hostname verification disabled")
             client.tls_insecure_set(True)
 
     # check if username and password are set
-    if "username" in config["MQTT"] and "password" in config["MQTT"] and config["MQTT"]["username"] != "" and config["MQTT"]["password"] != "":
-        logging.info('MQTT client: Using username "%s" and password to connect' % config["MQTT"]["username"])
-        client.username_pw_set(username=config["MQTT"]["username"], password=config["MQTT"]["password"])
+    if settings.mqtt_username != "" and settings.mqtt_password != "":
+        logging.info('MQTT client: Using username "%s" and password to connect' % settings.mqtt_username)
+        client.username_pw_set(username=settings.mqtt_username, password=settings.mqtt_password)
 
     # connect to broker
-    logging.info(f"MQTT client: Connecting to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
-    client.connect(host=config["MQTT"]["broker_address"], port=int(config["MQTT"]["broker_port"]))
+    logging.info(f"MQTT client: Connecting to broker {settings.mqtt_broker_address} on port {settings.mqtt_broker_port}")
+    connect_options = {}
+    if settings.mqtt_protocol == mqtt.MQTTv5:
+        from paho.mqtt.properties import Properties
+        from paho.mqtt.packettypes import PacketTypes
+
+        connect_properties = Properties(PacketTypes.CONNECT)
+
+        if settings.persistent_session:
+            connect_options["clean_start"] = False
+            connect_properties.SessionExpiryInterval = settings.session_expiry
+
+        if settings.topic_alias_maximum != 0:
+            connect_properties.TopicAliasMaximum = settings.topic_alias_maximum
+
+        if settings.receive_maximum != 0:
+            connect_properties.ReceiveMaximum = settings.receive_maximum
+
+        connect_options["properties"] = connect_properties
+
+    client.connect(host=settings.mqtt_broker_address, port=settings.mqtt_broker_port, **connect_options)
     client.loop_start()
 
-    # wait to receive first data, else the JSON is empty and phase setup won't work
-    i = 0
-    while ev_charger_dict["/Ac/Power"]["value"] is None:
-        if i % 12 != 0 or i == 0:
-            logging.info("Waiting 5 seconds for receiving first data...")
-        else:
-            logging.warning("Waiting since %s seconds for receiving first data..." % str(i * 5))
+    if settings.metrics_listen != "":
+        start_metrics_server(settings.metrics_listen)
 
-        # check if timeout was exceeded
-        if timeout != 0 and timeout <= (i * 5):
-            logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
-            sys.exit()
+    wait_started = time()
+    logging.info("Startup: connected to MQTT broker %.3f seconds after the driver started" % (wait_started - startup_time))
 
-        sleep(5)
-        i += 1
+    # configured EV chargers, discovered EV chargers create their dbus service when they are added
+    chargers_configured = [charger for charger in chargers if not charger.discovered]
 
-    paths_dbus = {
-        "/UpdateIndex": {"value": 0, "textformat": _n},
-    }
-    paths_dbus.update(ev_charger_dict)
+    # wait to receive first data of any configured EV charger, else the JSON is empty and phase setup won't work.
+    # The dbus service of each EV charger is created by the GLib main loop right after its own first message,
+    # so an offline EV charger doesn't keep the others off the dbus. In the stale timeout mode the driver doesn't wait,
+    # since it's not stopped after the timeout
+    if chargers_configured and settings.timeout_mode == "exit":
+        topics = ", ".join('"%s"' % charger.topic for charger in chargers_configured)
+        if not chargers_first_data.is_set():
+            logging.info("Waiting for receiving first data on topic %s..." % topics)
 
-    DbusMqttEvChargerService(
-        servicename="com.victronenergy.evcharger.mqtt_ev_charger_" + str(config["DEFAULT"]["device_instance"]),
-        deviceinstance=int(config["DEFAULT"]["device_instance"]),
-        customname=config["DEFAULT"]["device_name"],
-        paths=paths_dbus,
-    )
+        while not chargers_first_data.wait(60 if settings.timeout == 0 else max(0, min(60, wait_started + settings.timeout - time()))):
+            waited = time() - wait_started
+
+            # check if timeout was exceeded
+            if settings.timeout != 0 and waited >= settings.timeout:
+                logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time on topic %s." % (settings.timeout, topics))
+                sys.exit()
+
+            logging.warning("Waiting since %i seconds for receiving first data on topic %s..." % (waited, topics))
+
+        logging.info("Startup: received first data %.3f seconds after connecting to the MQTT broker" % (time() - wait_started))
+
+    for charger in chargers_configured:
+        if not charger.first_data.is_set():
+            logging.info('Waiting for receiving first data on topic "%s", the EV charger is registered on the dbus when it\'s received' % charger.topic)
 
     logging.info("Connected to dbus and switching over to GLib.MainLoop() (= event based)")
     mainloop = GLib.MainLoop()
+
+    # save the calculated energy, when the driver is stopped or restarted by the service
+    def on_sigterm():
+        logging.info("Driver stopped by SIGTERM")
+        save_energy_all()
+        mainloop.quit()
+        return False
+
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, on_sigterm)
+
+    # reload the config.ini on SIGHUP, e.g. sent by "svc -h /service/dbus-mqtt-ev-charger"
+    def on_sighup():
+        logging.info("Reloading config.ini on SIGHUP")
+        reload_config()
+        return True
+
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGHUP, on_sighup)
+
+    # reload the config.ini when it's changed
+    if settings.config_reload_on_change:
+        watch_config()
+
     mainloop.run()
 
 
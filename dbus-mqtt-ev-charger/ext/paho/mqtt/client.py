@@ -31,8 +31,6 @@ import string
 import struct
 import threading
 import time
-import urllib.parse
-import urllib.request
 import uuid
 import warnings
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Sequence, Tuple, Union, cast
@@ -100,10 +98,22 @@ except ImportError:
     ssl = None  # type: ignore[assignment]
 
 
-try:
-    import socks  # type: ignore[import-untyped]
-except ImportError:
-    socks = None  # type: ignore[assignment]
+# PySocks and urllib.request are imported on first use by _import_socks(), since the proxy
+# support is rarely used and importing urllib.request takes about half of the import time
+socks = None
+_socks_imported = False
+
+
+def _import_socks():  # type: ignore[no-untyped-def]
+    global socks, _socks_imported
+    if not _socks_imported:
+        _socks_imported = True
+        try:
+            import socks as socks_module  # type: ignore[import-untyped]
+            socks = socks_module
+        except ImportError:
+            pass
+    return socks
 
 
 try:
@@ -112,13 +122,6 @@ try:
 except AttributeError:
     time_func = time.time
 
-try:
-    import dns.resolver
-
-    HAVE_DNS = True
-except ImportError:
-    HAVE_DNS = False
-
 
 if platform.system() == 'Windows':
     EAGAIN = errno.WSAEWOULDBLOCK  # type: ignore[attr-defined]
@@ -1361,7 +1364,7 @@ class Client:
 
             mqttc.proxy_set(proxy_type=socks.HTTP, proxy_addr='1.2.3.4', proxy_port=4231)
         """
-        if socks is None:
+        if _import_socks() is None:
             raise ValueError("PySocks must be installed for proxy support.")
         elif not self._proxy_is_valid(proxy_args):
             raise ValueError("proxy_type and/or proxy_addr are invalid.")
@@ -1450,9 +1453,13 @@ class Client:
         :param keepalive, bind_address, clean_start and properties: see `connect()`
         """
 
-        if HAVE_DNS is False:
+        # imported on first use, since the SRV lookup is rarely used
+        try:
+            import dns.rdatatype
+            import dns.resolver
+        except ImportError as err:
             raise ValueError(
-                'No DNS resolver library found, try "pip install dnspython".')
+                'No DNS resolver library found, try "pip install dnspython".') from err
 
         if domain is None:
             domain = socket.getfqdn()
@@ -4549,7 +4556,7 @@ class Client:
     @staticmethod
     def _proxy_is_valid(p) -> bool:  # type: ignore[no-untyped-def]
         def check(t, a) -> bool:  # type: ignore[no-untyped-def]
-            return (socks is not None and
+            return (_import_socks() is not None and
                     t in {socks.HTTP, socks.SOCKS4, socks.SOCKS5} and a)
 
         if isinstance(p, dict):
@@ -4560,9 +4567,12 @@ class Client:
             return False
 
     def _get_proxy(self) -> dict[str, Any] | None:
-        if socks is None:
+        if _import_socks() is None:
             return None
 
+        import urllib.parse
+        import urllib.request
+
         # First, check if the user explicitly passed us a proxy to use
         if self._proxy_is_valid(self._proxy):
             return self._proxy
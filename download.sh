@@ -142,6 +142,13 @@ if [ -f ${driver_path}/${driver_name_instance}/config.ini ]; then
     mv ${driver_path}/${driver_name_instance}/config.ini ${driver_path}/${driver_name_instance}_config.ini
 fi
 
+# If updating: backup existing data like the calculated energy
+if [ -d ${driver_path}/${driver_name_instance}/data ]; then
+    echo ""
+    echo "Backing up existing data..."
+    mv ${driver_path}/${driver_name_instance}/data ${driver_path}/${driver_name_instance}_data
+fi
+
 
 # If updating: cleanup existing driver
 if [ -d ${driver_path}/${driver_name_instance} ]; then
@@ -175,12 +182,12 @@ if [ "$driver_name" != "$driver_name_instance" ]; then
     sed -i 's:'${driver_name}':'${driver_name_instance}':g' ${driver_path}/${driver_name_instance}/service/log/run
 
     # add device_instance to the end of the line where device_name is found in the config sample file
-    sed -i '/device_name/s/$/ '${driver_instance}'/' ${driver_path}/${driver_name_instance}/config.sample.ini
+    sed -i '/^device_name = /s/$/ '${driver_instance}'/' ${driver_path}/${driver_name_instance}/config.sample.ini
 
     # change the device_instance from 100 to 100 + device_instance in the config sample file
-    config_file_device_instance=$(grep 'device_instance = ' ${driver_path}/${driver_name_instance}/config.sample.ini | awk -F' = ' '{print $2}')
+    config_file_device_instance=$(grep '^device_instance = ' ${driver_path}/${driver_name_instance}/config.sample.ini | awk -F' = ' '{print $2}')
     new_device_instance=$((config_file_device_instance + driver_instance))
-    sed -i 's/device_instance = 100/device_instance = '${new_device_instance}'/' ${driver_path}/${driver_name_instance}/config.sample.ini
+    sed -i 's/^device_instance = 100/device_instance = '${new_device_instance}'/' ${driver_path}/${driver_name_instance}/config.sample.ini
 
 fi
 
@@ -192,6 +199,13 @@ if [ -f ${driver_path}/${driver_name_instance}_config.ini ]; then
     mv ${driver_path}/${driver_name_instance}_config.ini ${driver_path}/${driver_name_instance}/config.ini
 fi
 
+# If updating: restore existing data
+if [ -d ${driver_path}/${driver_name_instance}_data ]; then
+    echo ""
+    echo "Restoring existing data..."
+    mv ${driver_path}/${driver_name_instance}_data ${driver_path}/${driver_name_instance}/data
+fi
+
 
 # set permissions for files
 echo ""
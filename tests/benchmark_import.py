@@ -0,0 +1,85 @@
+"""
+Compare the import time of the vendored paho.mqtt.client of the working tree with a baseline: by default the working tree
+with ext/paho/lazy-imports.patch reverted, which is the unchanged paho-mqtt, or the ext directory of a git revision.
+Each import runs in a new Python process with "python -X importtime", so no module is cached.
+
+Usage: python tests/benchmark_import.py [baseline] [--runs N]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from statistics import median
+
+from conftest import DRIVER_DIRECTORY
+
+
+def get_import_time(ext_directory, module):
+    """
+    Get the cumulative import time of the module in milliseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sys; sys.path.insert(1, %r); import %s" % (ext_directory, module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    # import time: self [us] | cumulative | imported package
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+
+    raise ValueError("The import time of %s was not reported" % module)
+
+
+def extract_ext(revision, directory):
+    """
+    Extract the ext directory of the driver of the git revision to the directory and return its path
+    """
+    archive = subprocess.run(["git", "archive", revision, "ext"], cwd=DRIVER_DIRECTORY, check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, "ext")
+
+
+def extract_unpatched_ext(directory):
+    """
+    Copy the ext directory of the working tree to the directory, revert the lazy imports patch and return its path
+    """
+    ext_directory = os.path.join(directory, "ext")
+    shutil.copytree(os.path.join(DRIVER_DIRECTORY, "ext"), ext_directory, ignore=shutil.ignore_patterns("__pycache__"))
+    # the paths in the patch start with a/dbus-mqtt-ev-charger/ext
+    subprocess.run(["git", "apply", "-R", "-p2", os.path.join(ext_directory, "paho", "lazy-imports.patch")], cwd=directory, check=True)
+    return ext_directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline", nargs="?", default="unpatched", help="git revision of the baseline or unpatched (default: unpatched)")
+    parser.add_argument("--module", default="paho.mqtt.client", help="imported module (default: paho.mqtt.client)")
+    parser.add_argument("--runs", type=int, default=21, help="imports per revision (default: 21)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = extract_unpatched_ext(directory) if args.baseline == "unpatched" else extract_ext(args.baseline, directory)
+        ext_directories = {args.baseline: baseline, "working tree": os.path.join(DRIVER_DIRECTORY, "ext")}
+        results = {name: [] for name in ext_directories}
+
+        # alternate between the revisions, so that changes of the CPU clock affect both
+        for _ in range(args.runs):
+            for name, ext_directory in ext_directories.items():
+                results[name].append(get_import_time(ext_directory, args.module))
+
+    for name, times in results.items():
+        print("%-16s median %.1f ms, best %.1f ms" % (name, median(times), min(times)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
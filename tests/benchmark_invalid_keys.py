@@ -0,0 +1,61 @@
+"""
+Compare the time on_message needs per message with two invalid keys in each payload at the WARNING logging level,
+with the warnings rate limited by log_suppress_window = 60 and with every warning logged (log_suppress_window = 0).
+The warnings are formatted and written to os.devnull.
+
+Usage: python tests/benchmark_invalid_keys.py [--messages N] [--rounds N]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from statistics import median
+
+from benchmark_on_message import get_source, load, run_round
+from conftest import read_config
+
+
+def get_payloads(messages):
+    """
+    Payloads with the invalid keys "Ac/Frequency" and "Temperature", in which the power changes with every message
+    """
+    return [b'{"Ac":{"Power":%i,"Frequency":50},"Current":%.1f,"Status":2,"Temperature":35}' % (power % 3680, (power % 3680) / 230) for power in range(messages)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="messages per round (default: 20000)")
+    parser.add_argument("--rounds", type=int, default=15, help="rounds per driver (default: 15)")
+    args = parser.parse_args()
+
+    source = get_source(None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        drivers = {
+            "rate limited": load(os.path.join(directory, "limited"), source),
+            "not limited": load(os.path.join(directory, "unlimited"), source, read_config({"log_suppress_window = 60": "log_suppress_window = 0"})),
+        }
+
+        # format and write the warnings like the driver, but not to the terminal
+        with open(os.devnull, "w") as devnull:
+            logging.root.handlers = [logging.StreamHandler(devnull)]
+            logging.root.setLevel(logging.WARNING)
+
+            payloads = get_payloads(args.messages)
+            results = {name: [] for name in drivers}
+
+            # warm up, then alternate between the drivers
+            for driver in drivers.values():
+                run_round(driver, payloads)
+            for _ in range(args.rounds):
+                for name, driver in drivers.items():
+                    results[name].append(run_round(driver, payloads))
+
+    for name, times in results.items():
+        print("%-16s median %.2f us/msg, best %.2f us/msg" % (name, median(times), min(times)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
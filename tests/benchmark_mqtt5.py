@@ -0,0 +1,100 @@
+"""
+Compare MQTT 3.1.1 and MQTT 5.0 with topic aliases: the bytes the broker sends to the driver per message and the time
+until the driver processed all messages. Runs the driver of the working tree against the broker stand-in in mqtt_broker.py,
+the EV charger publishes unique payloads of 64 bytes as fast as possible.
+
+Usage: python tests/benchmark_mqtt5.py [--messages N] [--qos 0|1] [--rounds N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from statistics import median
+from time import monotonic, perf_counter, sleep
+
+from benchmark_session import DRIVER_CLIENT_ID, start_driver, start_ev_charger, stop
+from conftest import TOPIC
+from mqtt_broker import Broker
+
+PROTOCOLS = {
+    "MQTT 3.1.1": {},
+    "MQTT 5.0, topic aliases": {"protocol = 3.1.1": "protocol = 5"},
+}
+PAYLOAD_SIZE = 64
+
+
+def get_payloads(count):
+    """
+    Returns unique JSON payloads of PAYLOAD_SIZE bytes, so that the driver doesn't skip them as republished
+    """
+    payloads = []
+    for i in range(count):
+        payload = json.dumps({"Ac": {"Power": 1000 + i}, "Status": 2, "Model": ""}).encode("utf-8")
+        payloads.append(payload.replace(b'""', b'"' + b"x" * (PAYLOAD_SIZE - len(payload)) + b'"'))
+    return payloads
+
+
+def get_bytes_sent(broker):
+    """
+    Returns the bytes the broker sent to the driver
+    """
+    return sum(count for client_id, count in broker.bytes_sent.items() if client_id and client_id.startswith(DRIVER_CLIENT_ID))
+
+
+def run_round(directory, replace, payloads, qos):
+    """
+    Returns the bytes per message sent to the driver and the seconds from the first publish until the driver processed all messages
+    """
+    with Broker() as broker:
+        driver, processed = start_driver(directory, broker, {**replace, "qos = 0": "qos = %i" % qos})
+        ev_charger = start_ev_charger(driver, broker)
+
+        try:
+            # wait until both are connected and subscribed, the bytes of the connect are not counted
+            while driver.connected != 1 or not ev_charger.is_connected():
+                sleep(0.01)
+            sleep(0.1)
+            bytes_sent = get_bytes_sent(broker)
+
+            started = perf_counter()
+            for payload in payloads:
+                ev_charger.publish(TOPIC, payload, qos=qos)
+
+            waited_until = monotonic() + 30
+            while len(processed) < len(payloads) and monotonic() < waited_until:
+                sleep(0.001)
+            seconds = perf_counter() - started
+        finally:
+            stop(ev_charger, driver.mqtt_client)
+
+        # the topic aliases are resolved, before the message is routed to the EV charger
+        assert [payload for topic, payload in processed] == payloads, "%i of %i messages processed" % (len(processed), len(payloads))
+        assert all(topic == TOPIC for topic, payload in processed)
+
+        return (get_bytes_sent(broker) - bytes_sent) / len(payloads), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000, help="messages published by the EV charger (default: 5000)")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0, help="QoS of the subscription and the messages (default: 0)")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds per protocol (default: 3)")
+    args = parser.parse_args()
+
+    payloads = get_payloads(args.messages)
+    results = {name: [] for name in PROTOCOLS}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.rounds):
+            for n, (name, replace) in enumerate(PROTOCOLS.items()):
+                results[name].append(run_round(os.path.join(directory, "driver_%i_%i" % (n, i)), replace, payloads, args.qos))
+
+    print("%-26s %16s %16s" % ("median of %i rounds" % args.rounds, "bytes/message", "seconds"))
+    for name, rounds in results.items():
+        print("%-26s %16.1f %16.3f" % (name, median(bytes_per_message for bytes_per_message, seconds in rounds), median(seconds for bytes_per_message, seconds in rounds)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Compare the time on_message needs per message of the driver of two git revisions or of a revision and the working tree.
+The rounds of both drivers are interleaved in one process, so that changes of the CPU clock affect both.
+
+Usage: python tests/benchmark_on_message.py [baseline] [revision] [--messages N] [--rounds N]
+E.g. the overhead of a commit: python tests/benchmark_on_message.py <commit>~1 <commit>
+Both revisions need the EvCharger class and the settings object, compare older revisions with benchmark_parse_payload.py
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from conftest import DRIVER_DIRECTORY, Message, load_driver_from, read_config
+
+
+def load(directory, source, config=None):
+    """
+    Load the driver source with the config.ini text, by default the config.sample.ini, and create the dbus service of its EV charger
+    """
+    config = read_config() if config is None else config
+    driver = load_driver_from(directory, source, config, module_name="dbus_mqtt_ev_charger_" + os.path.basename(directory))
+    charger = driver.EvCharger(**driver.settings.chargers[0]._asdict())
+    driver.chargers.append(charger)
+    driver.chargers_matcher[charger.subscription_topic] = charger
+    driver.create_dbus_service(charger)
+    return driver
+
+
+def get_payloads(messages):
+    """
+    Payloads of a three phase EV charger, in which the power changes with every message
+    """
+    return [
+        b'{"Ac":{"Power":%i,"L1":{"Power":%i},"L2":{"Power":%i},"L3":{"Power":%i},"Energy":{"Forward":%.3f}},"Current":%.1f,"Status":2,"Mode":0}'
+        % (3 * (power % 3680), power % 3680, power % 3680, power % 3680, power / 1000, (power % 3680) / 230)
+        for power in range(messages)
+    ]
+
+
+def run_round(driver, payloads):
+    """
+    Returns the microseconds on_message needed per message
+    """
+    topic = driver.chargers[0].topic
+    messages = [Message(topic, payload) for payload in payloads]
+
+    started = perf_counter()
+    for message in messages:
+        driver.on_message(None, None, message)
+    elapsed = perf_counter() - started
+
+    driver.glib.run_idle()
+    return elapsed / len(messages) * 1000000
+
+
+def get_source(revision):
+    """
+    Get the driver of the git revision or of the working tree, if revision is None
+    """
+    if revision is None:
+        with open(os.path.join(DRIVER_DIRECTORY, "dbus-mqtt-ev-charger.py")) as file:
+            return file.read()
+
+    return subprocess.run(["git", "show", revision + ":dbus-mqtt-ev-charger/dbus-mqtt-ev-charger.py"], cwd=DRIVER_DIRECTORY, check=True, capture_output=True, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline", nargs="?", default="HEAD", help="git revision of the baseline driver (default: HEAD)")
+    parser.add_argument("revision", nargs="?", default=None, help="git revision of the compared driver (default: working tree)")
+    parser.add_argument("--messages", type=int, default=20000, help="messages per round (default: 20000)")
+    parser.add_argument("--rounds", type=int, default=15, help="rounds per driver (default: 15)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        drivers = {
+            args.baseline: load(os.path.join(directory, "baseline"), get_source(args.baseline)),
+            args.revision or "working tree": load(os.path.join(directory, "current"), get_source(args.revision)),
+        }
+        payloads = get_payloads(args.messages)
+        results = {name: [] for name in drivers}
+
+        # warm up, then alternate between the drivers
+        for driver in drivers.values():
+            run_round(driver, payloads)
+        for _ in range(args.rounds):
+            for name, driver in drivers.items():
+                results[name].append(run_round(driver, payloads))
+
+    for name, times in results.items():
+        print("%-16s median %.2f us/msg, best %.2f us/msg" % (name, median(times), min(times)))
+
+    baseline, current = (results[name] for name in drivers)
+    print("overhead         median %+.1f%%, best %+.1f%%" % ((median(current) / median(baseline) - 1) * 100, (min(current) / min(baseline) - 1) * 100))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Compare the time to store the values of the README sample payload of the walk of the original driver, three nested loops
+building the dbus path of each key, with parse_json_payload, which walks the key tree compiled at startup and then stores the changed values.
+The payloads are decoded before, so only the walks are measured.
+
+Usage: python tests/benchmark_parse_payload.py [--messages N] [--rounds N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from conftest import DRIVER_DIRECTORY, load_driver_from, read_config
+
+
+def walk_nested_loops(jsonpayload, ev_charger_dict):
+    """
+    The walk of on_message of the original driver, until it was replaced by parse_json_payload
+    """
+    for key_1, data_1 in jsonpayload.items():
+
+        key = "/" + key_1
+
+        if type(data_1) is dict:
+
+            for key_2, data_2 in data_1.items():
+
+                key = "/" + key_1 + "/" + key_2
+
+                if type(data_2) is dict:
+
+                    for key_3, data_3 in data_2.items():
+
+                        key = "/" + key_1 + "/" + key_2 + "/" + key_3
+
+                        if key in ev_charger_dict and (type(data_3) is str or type(data_3) is int or type(data_3) is float):
+                            ev_charger_dict[key]["value"] = data_3
+                        else:
+                            logging.warning('Received key "' + str(key) + '" with value "' + str(data_3) + '" is not valid')
+
+                else:
+
+                    if key in ev_charger_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float):
+                        ev_charger_dict[key]["value"] = data_2
+                    else:
+                        logging.warning('Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
+
+        else:
+
+            if key in ev_charger_dict and (type(data_1) is str or type(data_1) is int or type(data_1) is float):
+                ev_charger_dict[key]["value"] = data_1
+            else:
+                logging.warning('Received key "' + str(key) + '" with value "' + str(data_1) + '" is not valid')
+
+
+def get_payloads(driver, messages):
+    """
+    Decoded README sample payloads, in which the powers change with every message
+    """
+    payloads = []
+    for power in range(messages):
+        payload = json.loads(driver.JSON_SAMPLE_PAYLOAD)
+        payload["Ac"]["Power"] = 3 * (power % 3680)
+        for phase in ("L1", "L2", "L3"):
+            payload["Ac"][phase]["Power"] = power % 3680
+        payloads.append(payload)
+    return payloads
+
+
+def run_round(walk, payloads):
+    """
+    Returns the microseconds the walk needed per payload
+    """
+    started = perf_counter()
+    for payload in payloads:
+        walk(payload)
+    return (perf_counter() - started) / len(payloads) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="payloads per round (default: 20000)")
+    parser.add_argument("--rounds", type=int, default=15, help="rounds per walk (default: 15)")
+    args = parser.parse_args()
+
+    with open(os.path.join(DRIVER_DIRECTORY, "dbus-mqtt-ev-charger.py")) as file:
+        source = file.read()
+
+    with tempfile.TemporaryDirectory() as directory:
+        driver = load_driver_from(os.path.join(directory, "driver"), source, read_config())
+
+    charger = driver.EvCharger(**driver.settings.chargers[0]._asdict())
+    ev_charger_dict = {path: dict(data) for path, data in driver.ev_charger_dict.items()}
+
+    def walk_compiled(payload):
+        charger.parse_json_payload(payload, set())
+        # emptied by the GLib main loop in the driver
+        charger.dirty_paths.clear()
+
+    walks = {
+        "nested loops": lambda payload: walk_nested_loops(payload, ev_charger_dict),
+        "parse_json_payload": walk_compiled,
+    }
+    payloads = get_payloads(driver, args.messages)
+    results = {name: [] for name in walks}
+
+    # warm up, then alternate between the walks
+    for walk in walks.values():
+        run_round(walk, payloads)
+    for _ in range(args.rounds):
+        for name, walk in walks.items():
+            results[name].append(run_round(walk, payloads))
+
+    for name, times in results.items():
+        print("%-20s median %.2f us/msg, best %.2f us/msg" % (name, median(times), min(times)))
+
+    baseline, current = results.values()
+    print("change               median %+.1f%%, best %+.1f%%" % ((median(current) / median(baseline) - 1) * 100, (min(current) / min(baseline) - 1) * 100))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Compare the bytes on the wire and the decode time of the README sample payload as compact JSON, MessagePack and CBOR
+with all decoders of the driver, which are installed.
+
+Usage: python tests/benchmark_payload_formats.py [--messages N] [--rounds N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+from conftest import DRIVER_DIRECTORY, load_driver_from, read_config
+
+
+def encode_payloads(payload):
+    """
+    Encode the decoded payload in each format, for which the encoder is installed
+    """
+    payloads = {"json": json.dumps(payload, separators=(",", ":")).encode("utf-8")}
+
+    try:
+        import msgpack  # pyright: ignore[reportMissingImports]
+
+        payloads["msgpack"] = msgpack.packb(payload)
+    except ImportError:
+        print("msgpack is not installed, MessagePack is skipped")
+
+    try:
+        import cbor2  # pyright: ignore[reportMissingImports]
+
+        payloads["cbor"] = cbor2.dumps(payload)
+    except ImportError:
+        print("cbor2 is not installed, CBOR is skipped")
+
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="payloads per round (default: 20000)")
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per decoder, the best is shown (default: 5)")
+    args = parser.parse_args()
+
+    with open(os.path.join(DRIVER_DIRECTORY, "dbus-mqtt-ev-charger.py")) as file:
+        source = file.read()
+
+    with tempfile.TemporaryDirectory() as directory:
+        driver = load_driver_from(os.path.join(directory, "driver"), source, read_config())
+
+    payloads = encode_payloads(json.loads(driver.JSON_SAMPLE_PAYLOAD))
+
+    # the JSON payload with each JSON decoder and the other formats with their decoder
+    decoders = [("json", name, decoder) for name, decoder in driver.get_json_decoders().items()]
+    decoders += [(payload_format, payload_format, decoder) for payload_format, decoder in driver.payload_decoders.items() if payload_format != "json" and payload_format in payloads]
+    decoders += [(payload_format, "auto", driver.decode_payload_auto) for payload_format in payloads if payload_format in driver.payload_decoders]
+
+    print("%-8s %-8s %6s %12s" % ("format", "decoder", "bytes", "us/msg"))
+    for payload_format, name, decoder in decoders:
+        payload = payloads[payload_format]
+        assert decoder(payload) == json.loads(driver.JSON_SAMPLE_PAYLOAD)
+        seconds = min(timeit.repeat(lambda: decoder(payload), number=args.messages, repeat=args.rounds))
+        print("%-8s %-8s %6i %12.2f" % (payload_format, name, len(payload), seconds / args.messages * 1000000))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
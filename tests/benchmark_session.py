@@ -0,0 +1,122 @@
+"""
+Count the samples the driver processes, when its connection to the MQTT broker is dropped while the EV charger publishes.
+Runs the driver of the working tree against the broker stand-in in mqtt_broker.py, once with QoS 0 without a persistent
+session and once with QoS 1 and a persistent session, in which the broker keeps the samples until the driver reconnected.
+The EV charger publishes with QoS 1 and stays connected.
+
+Usage: python tests/benchmark_session.py [--samples N] [--interval SECONDS] [--outage SECONDS] [--protocol 3.1.1|5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import monotonic, sleep
+
+from conftest import DRIVER_DIRECTORY, TOPIC, load_driver_from, read_config
+from mqtt_broker import Broker
+
+SCENARIOS = {
+    "qos 0, no persistent session": {"qos = 0": "qos = 0", "persistent_session = 0": "persistent_session = 0"},
+    "qos 1, persistent session": {"qos = 0": "qos = 1", "persistent_session = 0": "persistent_session = 1"},
+}
+
+# prefix of the client ID of the driver
+DRIVER_CLIENT_ID = "MqttEvCharger_"
+
+
+def start_driver(directory, broker, replace):
+    """
+    Load the driver of the working tree connecting to the broker, in which the strings of replace are replaced in the config.ini,
+    and run main(). Returns the driver and the list of (topic, payload) of the messages it processes
+    """
+    with open(os.path.join(DRIVER_DIRECTORY, "dbus-mqtt-ev-charger.py")) as file:
+        source = file.read()
+    config = read_config(
+        {
+            "broker_port = 1883": "broker_port = %i" % broker.port,
+            # the driver doesn't wait for the first data and isn't stopped by the timeout
+            "timeout_mode = exit": "timeout_mode = stale",
+            "logging = WARNING": "logging = ERROR",
+            **replace,
+        }
+    )
+    driver = load_driver_from(directory, source, config, module_name="dbus_mqtt_ev_charger_" + os.path.basename(directory))
+
+    processed = []
+    handle_message = driver.handle_message
+
+    def count_message(charger, msg):
+        processed.append((msg.topic, msg.payload))
+        handle_message(charger, msg)
+
+    driver.handle_message = count_message
+    driver.main()
+
+    return driver, processed
+
+
+def start_ev_charger(driver, broker):
+    """
+    Returns a connected MQTT client publishing like the EV charger
+    """
+    ev_charger = driver.mqtt.Client(callback_api_version=driver.mqtt.CallbackAPIVersion.VERSION2, client_id="ev-charger")
+    ev_charger.connect("127.0.0.1", broker.port)
+    ev_charger.loop_start()
+    return ev_charger
+
+
+def stop(*clients):
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+
+
+def run_scenario(directory, replace, args):
+    """
+    Returns the powers processed by the driver and the reconnect stats of the driver
+    """
+    with Broker() as broker:
+        replace = {**replace, "protocol = 3.1.1": "protocol = %s" % args.protocol, "reconnect_delay_max = 120": "reconnect_delay_max = 2"}
+        driver, processed = start_driver(directory, broker, replace)
+        ev_charger = start_ev_charger(driver, broker)
+
+        try:
+            started = monotonic()
+            for i in range(args.samples):
+                if i == args.samples // 4:
+                    broker.drop(DRIVER_CLIENT_ID, args.outage)
+                sleep(max(0, started + i * args.interval - monotonic()))
+                ev_charger.publish(TOPIC, json.dumps({"Ac": {"Power": 1000 + i}}), qos=1)
+
+            # wait until the driver reconnected and received the queued samples
+            waited_until = monotonic() + 10
+            while monotonic() < waited_until and (driver.connected != 1 or len(set(processed)) < args.samples):
+                sleep(0.1)
+            sleep(0.5)
+        finally:
+            stop(ev_charger, driver.mqtt_client)
+
+        return [json.loads(payload)["Ac"]["Power"] for topic, payload in processed], driver.reconnect_backoff.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=40, help="samples published by the EV charger (default: 40)")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between the samples (default: 0.2)")
+    parser.add_argument("--outage", type=float, default=3, help="seconds the broker refuses the reconnect of the driver (default: 3)")
+    parser.add_argument("--protocol", choices=("3.1.1", "5"), default="3.1.1", help="MQTT protocol of the driver (default: 3.1.1)")
+    args = parser.parse_args()
+
+    print("%-30s %10s %10s %26s" % ("scenario", "processed", "lost", "reconnect to first data"))
+    with tempfile.TemporaryDirectory() as directory:
+        for n, (name, replace) in enumerate(SCENARIOS.items()):
+            processed, stats = run_scenario(os.path.join(directory, "driver_%i" % n), replace, args)
+            received = len(set(processed))
+            first_data = stats["last_reconnect_to_first_data_seconds"]
+            print("%-30s %4i of %-3i %10i %26s" % (name, received, args.samples, args.samples - received, "-" if first_data is None else "%.4f s" % first_data))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
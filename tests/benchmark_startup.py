@@ -0,0 +1,77 @@
+"""
+Measure the startup of the driver of two git revisions or of a revision and the working tree with the stubs of the tests:
+the time to import the driver, until it connects to the MQTT broker and until the values of the first message are on the dbus.
+The stubbed MQTT client delivers the first message after --delay seconds. The packages imported by the driver are cached
+in the process after the first startup, so the import time is mostly the one of the driver itself.
+
+Usage: python tests/benchmark_startup.py [baseline] [revision] [--delay SECONDS] [--rounds N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from benchmark_on_message import get_source
+from conftest import TOPIC, Client, Message, get_services, load_driver_from, read_config
+
+PAYLOAD = b'{"Ac":{"Power":2300}}'
+
+
+def run_startup(directory, source, delay):
+    """
+    Returns the seconds from starting the import of the driver until it's imported, connected and published the first values
+    """
+    times = {}
+
+    class TimedClient(Client):
+        messages = [(delay, Message(TOPIC, PAYLOAD))]
+
+        def connect(self, host, port, **kwargs):
+            times["connect"] = perf_counter()
+            super().connect(host, port, **kwargs)
+
+    started = perf_counter()
+    driver = load_driver_from(directory, source, read_config(), module_name="dbus_mqtt_ev_charger_" + os.path.basename(directory))
+    times["import"] = perf_counter()
+
+    original_client = driver.mqtt.Client
+    driver.mqtt.Client = TimedClient
+    try:
+        driver.main()
+        # the stubbed main loop returns at once, the sources added until then are run here
+        driver.glib.run_idle()
+    finally:
+        driver.mqtt.Client = original_client
+
+    assert any(service._dbusservice["/Ac/Power"] == 2300 for service in get_services(driver))
+    times["first publish"] = perf_counter()
+
+    return {name: seconds - started for name, seconds in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline", nargs="?", default="HEAD", help="git revision of the baseline driver (default: HEAD)")
+    parser.add_argument("revision", nargs="?", default=None, help="git revision of the compared driver (default: working tree)")
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds after connecting until the first message is delivered (default: 0.2)")
+    parser.add_argument("--rounds", type=int, default=3, help="startups per driver (default: 3)")
+    args = parser.parse_args()
+
+    sources = {args.baseline: get_source(args.baseline), args.revision or "working tree": get_source(args.revision)}
+    results = {name: [] for name in sources}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.rounds):
+            for n, (name, source) in enumerate(sources.items()):
+                results[name].append(run_startup(os.path.join(directory, "driver_%i_%i" % (n, i)), source, args.delay))
+
+    print("%-16s %10s %10s %14s" % ("median seconds", "import", "connect", "first publish"))
+    for name, runs in results.items():
+        print("%-16s %10.3f %10.3f %14.3f" % (name, *(median(run[step] for run in runs) for step in ("import", "connect", "first publish"))))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""
+Loads the driver with stubs for GLib, dbus and the Victron packages, which are only available on Venus OS
+"""
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+DRIVER_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dbus-mqtt-ev-charger")
+
+# topic of the EV charger in the config.sample.ini
+TOPIC = "custom/ev-charger"
+
+
+class MainLoop:
+    def run(self):
+        # returns at once, the tests run the sources with GLib.run_idle()
+        pass
+
+    def quit(self):
+        pass
+
+
+class GLib:
+    """
+    Records the sources instead of running a main loop, the tests run them with run_idle()
+    """
+
+    MainLoop = MainLoop
+    PRIORITY_DEFAULT = 0
+    PRIORITY_HIGH = -100
+
+    def __init__(self):
+        self.idle = []
+        self.timeouts = []
+        self.removed = []
+        # signal number -> handler
+        self.signal_handlers = {}
+
+    def idle_add(self, function, *args, **kwargs):
+        self.idle.append((function, args))
+        return len(self.idle)
+
+    def timeout_add(self, interval, function, *args):
+        self.timeouts.append((interval, function, args))
+        return len(self.timeouts)
+
+    def timeout_add_seconds(self, interval, function, *args):
+        return self.timeout_add(interval * 1000, function, *args)
+
+    def source_remove(self, source):
+        self.removed.append(source)
+
+    def unix_signal_add(self, priority, signum, function):
+        self.signal_handlers[signum] = function
+
+    def run_idle(self):
+        while self.idle:
+            function, args = self.idle.pop(0)
+            function(*args)
+
+
+class BusItem:
+    def __init__(self, value, onchangecallback):
+        self.value = value
+        self.onchangecallback = onchangecallback
+        self.deleted = False
+
+    def _local_set_value(self, value):
+        if self.value == value:
+            return None
+        self.value = value
+        return {"Value": value}
+
+    def SetValue(self, value):
+        """
+        Write from another process, like VeDbusItemExport.SetValue
+        """
+        if value == self.value:
+            return 0
+        if self.onchangecallback is None or self.onchangecallback(self.path, value):
+            self.value = value
+            return 0
+        return 2
+
+
+class ServiceContext:
+    def __init__(self, parent):
+        self.parent = parent
+        self.changes = {}
+
+    def __getitem__(self, path):
+        return self.parent[path]
+
+    def __setitem__(self, path, value):
+        change = self.parent._dbusobjects[path]._local_set_value(value)
+        if change is not None:
+            self.changes[path] = change
+
+    def __contains__(self, path):
+        return path in self.parent
+
+    def del_tree(self, root):
+        for path in list(self.parent._dbusobjects):
+            self[path] = None
+
+    def flush(self):
+        if self.changes:
+            self.parent.signals.append(dict(self.changes))
+            self.changes.clear()
+
+
+class VeDbusService:
+    """
+    Records the emitted signals, one dict of changed paths per signal
+    """
+
+    def __init__(self, servicename, bus=None, register=True):
+        self.servicename = servicename
+        self._dbusobjects = {}
+        self.signals = []
+        self.contexts = []
+        self.deleted = False
+
+    def add_path(self, path, value, description="", writeable=False, onchangecallback=None, gettextcallback=None, **kwargs):
+        self._dbusobjects[path] = BusItem(value, onchangecallback)
+        self._dbusobjects[path].path = path
+
+    def register(self):
+        pass
+
+    def __getitem__(self, path):
+        return self._dbusobjects[path].value
+
+    def __setitem__(self, path, value):
+        change = self._dbusobjects[path]._local_set_value(value)
+        if change is not None:
+            self.signals.append({path: change})
+
+    def __contains__(self, path):
+        return path in self._dbusobjects
+
+    def __enter__(self):
+        self.contexts.append(ServiceContext(self))
+        return self.contexts[-1]
+
+    def __exit__(self, *exc):
+        self.contexts.pop().flush()
+
+    def __del__(self):
+        self.deleted = True
+        self._dbusobjects.clear()
+
+
+class Bus:
+    def close(self):
+        pass
+
+
+class Message:
+    """
+    MQTT message like paho.mqtt.client.MQTTMessage
+    """
+
+    def __init__(self, topic, payload, timestamp=None, retain=False, properties=None):
+        self._topic = topic.encode("utf-8")
+        self.payload = payload
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self.retain = retain
+        # MQTT 5.0 properties, e.g. TopicAlias and MessageExpiryInterval
+        self.properties = properties
+        self.qos = 0
+
+    @property
+    def topic(self):
+        return self._topic.decode("utf-8")
+
+    @topic.setter
+    def topic(self, value):
+        # like paho, the topic is set as bytes
+        self._topic = value
+
+
+class PublishResult:
+    rc = 0
+
+
+class Client:
+    """
+    MQTT client like paho.mqtt.client.Client, which delivers the messages given to it after connecting
+    """
+
+    # (seconds after loop_start(), Message) delivered to on_message, set by the tests before main() creates the client
+    messages = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.subscriptions = []
+        self.unsubscriptions = []
+        self.published = []
+        self._out_packet = []
+
+    def connect(self, host, port, **kwargs):
+        self.broker = (host, port)
+        self.on_connect(self, None, None, 0, None)
+
+    def username_pw_set(self, username, password):
+        self.credentials = (username, password)
+
+    def loop_start(self):
+        def deliver():
+            started = time.monotonic()
+            for delay, message in self.messages:
+                time.sleep(max(0, started + delay - time.monotonic()))
+                message.timestamp = time.monotonic()
+                self.on_message(self, None, message)
+
+        # without delays the messages are delivered before loop_start() returns
+        if any(delay for delay, message in self.messages):
+            threading.Thread(target=deliver, daemon=True).start()
+        else:
+            deliver()
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append((topic, qos))
+
+    def unsubscribe(self, topic):
+        self.unsubscriptions.append(topic)
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append((topic, payload))
+        return PublishResult()
+
+    def reconnect_delay_set(self, min_delay, max_delay):
+        self.reconnect_delay = (min_delay, max_delay)
+
+
+class Gio:
+    """
+    File monitor of the config.ini, the tests report a change with changed()
+    """
+
+    class FileMonitorFlags:
+        NONE = 0
+
+    class File:
+        @staticmethod
+        def new_for_path(path):
+            return Gio.File()
+
+        def __init__(self):
+            self.callbacks = []
+
+        def monitor_file(self, flags, cancellable):
+            return self
+
+        def connect(self, signal, callback):
+            self.callbacks.append(callback)
+
+        def changed(self):
+            for callback in self.callbacks:
+                callback(self, self, None, 1)
+
+
+def install_stubs(glib):
+    gi = types.ModuleType("gi")
+    repository = types.ModuleType("gi.repository")
+    repository.GLib = glib
+    repository.Gio = Gio
+    gi.repository = repository
+    sys.modules["gi"] = gi
+    sys.modules["gi.repository"] = repository
+
+    dbus = types.ModuleType("dbus")
+    dbus.SystemBus = dbus.SessionBus = lambda private=False: Bus()
+    sys.modules["dbus"] = dbus
+    for name in ("dbus.service", "dbus.mainloop", "dbus.mainloop.glib"):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules["dbus.mainloop.glib"].DBusGMainLoop = lambda set_as_default=False: None
+
+    vedbus = types.ModuleType("vedbus")
+    vedbus.VeDbusService = VeDbusService
+    vedbus.ServiceContext = ServiceContext
+    sys.modules["vedbus"] = vedbus
+
+    ve_utils = types.ModuleType("ve_utils")
+    ve_utils.get_vrm_portal_id = lambda: "000000000000"
+    sys.modules["ve_utils"] = ve_utils
+
+
+def load_driver_from(directory, source, config, module_name="dbus_mqtt_ev_charger"):
+    """
+    Import the driver source with the config.ini text from the directory, in which the driver is copied
+    """
+    # the driver reads the config.ini and the packages from its own directory
+    os.makedirs(directory)
+    with open(os.path.join(directory, "config.ini"), "w") as file:
+        file.write(config)
+    # copied, since the driver resolves symlinks to find the config.ini and the data directory
+    with open(os.path.join(directory, "dbus-mqtt-ev-charger.py"), "w") as file:
+        file.write(source)
+    os.symlink(os.path.join(DRIVER_DIRECTORY, "ext"), os.path.join(directory, "ext"))
+
+    glib = GLib()
+    install_stubs(glib)
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, "dbus-mqtt-ev-charger.py"))
+    driver = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(driver)
+    driver.glib = glib
+    return driver
+
+
+def read_config(replace=None):
+    """
+    Read the config.sample.ini with a valid broker address, in which the strings of replace are replaced
+    """
+    with open(os.path.join(DRIVER_DIRECTORY, "config.sample.ini")) as file:
+        config = file.read().replace("IP_ADDR_OR_FQDN", "127.0.0.1")
+    for old, new in (replace or {}).items():
+        assert old in config, old
+        config = config.replace(old, new)
+    return config
+
+
+def run_main(driver, monkeypatch, messages=()):
+    """
+    Run main() of the driver with an MQTT client delivering the (seconds after connecting, Message) and run the sources
+    it added to the GLib main loop
+    """
+    monkeypatch.setattr(driver.mqtt, "Client", type("Client", (Client,), {"messages": list(messages)}))
+    driver.main()
+    driver.glib.run_idle()
+
+
+@pytest.fixture
+def load_driver(tmp_path):
+    """
+    Import the driver with the config.sample.ini, in which the strings of replace are replaced
+    """
+
+    def load(replace=None):
+        with open(os.path.join(DRIVER_DIRECTORY, "dbus-mqtt-ev-charger.py")) as file:
+            source = file.read()
+        return load_driver_from(str(tmp_path / "driver"), source, read_config(replace))
+
+    return load
+
+
+def get_services(driver):
+    """
+    Get the created DbusMqttEvChargerService instances by their timer of _update
+    """
+    return [function.__self__ for interval, function, args in driver.glib.timeouts if function.__name__ == "_update"]
+
+
+class EvChargerUnderTest:
+    """
+    The loaded driver with the EV charger of the config.ini and its dbus service
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.glib = driver.glib
+
+        self.charger = driver.EvCharger(**driver.settings.chargers[0]._asdict())
+        driver.chargers.append(self.charger)
+        driver.chargers_matcher[self.charger.subscription_topic] = self.charger
+
+        driver.create_dbus_service(self.charger)
+        self.service = get_services(driver)[0]
+        self.dbus = self.service._dbusservice
+
+    def receive(self, payload, topic=TOPIC, timestamp=None, properties=None):
+        self.driver.on_message(None, None, Message(topic, payload, timestamp, properties=properties))
+
+    def value(self, path):
+        return self.charger.values[path]["value"]
+
+
+@pytest.fixture
+def ev_charger(load_driver):
+    def create(replace=None):
+        return EvChargerUnderTest(load_driver(replace))
+
+    return create
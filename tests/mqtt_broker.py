@@ -0,0 +1,470 @@
+"""
+Minimal MQTT 3.1.1 and 5.0 broker on localhost for the benchmarks, since a real broker is not available everywhere.
+It supports QoS 0 and 1, retained messages, persistent sessions, topic aliases sent to the subscribers and the
+Message Expiry Interval. The connection of a client can be dropped and refused for some seconds to simulate an outage.
+Will messages, QoS 2, authentication and most checks of a real broker are missing.
+"""
+
+import socket
+import struct
+import threading
+from time import monotonic
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# MQTT 5.0 property identifier -> type
+PROPERTY_TYPES = {
+    0x01: "byte",
+    0x02: "int4",
+    0x03: "str",
+    0x08: "str",
+    0x09: "bin",
+    0x0B: "varint",
+    0x11: "int4",
+    0x12: "str",
+    0x13: "int2",
+    0x15: "str",
+    0x16: "bin",
+    0x17: "byte",
+    0x18: "int4",
+    0x19: "byte",
+    0x1A: "str",
+    0x1C: "str",
+    0x1F: "str",
+    0x21: "int2",
+    0x22: "int2",
+    0x23: "int2",
+    0x24: "byte",
+    0x25: "byte",
+    0x26: "pair",
+    0x27: "int4",
+    0x28: "byte",
+    0x29: "byte",
+    0x2A: "byte",
+}
+MESSAGE_EXPIRY_INTERVAL = 0x02
+SESSION_EXPIRY_INTERVAL = 0x11
+TOPIC_ALIAS_MAXIMUM = 0x22
+TOPIC_ALIAS = 0x23
+
+
+def encode_varint(value):
+    data = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        data.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(data)
+
+
+def encode_string(value):
+    value = value.encode("utf-8") if isinstance(value, str) else value
+    return struct.pack("!H", len(value)) + value
+
+
+def encode_packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + encode_varint(len(body)) + body
+
+
+class Reader:
+    """
+    Reads the fields of a packet body
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, length):
+        value = self.data[self.position : self.position + length]
+        self.position += length
+        return value
+
+    def byte(self):
+        return self.read(1)[0]
+
+    def int2(self):
+        return struct.unpack("!H", self.read(2))[0]
+
+    def int4(self):
+        return struct.unpack("!I", self.read(4))[0]
+
+    def varint(self):
+        value = multiplier = 0
+        while True:
+            byte = self.byte()
+            value += (byte & 0x7F) << (7 * multiplier)
+            multiplier += 1
+            if not byte & 0x80:
+                return value
+
+    def bin(self):
+        return self.read(self.int2())
+
+    def str(self):
+        return self.bin().decode("utf-8")
+
+    def properties(self):
+        properties = {}
+        end = self.varint() + self.position
+        while self.position < end:
+            identifier = self.varint()
+            property_type = PROPERTY_TYPES[identifier]
+            properties[identifier] = (self.str(), self.str()) if property_type == "pair" else getattr(self, property_type)()
+        return properties
+
+    def rest(self):
+        return self.read(len(self.data) - self.position)
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class Message:
+    def __init__(self, topic, payload, qos, retain, expiry):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        # Message Expiry Interval in seconds and the time the broker received the message
+        self.expiry = expiry
+        self.received_at = monotonic()
+
+    def remaining_expiry(self):
+        """
+        Returns the seconds until the message expires, None without expiry
+        """
+        if self.expiry is None:
+            return None
+        return self.expiry - int(monotonic() - self.received_at)
+
+
+class Session:
+    """
+    Subscriptions and undelivered QoS 1 messages of a client, kept after a disconnect, if the session is persistent
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        # topic filter -> QoS
+        self.subscriptions = {}
+        # QoS 1 messages sent without PUBACK: packet id -> Message
+        self.inflight = {}
+        # QoS 1 messages published while the client was disconnected
+        self.queued = []
+        self.packet_id = 0
+        self.persistent = False
+        self.connection = None
+
+    def next_packet_id(self):
+        self.packet_id = self.packet_id % 65535 + 1
+        return self.packet_id
+
+
+class Connection:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.protocol = 4
+        self.session = None
+        self.topic_alias_maximum = 0
+        # topic -> alias sent to the client
+        self.topic_aliases = {}
+        self.send_lock = threading.Lock()
+
+    def send(self, packet_type, flags, body):
+        packet = encode_packet(packet_type, flags, body)
+        with self.send_lock:
+            self.sock.sendall(packet)
+        self.broker.count_bytes(self.session.client_id if self.session else None, len(packet))
+
+    def properties(self, properties):
+        if self.protocol != 5:
+            return b""
+        body = bytearray()
+        for identifier, value in properties.items():
+            body += encode_varint(identifier)
+            property_type = PROPERTY_TYPES[identifier]
+            body += struct.pack("!H" if property_type == "int2" else "!I", value)
+        return encode_varint(len(body)) + bytes(body)
+
+    def send_publish(self, message, qos, packet_id=None, dup=False, retain=False):
+        remaining_expiry = message.remaining_expiry()
+        if remaining_expiry is not None and remaining_expiry <= 0:
+            return
+
+        properties = {}
+        topic = message.topic
+        if self.protocol == 5:
+            if remaining_expiry is not None:
+                properties[MESSAGE_EXPIRY_INTERVAL] = remaining_expiry
+            if topic in self.topic_aliases:
+                properties[TOPIC_ALIAS] = self.topic_aliases[topic]
+                topic = ""
+            elif len(self.topic_aliases) < self.topic_alias_maximum:
+                self.topic_aliases[topic] = properties[TOPIC_ALIAS] = len(self.topic_aliases) + 1
+
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack("!H", packet_id)
+        body += self.properties(properties) + message.payload
+        self.send(PUBLISH, (8 if dup else 0) | qos << 1 | (1 if retain else 0), body)
+
+    def run(self):
+        try:
+            while True:
+                header = self.sock.recv(1)
+                if not header:
+                    break
+                length = multiplier = 0
+                while True:
+                    byte = self.sock.recv(1)[0]
+                    length += (byte & 0x7F) << (7 * multiplier)
+                    multiplier += 1
+                    if not byte & 0x80:
+                        break
+                body = b""
+                while len(body) < length:
+                    chunk = self.sock.recv(length - len(body))
+                    if not chunk:
+                        raise ConnectionError("connection closed")
+                    body += chunk
+                if not self.handle(header[0] >> 4, header[0] & 0x0F, Reader(body)):
+                    break
+        except (OSError, IndexError):
+            pass
+        finally:
+            self.broker.disconnected(self)
+            self.sock.close()
+
+    def handle(self, packet_type, flags, reader):
+        """
+        Handle a packet of the client. Returns False, if the connection has to be closed
+        """
+        if packet_type == CONNECT:
+            reader.str()
+            self.protocol = reader.byte()
+            connect_flags = reader.byte()
+            reader.int2()
+            properties = reader.properties() if self.protocol == 5 else {}
+            client_id = reader.str()
+            self.topic_alias_maximum = properties.get(TOPIC_ALIAS_MAXIMUM, 0)
+            return self.broker.connect(self, client_id, clean=bool(connect_flags & 0x02), session_expiry=properties.get(SESSION_EXPIRY_INTERVAL))
+
+        if packet_type == PUBLISH:
+            qos = flags >> 1 & 0x03
+            topic = reader.str()
+            packet_id = reader.int2() if qos else None
+            properties = reader.properties() if self.protocol == 5 else {}
+            self.broker.publish(Message(topic, reader.rest(), qos, bool(flags & 0x01), properties.get(MESSAGE_EXPIRY_INTERVAL)))
+            if qos:
+                self.send(PUBACK, 0, struct.pack("!H", packet_id))
+
+        elif packet_type == PUBACK:
+            self.broker.acknowledged(self.session, reader.int2())
+
+        elif packet_type == SUBSCRIBE:
+            packet_id = reader.int2()
+            if self.protocol == 5:
+                reader.properties()
+            subscriptions = []
+            while reader.position < len(reader.data):
+                subscriptions.append((reader.str(), reader.byte() & 0x03))
+            self.send(SUBACK, 0, struct.pack("!H", packet_id) + self.properties({}) + bytes(min(qos, 1) for topic_filter, qos in subscriptions))
+            self.broker.subscribe(self, subscriptions)
+
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = reader.int2()
+            if self.protocol == 5:
+                reader.properties()
+            topic_filters = []
+            while reader.position < len(reader.data):
+                topic_filters.append(reader.str())
+            self.broker.unsubscribe(self.session, topic_filters)
+            self.send(UNSUBACK, 0, struct.pack("!H", packet_id) + (self.properties({}) + bytes(len(topic_filters)) if self.protocol == 5 else b""))
+
+        elif packet_type == PINGREQ:
+            self.send(PINGRESP, 0, b"")
+
+        elif packet_type == DISCONNECT:
+            return False
+
+        return True
+
+
+class Broker:
+    """
+    Broker listening on a free port of 127.0.0.1. Use it as context manager or call start() and stop()
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sessions = {}
+        self.retained = {}
+        self.connections = []
+        # client ID -> time until its connections are refused
+        self.refused_until = {}
+        # client ID -> bytes sent to the client
+        self.bytes_sent = {}
+        self.server = None
+        self.port = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def stop(self):
+        self.server.close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            self.close(connection)
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(self, sock)
+            with self.lock:
+                self.connections.append(connection)
+            threading.Thread(target=connection.run, daemon=True).start()
+
+    @staticmethod
+    def close(connection):
+        try:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def drop(self, client_id_prefix, seconds):
+        """
+        Close the connections of the clients with the ID prefix and refuse their reconnects for the seconds
+        """
+        with self.lock:
+            self.refused_until[client_id_prefix] = monotonic() + seconds
+            connections = [connection for connection in self.connections if connection.session and connection.session.client_id.startswith(client_id_prefix)]
+        for connection in connections:
+            self.close(connection)
+
+    def count_bytes(self, client_id, length):
+        with self.lock:
+            self.bytes_sent[client_id] = self.bytes_sent.get(client_id, 0) + length
+
+    def connect(self, connection, client_id, clean, session_expiry):
+        with self.lock:
+            for prefix, refused_until in self.refused_until.items():
+                if client_id.startswith(prefix) and monotonic() < refused_until:
+                    return False
+
+            session = self.sessions.get(client_id)
+            # a client connecting again takes over the session
+            if session is not None and session.connection is not None:
+                self.close(session.connection)
+                session.connection = None
+            session_present = session is not None and not clean
+            if not session_present:
+                session = self.sessions[client_id] = Session(client_id)
+
+            # MQTT 3.1.1 keeps the session without clean session, MQTT 5.0 only with a Session Expiry Interval
+            session.persistent = not clean if connection.protocol != 5 else bool(session_expiry)
+            session.connection = connection
+            connection.session = session
+
+            if connection.protocol == 5:
+                connection.send(CONNACK, 0, bytes([int(session_present), 0]) + connection.properties({}))
+            else:
+                connection.send(CONNACK, 0, bytes([int(session_present), 0]))
+
+            # send the messages the client missed, the ones sent without PUBACK again
+            for packet_id, message in session.inflight.items():
+                connection.send_publish(message, 1, packet_id, dup=True)
+            for message in session.queued:
+                self.deliver(session, message, 1)
+            session.queued = []
+
+        return True
+
+    def disconnected(self, connection):
+        with self.lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            session = connection.session
+            if session is None or session.connection is not connection:
+                return
+            session.connection = None
+            if not session.persistent:
+                del self.sessions[session.client_id]
+
+    def subscribe(self, connection, subscriptions):
+        with self.lock:
+            for topic_filter, qos in subscriptions:
+                connection.session.subscriptions[topic_filter] = min(qos, 1)
+                for message in self.retained.values():
+                    if topic_matches(topic_filter, message.topic):
+                        self.deliver(connection.session, message, min(qos, 1, message.qos), retain=True)
+
+    def unsubscribe(self, session, topic_filters):
+        with self.lock:
+            for topic_filter in topic_filters:
+                session.subscriptions.pop(topic_filter, None)
+
+    def publish(self, message):
+        with self.lock:
+            if message.retain:
+                self.retained[message.topic] = message
+
+            for session in self.sessions.values():
+                qos = max((qos for topic_filter, qos in session.subscriptions.items() if topic_matches(topic_filter, message.topic)), default=None)
+                if qos is None:
+                    continue
+                qos = min(qos, message.qos)
+                if session.connection is not None:
+                    self.deliver(session, message, qos)
+                elif qos and session.persistent:
+                    session.queued.append(message)
+
+    def deliver(self, session, message, qos, retain=False):
+        packet_id = None
+        if qos:
+            packet_id = session.next_packet_id()
+            session.inflight[packet_id] = message
+        try:
+            session.connection.send_publish(message, qos, packet_id, retain=retain)
+        except OSError:
+            pass
+
+    def acknowledged(self, session, packet_id):
+        with self.lock:
+            session.inflight.pop(packet_id, None)
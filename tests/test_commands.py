@@ -0,0 +1,178 @@
+"""
+Tests of the settings written on the dbus, which are published to the command topic of the EV charger
+"""
+
+import json
+from time import monotonic
+
+import pytest
+
+from conftest import TOPIC, Client
+
+COMMANDS = {";command_topic = {topic}/set": "command_topic = {topic}/set"}
+FLAT = {**COMMANDS, "topic_mode = json": "topic_mode = flat"}
+
+
+def create(ev_charger, replace=COMMANDS):
+    ev = ev_charger(replace)
+    ev.driver.mqtt_client = Client()
+    if ev.charger.topic_mode == "flat":
+        for path, payload in (("Ac/Power", b"0"), ("SetCurrent", b"6"), ("StartStop", b"0")):
+            ev.receive(payload, topic=TOPIC + "/" + path)
+    else:
+        ev.receive(b'{"Ac":{"Power":0},"SetCurrent":6,"StartStop":0}')
+    ev.glib.run_idle()
+    return ev
+
+
+def write(ev, path, value):
+    """
+    Write a value on the dbus from another process, e.g. the GUI
+    """
+    return ev.service._dbusservice._dbusobjects[path].SetValue(value)
+
+
+def get_command_timers(ev):
+    return [(interval, function) for interval, function, args in ev.glib.timeouts if function == ev.service._send_commands]
+
+
+def send_commands(ev):
+    interval, function = get_command_timers(ev)[-1]
+    assert function() is False
+
+
+def test_writes_are_coalesced(ev_charger):
+    ev = create(ev_charger)
+    for current in (7, 8, 9):
+        assert write(ev, "/SetCurrent", current) == 0
+
+    # one timer for all writes within command_coalesce_time
+    assert get_command_timers(ev) == [(300, ev.service._send_commands)]
+    assert ev.driver.mqtt_client.published == []
+
+    send_commands(ev)
+    assert ev.driver.mqtt_client.published == [("custom/ev-charger/set", '{"SetCurrent": 9}')]
+    assert ev.charger.command_stats["commands_sent"] == 1
+    assert ev.charger.commands_pending == {}
+
+    # the next write starts a new timer
+    write(ev, "/SetCurrent", 10)
+    assert len(get_command_timers(ev)) == 2
+
+
+def test_commands_are_published_as_one_json_payload(ev_charger):
+    ev = create(ev_charger)
+    write(ev, "/SetCurrent", 10)
+    write(ev, "/StartStop", 1)
+    send_commands(ev)
+
+    [(topic, payload)] = ev.driver.mqtt_client.published
+    assert topic == "custom/ev-charger/set"
+    assert json.loads(payload) == {"SetCurrent": 10, "StartStop": 1}
+    # all commands published together get the same ID
+    assert {command_id for value, written_at, command_id in ev.charger.commands_sent.values()} == {1}
+
+
+def test_commands_are_published_to_sub_topics_in_flat_topic_mode(ev_charger):
+    ev = create(ev_charger, FLAT)
+    write(ev, "/SetCurrent", 10)
+    write(ev, "/StartStop", 1)
+    send_commands(ev)
+
+    assert sorted(ev.driver.mqtt_client.published) == [("custom/ev-charger/set/SetCurrent", "10"), ("custom/ev-charger/set/StartStop", "1")]
+
+
+def test_own_commands_are_not_received_as_values_in_flat_topic_mode(ev_charger):
+    ev = create(ev_charger, FLAT)
+    write(ev, "/SetCurrent", 10)
+    send_commands(ev)
+
+    # the subscription <topic>/# matches the command topic <topic>/set, so the broker sends the commands back
+    for topic, payload in ev.driver.mqtt_client.published:
+        ev.receive(payload.encode("utf-8"), topic=topic)
+
+    assert ev.charger.stats["invalid_keys"] == 0
+    assert ev.value("/SetCurrent") == 6
+    assert "/SetCurrent" in ev.charger.commands_sent
+    assert ev.charger.command_stats["commands_acknowledged"] == 0
+
+
+def test_commands_are_not_published_without_command_topic(ev_charger):
+    ev = create(ev_charger, {})
+    assert write(ev, "/SetCurrent", 10) == 0
+    assert get_command_timers(ev) == []
+    assert ev.charger.commands_pending == {}
+
+
+def test_command_is_acknowledged(ev_charger):
+    ev = create(ev_charger)
+    write(ev, "/SetCurrent", 10)
+    send_commands(ev)
+
+    # a payload without the value doesn't acknowledge the command
+    ev.receive(b'{"Ac":{"Power":100},"SetCurrent":6,"StartStop":0}')
+    assert "/SetCurrent" in ev.charger.commands_sent
+
+    written_at = ev.charger.commands_sent["/SetCurrent"][1]
+    ev.receive(b'{"Ac":{"Power":200},"SetCurrent":10,"StartStop":0}', timestamp=written_at + 0.5)
+    assert ev.charger.commands_sent == {}
+    assert ev.charger.command_stats["commands_acknowledged"] == 1
+    assert ev.charger.command_latency.percentiles(50)[0] == pytest.approx(0.5)
+
+
+def test_command_not_acknowledged_is_reverted(ev_charger):
+    ev = create(ev_charger)
+    write(ev, "/SetCurrent", 10)
+    send_commands(ev)
+    assert ev.dbus["/SetCurrent"] == 10
+
+    # the EV charger keeps sending the old value
+    ev.receive(b'{"Ac":{"Power":100},"SetCurrent":6,"StartStop":0}')
+    ev.glib.run_idle()
+    ev.service._update()
+    assert ev.dbus["/SetCurrent"] == 10
+
+    value, written_at, command_id = ev.charger.commands_sent["/SetCurrent"]
+    ev.charger.commands_sent["/SetCurrent"] = (value, monotonic() - ev.driver.settings.command_timeout - 1, command_id)
+    ev.service._update()
+
+    assert ev.dbus["/SetCurrent"] == 6
+    assert ev.charger.commands_sent == {}
+    assert ev.charger.command_stats["commands_timed_out"] == 1
+
+
+def test_command_latency_percentiles_and_counters(ev_charger):
+    ev = create(ev_charger)
+    ev.service._update()
+    assert [ev.dbus[path] for path in ev.driver.COMMAND_LATENCY_PATHS] == [None, None, None]
+
+    # 100 commands acknowledged after 0.01 to 1 seconds
+    for i in range(1, 101):
+        current = 16 + i % 2
+        write(ev, "/SetCurrent", current)
+        send_commands(ev)
+        written_at = ev.charger.commands_sent["/SetCurrent"][1]
+        ev.receive(b'{"Ac":{"Power":%i},"SetCurrent":%i,"StartStop":0}' % (i, current), timestamp=written_at + i / 100)
+        ev.glib.run_idle()
+
+    # one command times out
+    write(ev, "/StartStop", 1)
+    send_commands(ev)
+    value, written_at, command_id = ev.charger.commands_sent["/StartStop"]
+    ev.charger.commands_sent["/StartStop"] = (value, monotonic() - ev.driver.settings.command_timeout - 1, command_id)
+    ev.service._update()
+
+    assert [ev.dbus[path] for path in ev.driver.COMMAND_LATENCY_PATHS] == [0.5, 0.95, 0.99]
+    assert ev.dbus["/Mgmt/Commands/Sent"] == 101
+    assert ev.dbus["/Mgmt/Commands/Acknowledged"] == 100
+    assert ev.dbus["/Mgmt/Commands/TimedOut"] == 1
+
+
+def test_percentiles_use_the_nearest_rank(load_driver):
+    driver = load_driver()
+    histogram = driver.LatencyHistogram(driver.COMMAND_LATENCY_BUCKETS)
+    assert histogram.percentiles(50, 95, 99) == (None, None, None)
+
+    for latency in (0.3, 0.1, 0.2):
+        histogram.observe(latency)
+    assert histogram.percentiles(50, 95, 99) == (0.2, 0.3, 0.3)
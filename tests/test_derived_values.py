@@ -0,0 +1,75 @@
+"""
+Tests of the values calculated from other values, if the EV charger doesn't send them
+"""
+
+from conftest import TOPIC
+
+FLAT = {"topic_mode = json": "topic_mode = flat"}
+
+
+def test_derived_values_follow_the_phases_of_the_last_payload(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"L1":{"Power":2300},"L2":{"Power":2300},"L3":{"Power":2300}}}')
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (6900, 10)
+
+    # switched to one phase, the power of L2 and L3 is no longer sent
+    ev.receive(b'{"Ac":{"L1":{"Power":2300}}}')
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (2300, 10)
+
+    ev.receive(b'{"Ac":{"L1":{"Power":2300},"L2":{"Power":2300},"L3":{"Power":2300}}}')
+    ev.receive(b'{"Ac":{"Power":2300,"L1":{"Power":2300}}}')
+    assert ev.value("/Current") == 10
+
+
+def test_derived_values_while_the_main_loop_publishes(ev_charger):
+    ev = ev_charger()
+    parse_json_payload = ev.charger.parse_json_payload
+
+    def parse_and_publish(*args):
+        parse_json_payload(*args)
+        # the GLib main loop published the changed paths meanwhile
+        ev.charger.dirty_paths.clear()
+
+    ev.charger.parse_json_payload = parse_and_publish
+    ev.receive(b'{"Ac":{"L1":{"Power":2300}}}')
+    assert ev.value("/Ac/Power") == 2300
+    assert ev.value("/Current") == 10
+
+
+def test_current_from_the_configured_phases(ev_charger):
+    ev = ev_charger({"phases = 0": "phases = 3"})
+    ev.receive(b'{"Ac":{"Power":6900}}')
+    assert ev.value("/Current") == 10
+
+
+def test_derived_values_in_flat_topic_mode(ev_charger):
+    ev = ev_charger(FLAT)
+    for phase in ("L1", "L2", "L3"):
+        ev.receive(b"2300", topic=TOPIC + "/Ac/%s/Power" % phase, timestamp=100)
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (6900, 10)
+
+
+def test_phases_not_received_anymore_in_flat_topic_mode(ev_charger):
+    ev = ev_charger(FLAT)
+    for phase in ("L1", "L2", "L3"):
+        ev.receive(b"2300", topic=TOPIC + "/Ac/%s/Power" % phase, timestamp=100)
+
+    # switched to one phase, L2 and L3 are not published anymore
+    ev.receive(b"2000", topic=TOPIC + "/Ac/L1/Power", timestamp=100 + ev.driver.settings.phase_timeout)
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (6600, 9.565)
+    ev.receive(b"2300", topic=TOPIC + "/Ac/L1/Power", timestamp=101 + ev.driver.settings.phase_timeout)
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (2300, 10)
+
+    # switched back to three phases
+    for phase in ("L2", "L3"):
+        ev.receive(b"2300", topic=TOPIC + "/Ac/%s/Power" % phase, timestamp=102 + ev.driver.settings.phase_timeout)
+    assert (ev.value("/Ac/Power"), ev.value("/Current")) == (6900, 10)
+
+
+def test_phases_are_kept_without_phase_timeout_in_flat_topic_mode(ev_charger):
+    ev = ev_charger(dict(FLAT, **{"phase_timeout = 30": "phase_timeout = 0"}))
+    for phase in ("L1", "L2", "L3"):
+        ev.receive(b"2300", topic=TOPIC + "/Ac/%s/Power" % phase, timestamp=100)
+
+    ev.receive(b"2000", topic=TOPIC + "/Ac/L1/Power", timestamp=1000)
+    assert ev.value("/Ac/Power") == 6600
@@ -0,0 +1,55 @@
+"""
+Tests of EV chargers discovered on a wildcard topic
+"""
+
+from conftest import TOPIC, Message, get_services
+
+DISCOVERY = {";[DISCOVERY]": "[DISCOVERY]", ";topic = custom/ev-charger/+": "topic = custom/ev-charger/+"}
+
+
+def test_discovered_charger_is_stale_after_the_timeout(load_driver):
+    driver = load_driver(DISCOVERY)
+    driver.discovery = driver.get_discovery_from_config(driver.chargers)
+    driver.on_message(None, None, Message(TOPIC + "/garage", b'{"Ac":{"Power":2300}}'))
+    driver.glib.run_idle()
+
+    charger = driver.chargers[0]
+    service = get_services(driver)[0]
+    charger.last_changed -= driver.settings.timeout + 1
+
+    # the timeout_mode is exit, but discovered EV chargers are kept until remove_after
+    assert service._update() is True
+    assert service._dbusservice["/Connected"] == 0
+    assert service._dbusservice["/Ac/Power"] is None
+
+
+def test_removed_charger_is_not_published(load_driver):
+    driver = load_driver(DISCOVERY)
+    driver.discovery = driver.get_discovery_from_config(driver.chargers)
+    driver.on_message(None, None, Message(TOPIC + "/garage", b'{"Ac":{"Power":2300}}'))
+    driver.glib.run_idle()
+
+    service = get_services(driver)[0]
+    driver.on_message(None, None, Message(TOPIC + "/garage", b'{"Ac":{"Power":1000}}'))
+    service._remove()
+    driver.glib.run_idle()
+    assert driver.chargers == []
+
+
+def test_discovered_chargers_get_free_device_instances(load_driver):
+    driver = load_driver(dict(DISCOVERY, **{";device_instance_last = 219": "device_instance_last = 201"}))
+    driver.discovery = driver.get_discovery_from_config(driver.chargers)
+    for name in ("garage", "carport", "street"):
+        driver.on_message(None, None, Message(TOPIC + "/" + name, b'{"Ac":{"Power":2300}}'))
+    driver.glib.run_idle()
+
+    assert [(charger.topic, charger.device_instance, charger.device_name) for charger in driver.chargers] == [
+        (TOPIC + "/garage", 200, "MQTT EV Charger garage"),
+        (TOPIC + "/carport", 201, "MQTT EV Charger carport"),
+    ]
+    assert driver.discovery.ignored_topics == {TOPIC + "/street"}
+
+    # the device instance of a removed EV charger is used again
+    get_services(driver)[0]._remove()
+    driver.on_message(None, None, Message(TOPIC + "/street", b'{"Ac":{"Power":2300}}'))
+    assert [(charger.topic, charger.device_instance) for charger in driver.chargers] == [(TOPIC + "/carport", 201), (TOPIC + "/street", 200)]
@@ -0,0 +1,124 @@
+"""
+Tests of the message handling from on_message until the values are written to the dbus and of the writes on the dbus
+"""
+
+from time import monotonic
+
+import pytest
+
+# maximum seconds from receiving a message in on_message until its values are written to the dbus
+LATENCY_TARGET = 0.05
+
+# unix time of the GX device in the source age tests
+NOW = 1700000000.0
+
+
+def test_message_is_published_without_waiting_for_the_timer(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":2300}}')
+
+    assert [function for function, args in ev.glib.idle] == [ev.service._publish]
+    ev.glib.run_idle()
+    assert ev.dbus["/Ac/Power"] == 2300
+    assert ev.dbus["/Current"] == 10
+
+
+def test_messages_are_coalesced_until_published(ev_charger):
+    ev = ev_charger()
+    for power in (1000, 2000, 3000):
+        ev.receive(b'{"Ac":{"Power":%i}}' % power)
+
+    assert len(ev.glib.idle) == 1
+    signals = len(ev.dbus.signals)
+    ev.glib.run_idle()
+    assert ev.dbus["/Ac/Power"] == 3000
+    assert len(ev.dbus.signals) == signals + 1
+
+
+def test_handoff_latency(ev_charger):
+    ev = ev_charger()
+    latencies = []
+    for power in range(1000, 1100):
+        received_at = monotonic()
+        ev.receive(b'{"Ac":{"Power":%i}}' % power, timestamp=received_at)
+        ev.glib.run_idle()
+        latencies.append(monotonic() - received_at)
+        assert ev.dbus["/Ac/Power"] == power
+
+    assert max(latencies) < LATENCY_TARGET
+    # the latency measured by the driver for /Latency
+    assert ev.charger.latency.percentiles(99)[0] < LATENCY_TARGET
+
+
+@pytest.mark.parametrize("timestamp", [NOW - 1.5, int((NOW - 1.5) * 1000)], ids=["seconds", "milliseconds"])
+def test_source_age(ev_charger, monkeypatch, timestamp):
+    ev = ev_charger()
+    monkeypatch.setattr(ev.driver, "time", lambda: NOW)
+    ev.receive(b'{"Ac":{"Power":2300},"Timestamp":%r}' % timestamp)
+
+    assert list(ev.charger.source_age.samples) == [1.5]
+    ev.service._update()
+    assert ev.dbus["/Mgmt/SourceAge"] == 1.5
+
+
+@pytest.mark.parametrize("timestamp", [b'"1700000000"', b"true", b"null", b"[1700000000]"])
+def test_invalid_source_timestamp_is_ignored(ev_charger, monkeypatch, caplog, timestamp):
+    ev = ev_charger()
+    monkeypatch.setattr(ev.driver, "time", lambda: NOW)
+    ev.receive(b'{"Ac":{"Power":2300},"Timestamp":%s}' % timestamp)
+
+    assert list(ev.charger.source_age.samples) == []
+    assert "is not a unix time" in caplog.text
+    # the Timestamp is no dbus path
+    assert ev.charger.stats["invalid_keys"] == 0
+    assert ev.value("/Ac/Power") == 2300
+    ev.service._update()
+    assert ev.dbus["/Mgmt/SourceAge"] is None
+
+
+def test_source_age_in_flat_topic_mode(ev_charger, monkeypatch):
+    ev = ev_charger({"topic_mode = json": "topic_mode = flat"})
+    monkeypatch.setattr(ev.driver, "time", lambda: NOW)
+    ev.receive(b"2300", topic=ev.charger.topic + "/Ac/Power")
+    ev.receive(b"%i" % ((NOW - 2) * 1000), topic=ev.charger.topic + "/Timestamp")
+
+    assert list(ev.charger.source_age.samples) == [2]
+    assert ev.charger.stats["invalid_keys"] == 0
+
+
+def test_source_age_is_the_median(ev_charger, monkeypatch):
+    ev = ev_charger()
+    monkeypatch.setattr(ev.driver, "time", lambda: NOW)
+    for power, age in enumerate((0.2, 5.0, 0.4, 0.3, 30.0)):
+        ev.receive(b'{"Ac":{"Power":%i},"Timestamp":%r}' % (power, NOW - age))
+
+    # the outliers of a delayed message don't change the median
+    ev.service._update()
+    assert ev.dbus["/Mgmt/SourceAge"] == 0.4
+
+
+def test_write_on_the_dbus_is_reverted_without_command_topic(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":2300},"SetCurrent":6}')
+    ev.glib.run_idle()
+
+    # written from another process, e.g. the GUI, but not sent to the EV charger
+    for path, value in (("/SetCurrent", 10), ("/Ac/Power", 0)):
+        assert ev.service._dbusservice._dbusobjects[path].SetValue(value) == 0
+        assert ev.dbus[path] == value
+
+    # the next message of the EV charger restores its values
+    ev.receive(b'{"Ac":{"Power":2300},"SetCurrent":6}')
+    ev.glib.run_idle()
+    assert ev.dbus["/SetCurrent"] == 6
+    assert ev.dbus["/Ac/Power"] == 2300
+
+
+def test_write_on_the_dbus_is_reverted_by_the_update(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":2300},"SetCurrent":6}')
+    ev.glib.run_idle()
+    ev.service._dbusservice._dbusobjects["/SetCurrent"].SetValue(10)
+
+    ev.service._update()
+    assert ev.dbus["/SetCurrent"] == 6
@@ -0,0 +1,71 @@
+"""
+Tests of the energy calculated from the power, if the EV charger doesn't send /Ac/Energy/Forward
+"""
+
+import json
+import os
+
+import pytest
+
+
+def receive_power(ev, power, timestamp):
+    ev.receive(b'{"Ac":{"Power":%i}}' % power, timestamp=timestamp)
+
+
+def test_energy_is_integrated_with_the_trapezoidal_rule(ev_charger):
+    ev = ev_charger()
+    receive_power(ev, 1000, 100)
+    receive_power(ev, 3000, 136)
+    receive_power(ev, 3000, 172)
+
+    # (1000 W + 3000 W) / 2 * 36 s + 3000 W * 36 s
+    assert ev.charger.energy_forward == pytest.approx(0.05)
+    assert ev.value("/Ac/Energy/Forward") == 0.05
+
+
+def test_energy_is_not_integrated_over_gaps_and_negative_power(ev_charger):
+    ev = ev_charger()
+    receive_power(ev, 3000, 100)
+    # longer than the timeout, the power in between is unknown
+    receive_power(ev, 3000, 100 + ev.driver.settings.timeout + 1)
+    receive_power(ev, -200, 300)
+    receive_power(ev, -200, 310)
+
+    assert ev.charger.energy_forward == 0
+
+
+def test_energy_of_the_ev_charger_is_used(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":3000,"Energy":{"Forward":12.5}}}', timestamp=100)
+    ev.receive(b'{"Ac":{"Power":3000,"Energy":{"Forward":12.5},"L1":{"Power":3000}}}', timestamp=136)
+
+    assert ev.charger.energy_forward == 0
+    assert ev.value("/Ac/Energy/Forward") == 12.5
+
+
+def test_energy_is_saved_and_loaded(ev_charger):
+    ev = ev_charger()
+    receive_power(ev, 3600, 100)
+    receive_power(ev, 3600, 110)
+    ev.charger.save_energy()
+
+    with open(ev.driver.get_energy_file(100)) as file:
+        assert json.load(file) == {"topic": "custom/ev-charger", "energy_forward": pytest.approx(0.01)}
+    assert not os.path.exists(ev.driver.get_energy_file(100) + ".tmp")
+
+    charger = ev.driver.EvCharger(**ev.driver.settings.chargers[0]._asdict())
+    assert charger.energy_forward == pytest.approx(0.01)
+    assert charger.values["/Ac/Energy/Forward"]["value"] == 0.01
+
+    # the saved energy belongs to another EV charger
+    charger = ev.driver.EvCharger(**ev.driver.settings.chargers[0]._replace(topic="custom/other")._asdict())
+    assert charger.energy_forward == 0
+
+
+def test_invalid_energy_file_is_ignored(load_driver):
+    driver = load_driver()
+    os.makedirs(driver.data_directory, exist_ok=True)
+    with open(driver.get_energy_file(100), "w") as file:
+        file.write('{"topic": "custom/ev-charger"')
+
+    assert driver.load_energy(100, "custom/ev-charger") == 0
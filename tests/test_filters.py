@@ -0,0 +1,77 @@
+"""
+Tests of the deadband and rounding filters of the [FILTER] section
+"""
+
+from time import time
+
+FILTER = {";[FILTER]": "[FILTER]", ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Power = absolute=5 relative=0.01 round=0"}
+
+
+def receive_power(ev, power):
+    ev.receive(b'{"Ac":{"Power":%s}}' % str(power).encode("utf-8"))
+    ev.glib.run_idle()
+
+
+def test_value_within_the_deadband_is_not_published(ev_charger):
+    ev = ev_charger(FILTER)
+    receive_power(ev, 1000)
+    assert ev.dbus["/Ac/Power"] == 1000
+
+    # 4 W is below the absolute and 8 W below the relative deadband of 1%
+    for power in (1004, 1008):
+        receive_power(ev, power)
+        assert ev.value("/Ac/Power") == power
+        assert ev.dbus["/Ac/Power"] == 1000
+
+    receive_power(ev, 1010)
+    assert ev.dbus["/Ac/Power"] == 1010
+
+
+def test_value_is_rounded(ev_charger):
+    ev = ev_charger(FILTER)
+    receive_power(ev, 1000.4)
+
+    assert ev.value("/Ac/Power") == 1000
+    assert type(ev.value("/Ac/Power")) is int
+    assert ev.dbus["/Ac/Power"] == 1000
+
+
+def test_value_within_the_deadband_is_published_after_max_silence(ev_charger):
+    ev = ev_charger(FILTER)
+    receive_power(ev, 1000)
+    receive_power(ev, 1004)
+    assert ev.service._update() is True
+    assert ev.dbus["/Ac/Power"] == 1000
+
+    # the last published value is older than max_silence
+    ev.charger.filter_references["/Ac/Power"] = (1000, time() - ev.driver.settings.filter_max_silence)
+    assert ev.service._update() is True
+    assert ev.dbus["/Ac/Power"] == 1004
+
+
+def test_unchanged_value_is_not_published_again_after_max_silence(ev_charger):
+    ev = ev_charger(FILTER)
+    receive_power(ev, 1000)
+    signals = len(ev.dbus.signals)
+
+    ev.charger.filter_references["/Ac/Power"] = (1000, time() - ev.driver.settings.filter_max_silence)
+    ev.service._update()
+    assert "/Ac/Power" not in ev.charger.dirty_paths
+    assert all("/Ac/Power" not in signal for signal in ev.dbus.signals[signals:])
+
+
+def test_changed_filter_is_applied_on_reload(ev_charger):
+    ev = ev_charger(FILTER)
+    receive_power(ev, 1000)
+    receive_power(ev, 1004)
+    assert ev.dbus["/Ac/Power"] == 1000
+
+    with open(ev.driver.config_file) as file:
+        config = file.read()
+    with open(ev.driver.config_file, "w") as file:
+        file.write(config.replace("/Ac/Power = absolute=5 relative=0.01 round=0", "/Ac/Power = absolute=1"))
+    ev.driver.reload_config()
+
+    assert ev.driver.settings.path_filters == {"/Ac/Power": ev.driver.PathFilter(absolute=1)}
+    receive_power(ev, 1005.5)
+    assert ev.dbus["/Ac/Power"] == 1005.5
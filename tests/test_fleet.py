@@ -0,0 +1,71 @@
+"""
+Tests of multiple EV chargers handled by one driver
+"""
+
+import pytest
+
+from conftest import TOPIC, Message, get_services, run_main
+
+# enables the commented [EV_CHARGER_<n>] sections of the config.sample.ini
+FLEET = {
+    ";" + line: line
+    for line in ("[EV_CHARGER_1]", "device_name = EV Charger Garage", "device_instance = 100", "topic = custom/ev-charger/garage")
+    + ("[EV_CHARGER_2]", "device_name = EV Charger Carport", "device_instance = 101", "topic = custom/ev-charger/carport")
+}
+
+
+def get_device_instances(driver):
+    return [service._charger.device_instance for service in get_services(driver)]
+
+
+def test_chargers_are_registered_without_waiting_for_the_others(load_driver, monkeypatch):
+    driver = load_driver(FLEET)
+    run_main(driver, monkeypatch, [(0, Message(TOPIC + "/garage", b'{"Ac":{"Power":2300}}'))])
+    assert get_device_instances(driver) == [100]
+
+    driver.on_message(None, None, Message(TOPIC + "/carport", b'{"Ac":{"Power":1000}}'))
+    driver.glib.run_idle()
+    assert get_device_instances(driver) == [100, 101]
+
+    # the first data is received only once
+    driver.on_message(None, None, Message(TOPIC + "/carport", b'{"Ac":{"Power":2000}}'))
+    driver.glib.run_idle()
+    assert get_device_instances(driver) == [100, 101]
+
+
+def test_startup_stops_if_no_charger_sent_data(load_driver, monkeypatch):
+    driver = load_driver(dict(FLEET, **{"timeout = 60": "timeout = 1"}))
+    with pytest.raises(SystemExit):
+        run_main(driver, monkeypatch)
+
+
+def test_startup_does_not_wait_in_stale_mode(load_driver, monkeypatch):
+    driver = load_driver({"timeout = 60": "timeout = 1", "timeout_mode = exit": "timeout_mode = stale"})
+    run_main(driver, monkeypatch)
+    assert get_device_instances(driver) == []
+
+    driver.on_message(None, None, Message(TOPIC, b'{"Ac":{"Power":2300}}'))
+    driver.glib.run_idle()
+    assert get_device_instances(driver) == [100]
+
+
+def test_timeout_of_one_charger_does_not_stop_the_others(load_driver, monkeypatch):
+    driver = load_driver(FLEET)
+    run_main(driver, monkeypatch, [(0, Message(TOPIC + "/garage", b'{"Ac":{"Power":2300}}')), (0, Message(TOPIC + "/carport", b'{"Ac":{"Power":1000}}'))])
+    garage, carport = get_services(driver)
+
+    # the timeout_mode is exit, but the other EV charger stays on the dbus
+    garage._charger.last_changed -= driver.settings.timeout + 1
+    assert garage._update() is True
+    assert carport._update() is True
+    assert (garage._dbusservice["/Connected"], garage._dbusservice["/Ac/Power"]) == (0, None)
+    assert (carport._dbusservice["/Connected"], carport._dbusservice["/Ac/Power"]) == (1, 1000)
+
+
+def test_timeout_stops_a_single_charger(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.charger.last_changed -= ev.driver.settings.timeout + 1
+
+    with pytest.raises(SystemExit):
+        ev.service._update()
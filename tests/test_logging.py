@@ -0,0 +1,102 @@
+"""
+Tests of the RateLimitedLogger, which limits the messages logged while processing the payloads
+"""
+
+import logging
+
+import pytest
+
+
+class Clock:
+    """
+    Replaces time() of the driver, the tests advance it
+    """
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def logger(load_driver, monkeypatch, caplog):
+    """
+    RateLimitedLogger with a window of 60 seconds and a fake clock
+    """
+    driver = load_driver()
+    clock = Clock()
+    monkeypatch.setattr(driver, "time", clock)
+    caplog.set_level(logging.WARNING)
+
+    logger = driver.RateLimitedLogger(60)
+    logger.clock = clock
+    return logger
+
+
+def get_messages(caplog):
+    messages = [record.getMessage() for record in caplog.records]
+    caplog.clear()
+    return messages
+
+
+def test_messages_are_suppressed_within_the_window(logger, caplog):
+    logger.warning(("invalid key", "Foo"), 'Received key "%s" is not valid', "/Foo")
+    logger.clock.now += 59
+    logger.warning(("invalid key", "Foo"), 'Received key "%s" is not valid', "/Foo")
+    # other keys are logged independently
+    logger.warning(("invalid key", "Bar"), 'Received key "%s" is not valid', "/Bar")
+
+    assert get_messages(caplog) == ['Received key "/Foo" is not valid', 'Received key "/Bar" is not valid']
+    assert logger.keys[("invalid key", "Foo")] == [logger.clock.now - 59, 1]
+
+
+def test_suppressed_messages_are_summarized_after_the_window(logger, caplog):
+    started = logger.clock.now
+    for seconds in (0, 20, 40, 59):
+        logger.clock.now = started + seconds
+        logger.warning("key", "Value %i is not valid", 5)
+    assert get_messages(caplog) == ["Value 5 is not valid"]
+
+    # 70 seconds after the first message, the 3 suppressed ones are summarized
+    logger.clock.now = started + 70
+    logger.warning("key", "Value %i is not valid", 6)
+    assert get_messages(caplog) == ["Value 6 is not valid (3 similar messages suppressed in the last 70 seconds)"]
+
+    # a new window starts without suppressed messages
+    logger.clock.now += 60
+    logger.warning("key", "Value %i is not valid", 7)
+    assert get_messages(caplog) == ["Value 7 is not valid"]
+
+
+def test_window_0_logs_all_messages(logger, caplog):
+    logger.window = 0
+    for _ in range(3):
+        logger.error("key", "Failed")
+
+    assert get_messages(caplog) == ["Failed"] * 3
+    assert logger.keys == {}
+
+
+def test_disabled_level_is_not_tracked(logger, caplog):
+    caplog.set_level(logging.ERROR)
+    logger.warning("key", "Not logged")
+
+    assert get_messages(caplog) == []
+    assert logger.keys == {}
+
+
+def test_keys_are_limited(logger, caplog):
+    for n in range(logger.MAX_KEYS):
+        logger.warning(("invalid key", n), "Key %i", n)
+    assert len(logger.keys) == logger.MAX_KEYS
+
+    # a further key starts tracking again, so the memory stays limited
+    logger.warning(("invalid key", logger.MAX_KEYS), "Key %i", logger.MAX_KEYS)
+    assert list(logger.keys) == [("invalid key", logger.MAX_KEYS)]
+
+    # the key after the limit is still suppressed within the window, the dropped keys are logged again
+    get_messages(caplog)
+    logger.warning(("invalid key", logger.MAX_KEYS), "Key %i", logger.MAX_KEYS)
+    logger.warning(("invalid key", 0), "Key %i", 0)
+    assert get_messages(caplog) == ["Key 0"]
@@ -0,0 +1,79 @@
+"""
+Tests of the metrics in the Prometheus text format
+"""
+
+import re
+import socket
+
+# a sample line: name, optional labels and the value
+SAMPLE = re.compile(r'^[a-z_]+(\{[a-z_]+="([^"\\]|\\.)*"(,[a-z_]+="([^"\\]|\\.)*")*\})? (-?[0-9.e+-]+|NaN|\+Inf)$')
+
+
+def test_render_format(load_driver):
+    driver = load_driver()
+    histogram = driver.LatencyHistogram((0.1, 1))
+    for latency in (0.05, 0.5, 2):
+        histogram.observe(latency)
+
+    registry = driver.MetricsRegistry("test_")
+    registry.add("messages_total", "counter", "Messages", lambda: [({"topic": 'a"b\\c\nd'}, 3)])
+    registry.add("power", "gauge", "Power", lambda: [({}, None), ({"phase": "L1"}, 1.5)])
+    registry.add("latency_seconds", "histogram", "Latency", lambda: [({"device_instance": 100}, histogram)])
+
+    assert registry.render() == (
+        "# HELP test_messages_total Messages\n"
+        "# TYPE test_messages_total counter\n"
+        'test_messages_total{topic="a\\"b\\\\c\\nd"} 3\n'
+        "# HELP test_power Power\n"
+        "# TYPE test_power gauge\n"
+        "test_power NaN\n"
+        'test_power{phase="L1"} 1.5\n'
+        "# HELP test_latency_seconds Latency\n"
+        "# TYPE test_latency_seconds histogram\n"
+        'test_latency_seconds_bucket{device_instance="100",le="0.1"} 1\n'
+        'test_latency_seconds_bucket{device_instance="100",le="1"} 2\n'
+        'test_latency_seconds_bucket{device_instance="100",le="+Inf"} 3\n'
+        'test_latency_seconds_sum{device_instance="100"} 2.55\n'
+        'test_latency_seconds_count{device_instance="100"} 3\n'
+    )
+
+
+def test_driver_metrics(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.glib.run_idle()
+
+    lines = ev.driver.get_metrics_registry().render().splitlines()
+    names = [line.split()[2] for line in lines if line.startswith("# TYPE ")]
+    assert len(names) == len(set(names)) == len([line for line in lines if line.startswith("# HELP ")])
+    assert all(SAMPLE.match(line) for line in lines if not line.startswith("#")), [line for line in lines if not line.startswith("#") and not SAMPLE.match(line)]
+
+    labels = '{device_instance="100",topic="custom/ev-charger"}'
+    assert "dbus_mqtt_ev_charger_mqtt_messages_received_total 1" in lines
+    assert "dbus_mqtt_ev_charger_messages_processed_total%s 1" % labels in lines
+    assert "dbus_mqtt_ev_charger_dbus_latency_seconds_count%s 1" % labels in lines
+    assert "dbus_mqtt_ev_charger_stale%s 0" % labels in lines
+
+
+def test_metrics_server_on_unix_socket(load_driver, tmp_path):
+    driver = load_driver()
+    path = str(tmp_path / "metrics.sock")
+    driver.start_metrics_server(path)
+
+    def get(url):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall(b"GET %s HTTP/1.0\r\n\r\n" % url)
+            response = b""
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    return response.decode("utf-8")
+                response += data
+
+    response = get(b"/metrics")
+    assert response.startswith("HTTP/1.0 200")
+    assert "Content-Type: text/plain; version=0.0.4; charset=utf-8" in response
+    assert "# TYPE dbus_mqtt_ev_charger_mqtt_connected gauge" in response
+
+    assert get(b"/other").startswith("HTTP/1.0 404")
@@ -0,0 +1,56 @@
+"""
+Tests of the topic aliases and the message age of MQTT 5.0 messages
+"""
+
+from types import SimpleNamespace
+
+from conftest import Client
+
+MESSAGE_AGE = {"message_expiry = 0": "message_expiry = 60", "message_max_age = 0": "message_max_age = 10"}
+
+
+def test_topic_alias_is_resolved(ev_charger):
+    ev = ev_charger()
+    # the first message with the alias contains the topic
+    ev.receive(b'{"Ac":{"Power":1000}}', properties=SimpleNamespace(TopicAlias=1))
+    assert ev.value("/Ac/Power") == 1000
+    assert ev.driver.topic_aliases == {1: "custom/ev-charger"}
+
+    ev.receive(b'{"Ac":{"Power":2000}}', topic="", properties=SimpleNamespace(TopicAlias=1))
+    assert ev.value("/Ac/Power") == 2000
+
+
+def test_unknown_topic_alias_is_dropped(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":1000}}')
+    ev.receive(b'{"Ac":{"Power":2000}}', topic="", properties=SimpleNamespace(TopicAlias=2))
+    assert ev.value("/Ac/Power") == 1000
+
+
+def test_topic_aliases_are_cleared_on_connect(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":1000}}', properties=SimpleNamespace(TopicAlias=1))
+
+    # the aliases are only valid for one connection
+    ev.driver.on_connect(Client(), None, None, 0, None)
+    assert ev.driver.topic_aliases == {}
+    ev.receive(b'{"Ac":{"Power":2000}}', topic="", properties=SimpleNamespace(TopicAlias=1))
+    assert ev.value("/Ac/Power") == 1000
+
+
+def test_message_older_than_max_age_is_dropped(ev_charger):
+    ev = ev_charger(MESSAGE_AGE)
+    # the message waited 15 seconds at the broker
+    ev.receive(b'{"Ac":{"Power":1000}}', properties=SimpleNamespace(MessageExpiryInterval=45))
+    assert ev.value("/Ac/Power") is None
+    assert ev.driver.mqtt_stats["messages_dropped_max_age"] == 1
+
+    ev.receive(b'{"Ac":{"Power":2000}}', properties=SimpleNamespace(MessageExpiryInterval=55))
+    assert ev.value("/Ac/Power") == 2000
+    assert ev.driver.mqtt_stats["messages_dropped_max_age"] == 1
+
+
+def test_message_age_is_not_checked_without_message_expiry(ev_charger):
+    ev = ev_charger({"message_max_age = 0": "message_max_age = 10"})
+    ev.receive(b'{"Ac":{"Power":1000}}', properties=SimpleNamespace(MessageExpiryInterval=1))
+    assert ev.value("/Ac/Power") == 1000
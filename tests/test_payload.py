@@ -0,0 +1,193 @@
+"""
+Tests of decoding the payload and storing its values
+"""
+
+import json
+import sys
+import types
+
+import pytest
+
+# encoders of the payload formats, the tests of a format are skipped, if its package is not installed
+ENCODERS = {
+    "json": lambda: json.dumps,
+    "msgpack": lambda: pytest.importorskip("msgpack").packb,
+    "cbor": lambda: pytest.importorskip("cbor2").dumps,
+}
+
+
+def test_parse_payload(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":7000,"Energy":{"Forward":12.5},"L1":{"Power":2300}},"Status":2,"Unknown":1}')
+    ev.glib.run_idle()
+
+    assert ev.dbus["/Ac/Power"] == 7000
+    assert ev.dbus["/Ac/Energy/Forward"] == 12.5
+    assert ev.dbus["/Ac/L1/Power"] == 2300
+    assert ev.dbus["/Status"] == 2
+    assert ev.charger.stats["invalid_keys"] == 1
+
+
+def test_parse_payload_with_invalid_values(ev_charger):
+    ev = ev_charger()
+    ev.receive(b'{"Ac":{"Power":7000,"L1":[2300],"Energy":{"Forward":{"Total":12.5}}},"Status":null}')
+
+    assert ev.value("/Ac/Power") == 7000
+    assert ev.value("/Ac/L1/Power") is None
+    assert ev.value("/Ac/Energy/Forward") is None
+    assert ev.value("/Status") is None
+    assert ev.charger.stats["invalid_keys"] == 3
+
+
+def test_compile_json_paths(load_driver):
+    driver = load_driver()
+    values = {"/Ac/Power": {"value": None}, "/Ac/L1/Power": {"value": None}, "/Status": {"value": None}}
+
+    tree = driver.compile_json_paths(values)
+    assert tree == {
+        "Ac": {"Power": ("/Ac/Power", values["/Ac/Power"]), "L1": {"Power": ("/Ac/L1/Power", values["/Ac/L1/Power"])}},
+        "Status": ("/Status", values["/Status"]),
+    }
+    assert (tree.path, tree["Ac"].path, tree["Ac"]["L1"].path) == ("", "/Ac", "/Ac/L1")
+
+
+def test_identical_payload_is_skipped(ev_charger):
+    ev = ev_charger()
+    # with the energy of the EV charger nothing is calculated, which would change between the messages
+    ev.receive(b'{"Ac":{"Power":2300,"Energy":{"Forward":12.5}}}')
+    ev.glib.run_idle()
+    signals = len(ev.dbus.signals)
+
+    ev.receive(b'{"Ac":{"Power":2300,"Energy":{"Forward":12.5}}}')
+    assert ev.glib.idle == []
+    assert ev.charger.stats["messages_processed"] == 1
+    assert ev.charger.stats["messages_skipped"] == 1
+    assert len(ev.dbus.signals) == signals
+
+
+def test_identical_payload_is_decoded_after_the_timeout(ev_charger):
+    ev = ev_charger({"timeout_mode = exit": "timeout_mode = stale"})
+    ev.receive(b'{"Ac":{"Power":2300,"Energy":{"Forward":12.5}}}')
+    ev.charger.mark_stale()
+
+    ev.receive(b'{"Ac":{"Power":2300,"Energy":{"Forward":12.5}}}')
+    assert ev.charger.stats["messages_processed"] == 2
+    assert ev.charger.stats["messages_skipped"] == 0
+    assert ev.value("/Ac/Power") == 2300
+
+
+@pytest.mark.parametrize("payload_format", ["msgpack", "cbor"])
+def test_binary_payload(ev_charger, payload_format):
+    encode = ENCODERS[payload_format]()
+    ev = ev_charger({"payload_format = json": "payload_format = " + payload_format})
+    ev.receive(encode({"Ac": {"Power": 7000, "L1": {"Power": 2300}}, "Status": 2}))
+
+    assert ev.value("/Ac/Power") == 7000
+    assert ev.value("/Ac/L1/Power") == 2300
+    assert ev.value("/Status") == 2
+
+
+@pytest.mark.parametrize("payload_format", ["json", "msgpack", "cbor"])
+def test_decode_payload_auto(load_driver, payload_format):
+    encode = ENCODERS[payload_format]()
+    driver = load_driver()
+    payload = encode({"Ac": {"Power": 7000}, "Model": "AC22E"})
+    if type(payload) is str:
+        payload = payload.encode("utf-8")
+
+    assert driver.decode_payload_auto(payload) == {"Ac": {"Power": 7000}, "Model": "AC22E"}
+
+
+def test_decode_payload_auto_without_decoder(load_driver):
+    driver = load_driver()
+    driver.payload_decoders.pop("msgpack", None)
+
+    # MessagePack fixmap with one entry
+    with pytest.raises(ValueError, match="msgpack"):
+        driver.decode_payload_auto(b"\x81\xa2Ac\x81\xa5Power\xcd\x1bX")
+
+
+def install_json_modules(monkeypatch, installed):
+    """
+    Install stubs of the optional JSON packages in installed, the others can't be imported
+    """
+    for name in ("orjson", "ujson"):
+        if name in installed:
+            module = types.ModuleType(name)
+            module.loads = lambda payload: json.loads(payload)
+            monkeypatch.setitem(sys.modules, name, module)
+        else:
+            # None in sys.modules makes the import raise an ImportError
+            monkeypatch.setitem(sys.modules, name, None)
+
+
+@pytest.mark.parametrize("installed, selected", [(("orjson", "ujson"), "orjson"), (("ujson",), "ujson"), ((), "json")])
+def test_select_json_decoder_auto(load_driver, monkeypatch, installed, selected):
+    driver = load_driver()
+    install_json_modules(monkeypatch, installed)
+
+    name, decoder = driver.select_json_decoder("auto")
+    assert name == selected
+    assert decoder is (json.loads if selected == "json" else sys.modules[selected].loads)
+
+
+@pytest.mark.parametrize("name", ["json", "ujson"])
+def test_select_json_decoder_by_name(load_driver, monkeypatch, name):
+    driver = load_driver()
+    install_json_modules(monkeypatch, ("orjson", "ujson"))
+
+    assert driver.select_json_decoder(name) == (name, json.loads if name == "json" else sys.modules[name].loads)
+
+
+def test_select_json_decoder_falls_back_to_json(load_driver, monkeypatch, caplog):
+    driver = load_driver()
+    install_json_modules(monkeypatch, ("ujson",))
+
+    assert driver.select_json_decoder("orjson") == ("json", json.loads)
+    assert 'JSON decoder "orjson" is not available' in caplog.text
+
+
+def test_invalid_binary_payload_is_not_stored(ev_charger):
+    ENCODERS["cbor"]()
+    ev = ev_charger({"payload_format = json": "payload_format = auto"})
+    # CBOR map with one entry, which is cut off
+    ev.receive(b"\xa1\x62Ac")
+
+    assert ev.value("/Ac/Power") is None
+    assert ev.charger.stats["messages_processed"] == 0
+
+
+@pytest.mark.parametrize("payload, value", [(b"2300", 2300), (b"-12.5", -12.5), (b"1e3", 1000.0), (b"AC22E", "AC22E")])
+def test_parse_flat_value(load_driver, payload, value):
+    driver = load_driver()
+    result = driver.parse_flat_value(payload)
+    assert (result, type(result)) == (value, type(value))
+
+
+@pytest.mark.parametrize("payload", [b"nan", b"NaN", b"inf", b"-inf", b"Infinity"])
+def test_parse_flat_value_rejects_non_finite_numbers(load_driver, payload):
+    driver = load_driver()
+    with pytest.raises(ValueError, match="not a finite number"):
+        driver.parse_flat_value(payload)
+
+
+@pytest.mark.parametrize("sub_topic", ["Ac/Power", "Timestamp"])
+def test_non_finite_flat_value_is_not_stored(ev_charger, sub_topic):
+    ev = ev_charger({"topic_mode = json": "topic_mode = flat"})
+    ev.receive(b"2300", topic=ev.charger.topic + "/Ac/Power")
+    ev.receive(b"nan", topic=ev.charger.topic + "/" + sub_topic)
+
+    assert ev.value("/Ac/Power") == 2300
+    assert list(ev.charger.source_age.samples) == []
+    assert ev.charger.stats["invalid_keys"] == 1
+
+
+def test_non_finite_json_value_is_not_stored(ev_charger):
+    # the JSON decoder of the standard library accepts NaN and Infinity
+    ev = ev_charger({"json_decoder = auto": "json_decoder = json"})
+    ev.receive(b'{"Ac":{"Power":2300,"L1":{"Power":NaN}},"Current":Infinity}')
+
+    assert ev.value("/Ac/Power") == 2300
+    assert ev.value("/Ac/L1/Power") is None
+    assert ev.value("/Current") is None
+    assert ev.charger.stats["invalid_keys"] == 2
@@ -0,0 +1,72 @@
+"""
+Tests of the delay between the reconnect attempts to the MQTT broker
+"""
+
+import pytest
+
+from conftest import Client
+
+
+@pytest.fixture
+def backoff(load_driver):
+    driver = load_driver({"reconnect_delay_min = 1": "reconnect_delay_min = 2", "reconnect_delay_max = 120": "reconnect_delay_max = 60"})
+    return driver.reconnect_backoff
+
+
+def test_delay_doubles_with_each_attempt(backoff, monkeypatch):
+    # without jitter the upper bound of the delay is used
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    client = Client()
+
+    delays = [backoff.schedule(client) for attempt in range(7)]
+    assert delays == [2, 4, 8, 16, 32, 60, 60]
+    assert backoff.attempts == 7
+    # paho waits the delay before its next attempt
+    assert client.reconnect_delay == (60, 60)
+
+
+def test_jitter_is_up_to_half_of_the_delay(backoff):
+    client = Client()
+    for attempt in range(20):
+        delay = backoff.schedule(client)
+        upper = min(backoff.max_delay, backoff.min_delay * 2**attempt)
+        assert max(backoff.min_delay, upper / 2) <= delay <= upper
+        assert client.reconnect_delay == (delay, delay)
+
+
+def test_connected_resets_the_delay_and_counts_the_reconnect(backoff, monkeypatch):
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    client = Client()
+
+    # the first connect is not a reconnect
+    assert backoff.connected() is None
+    assert backoff.stats["reconnects"] == 0
+
+    for reconnect in range(2):
+        backoff.disconnected()
+        for attempt in range(3):
+            backoff.schedule(client)
+        assert backoff.connected() >= 0
+
+    assert backoff.attempts == 0
+    assert backoff.schedule(client) == 2
+    assert backoff.stats["reconnects"] == 2
+    assert backoff.stats["reconnect_attempts"] == 6
+    assert backoff.stats["last_reconnect_attempts"] == 3
+    assert backoff.reconnected_at is not None
+
+    assert backoff.message_received() >= 0
+    assert backoff.reconnected_at is None
+    assert backoff.stats["last_reconnect_to_first_data_seconds"] is not None
+
+
+def test_disconnect_callback_schedules_the_reconnect(load_driver):
+    driver = load_driver()
+    client = Client()
+
+    driver.on_disconnect(client, None, None, 7, None)
+    driver.on_connect_fail(client, None)
+
+    assert driver.reconnect_backoff.attempts == 2
+    assert driver.reconnect_backoff.disconnected_at is not None
+    assert client.reconnect_delay[0] == client.reconnect_delay[1] >= driver.settings.reconnect_delay_min
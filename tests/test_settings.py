@@ -0,0 +1,134 @@
+"""
+Tests of the validation of the config.ini and of the settings applied on reload
+"""
+
+import signal
+
+import pytest
+from conftest import TOPIC, Message, get_services, run_main
+
+DISCOVERY = {";[DISCOVERY]": "[DISCOVERY]", ";topic = custom/ev-charger/+": "topic = custom/ev-charger/+"}
+FILTER = {";[FILTER]": "[FILTER]"}
+
+
+@pytest.mark.parametrize(
+    "replace",
+    [
+        {"voltage = 230": "voltage = 0"},
+        {"qos = 0": "qos = 3"},
+        {"stats_interval = 10": "stats_interval = -1"},
+        {"timeout_mode = exit": "timeout_mode = wait"},
+        # the last device instance of the discovery is lower than the first one
+        {**DISCOVERY, ";device_instance_last = 219": "device_instance_last = 199"},
+        {**DISCOVERY, ";device_instance_first = 200": "device_instance_first = -1"},
+        {**DISCOVERY, ";remove_after = 300": "remove_after = -1"},
+        {**FILTER, ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Power = absolute=five"},
+        {**FILTER, ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Power = absolute=-5"},
+        {**FILTER, ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Power = deadband=5"},
+        {**FILTER, ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Power = 5"},
+        {**FILTER, ";/Ac/Power = absolute=5 relative=0.01 round=0": "/Ac/Unknown = absolute=5"},
+        # the driver would receive its own commands
+        {";command_topic = {topic}/set": "command_topic = {topic}"},
+        {"payload_format = json": "payload_format = xml"},
+        {**DISCOVERY, ";remove_after = 300": "payload_format = yaml"},
+        {"broker_port = 1883": "broker_port = 0"},
+    ],
+)
+def test_invalid_settings(load_driver, monkeypatch, replace):
+    # the driver waits 60 seconds before it's restarted
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    with pytest.raises(SystemExit):
+        load_driver(replace)
+
+
+def test_discovery_settings(load_driver):
+    driver = load_driver({**DISCOVERY, ";device_instance_last = 219": "device_instance_last = 201", ";remove_after = 300": "remove_after = 0"})
+    discovery = driver.get_discovery_from_config(driver.chargers)
+
+    assert discovery.topic == "custom/ev-charger/+"
+    assert discovery.free_device_instances == [200, 201]
+    assert discovery.remove_after == 0
+
+
+def test_reload_keeps_settings_applied_on_restart(load_driver):
+    driver = load_driver()
+    with open(driver.config_file) as file:
+        config = file.read()
+    with open(driver.config_file, "w") as file:
+        file.write(config.replace("stats_interval = 10", "stats_interval = 5").replace("command_timeout = 10", "command_timeout = 3"))
+
+    driver.reload_config()
+    assert driver.settings.stats_interval == 10
+    assert driver.settings.command_timeout == 3
+
+
+def test_reload_keeps_discovery_settings(load_driver):
+    driver = load_driver(DISCOVERY)
+    with open(driver.config_file) as file:
+        config = file.read()
+    with open(driver.config_file, "w") as file:
+        file.write(config.replace("topic = custom/ev-charger/+", "topic = custom/wallbox/+"))
+
+    driver.reload_config()
+    assert driver.settings.discovery.topic == "custom/ev-charger/+"
+
+
+def reload_by_file_change(driver):
+    driver.config_monitor.changed()
+    # the config.ini is reloaded one second after the last change
+    interval, on_timeout, args = driver.glib.timeouts[-1]
+    assert interval == 1000
+    on_timeout(*args)
+
+
+@pytest.mark.parametrize(
+    "reload",
+    [lambda driver: driver.glib.signal_handlers[signal.SIGHUP](), reload_by_file_change],
+    ids=["sighup", "file change"],
+)
+def test_reload_subscribes_a_changed_topic_in_place(load_driver, monkeypatch, reload):
+    driver = load_driver({"broker_port = 1883": "broker_port = 8883", ";username = myuser": "username = myuser", ";password = mypassword": "password = mypassword"})
+    run_main(driver, monkeypatch, [(0, Message(TOPIC, b'{"Ac":{"Power":2300}}'))])
+    client = driver.mqtt_client
+    (service,) = get_services(driver)
+    assert (client.broker, client.credentials) == (("127.0.0.1", 8883), ("myuser", "mypassword"))
+    assert client.subscriptions == [([(TOPIC, 0)], 0)]
+
+    with open(driver.config_file) as file:
+        config = file.read()
+    with open(driver.config_file, "w") as file:
+        file.write(config.replace("\ntopic = custom/ev-charger\n", "\ntopic = custom/wallbox\n").replace("broker_port = 8883", "broker_port = 1884"))
+    reload(driver)
+
+    assert client.unsubscriptions == [TOPIC]
+    assert client.subscriptions[-1] == ("custom/wallbox", 0)
+    # the broker is only changed on a restart
+    assert driver.settings.mqtt_broker_port == 8883
+
+    # the dbus service and its values are kept
+    assert get_services(driver) == [service]
+    assert service._dbusservice["/Ac/Power"] == 2300
+    driver.on_message(None, None, Message(TOPIC, b'{"Ac":{"Power":1000}}'))
+    driver.on_message(None, None, Message("custom/wallbox", b'{"Ac":{"Power":3000}}'))
+    driver.glib.run_idle()
+    assert service._dbusservice["/Ac/Power"] == 3000
+
+
+def test_mqtt_connection_settings(load_driver, monkeypatch):
+    driver = load_driver(
+        {
+            "broker_port = 1883": "broker_port = 8883",
+            ";tls_enabled = 1": "tls_enabled = 1",
+            ";tls_insecure = 1": "tls_insecure = 0",
+            ";username = myuser": "username = myuser",
+            ";password = mypassword": "password = mypassword",
+        }
+    )
+
+    assert driver.settings.mqtt_broker_address == "127.0.0.1"
+    assert driver.settings.mqtt_broker_port == 8883
+    assert driver.settings.mqtt_tls_enabled
+    assert driver.settings.mqtt_tls_path_to_ca == ""
+    assert not driver.settings.mqtt_tls_insecure
+    assert (driver.settings.mqtt_username, driver.settings.mqtt_password) == ("myuser", "mypassword")
+    assert driver.settings.mqtt_client_id_instance == 100
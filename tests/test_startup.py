@@ -0,0 +1,78 @@
+"""
+Tests of the startup of the driver until the first values are on the dbus
+"""
+
+import os
+from time import monotonic
+
+from conftest import TOPIC, Message, get_services, run_main
+
+# seconds after connecting until the stubbed MQTT client delivers the first message
+FIRST_MESSAGE_DELAY = 0.2
+
+
+def test_first_values_are_published_right_after_the_first_message(load_driver, monkeypatch):
+    driver = load_driver()
+    started = monotonic()
+    run_main(driver, monkeypatch, [(FIRST_MESSAGE_DELAY, Message(TOPIC, b'{"Ac":{"Power":2300}}'))])
+
+    assert get_services(driver)[0]._dbusservice["/Ac/Power"] == 2300
+    assert monotonic() - started < FIRST_MESSAGE_DELAY + 0.5
+
+
+def test_retained_messages_are_ignored(load_driver, monkeypatch):
+    driver = load_driver({"retained_messages = 1": "retained_messages = 0", "timeout_mode = exit": "timeout_mode = stale"})
+    run_main(driver, monkeypatch, [(0, Message(TOPIC, b'{"Ac":{"Power":2300}}', retain=True))])
+    assert get_services(driver) == []
+
+    driver.on_message(None, None, Message(TOPIC, b'{"Ac":{"Power":1000}}'))
+    driver.glib.run_idle()
+    assert get_services(driver)[0]._dbusservice["/Ac/Power"] == 1000
+
+
+def count_portal_id_queries(driver, monkeypatch):
+    queries = []
+
+    def get_vrm_portal_id():
+        queries.append(True)
+        return "c0619ab12345"
+
+    monkeypatch.setattr(driver, "get_vrm_portal_id", get_vrm_portal_id)
+    return queries
+
+
+def test_portal_id_is_cached(load_driver, monkeypatch):
+    driver = load_driver()
+    queries = count_portal_id_queries(driver, monkeypatch)
+
+    assert driver.get_portal_id() == "c0619ab12345"
+    with open(os.path.join(driver.data_directory, "portal_id")) as file:
+        assert file.read() == "c0619ab12345"
+
+    # the next start doesn't run /sbin/get-unique-id
+    assert driver.get_portal_id() == "c0619ab12345"
+    assert len(queries) == 1
+
+
+def test_empty_portal_id_cache_is_ignored(load_driver, monkeypatch):
+    driver = load_driver()
+    queries = count_portal_id_queries(driver, monkeypatch)
+    os.makedirs(driver.data_directory, exist_ok=True)
+    with open(os.path.join(driver.data_directory, "portal_id"), "w") as file:
+        file.write("\n")
+
+    assert driver.get_portal_id() == "c0619ab12345"
+    assert len(queries) == 1
+
+
+def test_portal_id_without_writable_data_directory(load_driver, monkeypatch, tmp_path, caplog):
+    driver = load_driver()
+    queries = count_portal_id_queries(driver, monkeypatch)
+    # the data directory can't be created below a file
+    (tmp_path / "file").write_text("")
+    monkeypatch.setattr(driver, "data_directory", str(tmp_path / "file" / "data"))
+
+    assert driver.get_portal_id() == "c0619ab12345"
+    assert driver.get_portal_id() == "c0619ab12345"
+    assert len(queries) == 2
+    assert "Could not cache the VRM portal ID" in caplog.text
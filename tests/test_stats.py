@@ -0,0 +1,99 @@
+"""
+Tests of the driver statistics under /Mgmt/Stats
+"""
+
+from itertools import count
+
+import pytest
+
+
+def decode_in_20_us(ev, monkeypatch):
+    """
+    Each decoding measured by the stats update takes 20 µs
+    """
+    clock = count(0, 0.00002)
+    monkeypatch.setattr(ev.driver, "perf_counter", lambda: next(clock))
+
+
+STATS_PATHS = (
+    "/Mgmt/Stats/MessagesPerSecond",
+    "/Mgmt/Stats/DecodeTime",
+    "/Mgmt/Stats/LastMessageAge",
+    "/Mgmt/Stats/MessagesSkipped",
+    "/Mgmt/Stats/MessagesDropped",
+    "/Mgmt/Stats/InvalidKeys",
+    "/Mgmt/Stats/Reconnects",
+    "/Mgmt/Stats/DbusSignals",
+)
+
+
+def test_stats_are_written_as_one_signal(ev_charger):
+    ev = ev_charger()
+    assert (10000, ev.service._update_stats, ()) in ev.glib.timeouts
+
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.receive(b'{"Ac":{"Power":2300},"Invalid":1}')
+    ev.glib.run_idle()
+    signals = len(ev.dbus.signals)
+    dbus_signals = ev.charger.stats["dbus_signals"]
+
+    assert ev.service._update_stats() is True
+    assert len(ev.dbus.signals) == signals + 1
+    assert set(ev.dbus.signals[-1]) <= set(STATS_PATHS)
+    assert ev.charger.stats["dbus_signals"] == dbus_signals + 1
+    assert ev.dbus["/Mgmt/Stats/LastMessageAge"] == 0
+    assert ev.dbus["/Mgmt/Stats/MessagesSkipped"] == 1
+    assert ev.dbus["/Mgmt/Stats/InvalidKeys"] == 1
+    # the rates need a previous update
+    assert ev.dbus["/Mgmt/Stats/MessagesPerSecond"] is None
+
+
+def test_idle_update_only_counts_the_last_signal(ev_charger, monkeypatch):
+    ev = ev_charger()
+    decode_in_20_us(ev, monkeypatch)
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.glib.run_idle()
+    ev.service._update_stats()
+    ev.service._update_stats()
+    signals = len(ev.dbus.signals)
+
+    # the signal of the last update is the only change
+    ev.service._update_stats()
+    assert ev.dbus.signals[signals:] == [{"/Mgmt/Stats/DbusSignals": {"Value": ev.charger.stats["dbus_signals"] - 1}}]
+
+
+def test_rates_since_the_last_update(ev_charger, monkeypatch):
+    ev = ev_charger()
+    decode_in_20_us(ev, monkeypatch)
+    ev.receive(b'{"Ac":{"Power":2300}}')
+    ev.service._update_stats()
+
+    for power in range(1000, 1005):
+        ev.receive(b'{"Ac":{"Power":%i}}' % power)
+    # the last update was 2 seconds ago
+    last_time, *last_values = ev.service._stats_last
+    ev.service._stats_last = (last_time - 2, *last_values)
+    ev.service._update_stats()
+
+    assert ev.dbus["/Mgmt/Stats/MessagesPerSecond"] == pytest.approx(2.5, abs=0.1)
+    # the last payload is decoded again by each update
+    assert ev.dbus["/Mgmt/Stats/DecodeTime"] == pytest.approx(20, abs=0.1)
+    assert ev.charger.decode_time.snapshot()[2] == 2
+
+
+def test_stats_are_disabled(ev_charger):
+    ev = ev_charger({"stats_interval = 10": "stats_interval = 0"})
+    assert all(path not in ev.dbus for path in STATS_PATHS)
+    assert all(function != ev.service._update_stats for interval, function, args in ev.glib.timeouts)
+
+
+def test_decode_time_is_measured_by_the_update_only(ev_charger):
+    ev = ev_charger()
+    for power in range(1000, 1020):
+        ev.receive(b'{"Ac":{"Power":%i}}' % power)
+    assert ev.charger.decode_time.snapshot()[2] == 0
+
+    ev.service._update_stats()
+    assert ev.charger.decode_time.snapshot()[2] == 1
+    assert ev.dbus["/Mgmt/Stats/DecodeTime"] > 0
@@ -0,0 +1,39 @@
+"""
+Tests of the timeout_mode = stale, which keeps the driver running after the timeout
+"""
+
+from conftest import TOPIC
+
+STALE = {"timeout_mode = exit": "timeout_mode = stale"}
+
+
+def test_stale_after_the_timeout(ev_charger):
+    ev = ev_charger(STALE)
+    ev.receive(b'{"Ac":{"Power":2300,"L1":{"Power":2300}},"Status":2}')
+    ev.glib.run_idle()
+
+    ev.charger.last_changed -= ev.driver.settings.timeout + 1
+    assert ev.service._update() is True
+    assert ev.charger.stale
+    assert ev.dbus["/Connected"] == 0
+    assert (ev.dbus["/Ac/Power"], ev.dbus["/Ac/L1/Power"], ev.dbus["/Current"]) == (None, None, None)
+    # only the measured values are invalidated
+    assert ev.dbus["/Status"] == 2
+
+    ev.receive(b'{"Ac":{"Power":1000}}')
+    ev.glib.run_idle()
+    assert not ev.charger.stale
+    assert (ev.dbus["/Connected"], ev.dbus["/Ac/Power"]) == (1, 1000)
+
+
+def test_stale_charger_without_power(ev_charger):
+    ev = ev_charger({"timeout_mode = exit": "timeout_mode = stale", "topic_mode = json": "topic_mode = flat"})
+    ev.receive(b"2300", topic=TOPIC + "/Ac/Power")
+    ev.glib.run_idle()
+
+    ev.charger.mark_stale()
+    ev.receive(b"2", topic=TOPIC + "/Status")
+    assert ev.service._update() is True
+    ev.glib.run_idle()
+    assert ev.dbus["/Ac/Power"] is None
+    assert ev.dbus["/Status"] == 2